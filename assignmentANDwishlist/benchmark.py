@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark against local fake mail servers (santa_fake_servers.py), no Gmail account needed.
+
+For each group size it runs the three steps of a real round: setup_secret_santa (matching + wishlist requests),
+check_wishlists (every participant has replied) and send_assignments, then reports emails per second for each
+step, where the time went (connect, fetch, parse, render, state-write, send) and the peak memory.
+
+    python benchmark.py                  # 10, 1000, 10000 and 100000 participants
+    python benchmark.py 10 1000          # just these sizes
+    python benchmark.py 1000 --concurrent
+    python benchmark.py --startup        # how fast status.py starts
+
+Each size runs in its own process in a scratch directory, so peak memory is per size and nothing touches your own
+email_auth.json or game state.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from santa_fake_servers import FakeIMAPServer, FakeSMTPServer
+
+SIZES = [10, 1000, 10000, 100000]
+PHASES = ['connect', 'fetch', 'parse', 'render', 'state-write', 'send', 'other']
+# Cold starts of status.py to time, and the modules it has no business loading
+STARTUP_RUNS = 20
+NETWORK_MODULES = ('smtplib', 'imaplib', 'ssl', 'asyncio', 'email.message')
+
+
+class PhaseTimer:
+    """
+    Splits wall time between phases by wrapping the functions that do each kind of work. Time is exclusive: while
+    a wrapped function calls another (a fetch that parses), only the innermost one's phase is counting.
+    """
+
+    def __init__(self):
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.stack = []  # [phase, started] of each wrapped call in progress
+
+    def wrap(self, owner, name, phase):
+        """
+        Replace owner.name with a version that counts its time against phase.
+        :param owner: module or class
+        :param name: attribute to wrap
+        :param phase: one of PHASES
+        :return: None
+        """
+        original = getattr(owner, name)
+
+        def timed(*args, **kwargs):
+            now = time.perf_counter()
+            if self.stack:
+                self.totals[self.stack[-1][0]] += now - self.stack[-1][1]
+            self.stack.append([phase, now])
+            try:
+                return original(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                done, started = self.stack.pop()
+                self.totals[done] += end - started
+                if self.stack:
+                    self.stack[-1][1] = end
+
+        setattr(owner, name, timed)
+
+
+def instrument(timer):
+    """
+    Wrap the mail, parsing and state functions of this project so their time is counted.
+    :param timer: PhaseTimer
+    :return: None
+    """
+    import imaplib
+    import santa_inbox
+    from santa_mail import MailSession
+    from santa_store import StateStore
+    from santa_templates import MessageTemplate
+
+    timer.wrap(santa_inbox, 'connect_inbox', 'connect')
+    timer.wrap(MailSession, 'open', 'connect')
+    # every IMAP command after login: SELECT, SEARCH, FETCH and STORE
+    timer.wrap(imaplib.IMAP4, 'select', 'fetch')
+    timer.wrap(imaplib.IMAP4, 'uid', 'fetch')
+    for name in ('parse_fetch_response', 'find_text_part', 'decode_part'):
+        timer.wrap(santa_inbox, name, 'parse')
+    for name in ('reset', 'import_json', 'record_wishlist', 'set_meta', 'plan_messages', 'dequeue_ready',
+                 'claim', 'mark_sent', 'mark_failed', 'mark_deferred', 'defer_until', 'count_sent',
+                 'fill_quota'):
+        timer.wrap(StateStore, name, 'state-write')
+    # called from inside plan_messages() as the outbox reads the batch
+    timer.wrap(MessageTemplate, 'render', 'render')
+    timer.wrap(MailSession, 'send_message', 'send')
+
+
+def run_size(size, smtp_port, imap_port, concurrent=False):
+    """
+    Play one round with size participants against the fake servers, in the current (scratch) directory.
+    :param size: number of participants
+    :param smtp_port: port of the running FakeSMTPServer
+    :param imap_port: port of the running FakeIMAPServer, already seeded with everyone's reply
+    :param concurrent: send over several connections at once
+    :return: dictionary with the wall time of each step, total time, time per phase and peak memory in MB
+    """
+    with open('email_auth.json', 'w') as f:
+        json.dump({
+            'gmail_username': 'santa@bench.test', 'gmail_app_password': 'bench',
+            'per_day': 10 ** 9, 'per_minute': 10 ** 9,
+            'smtp_host': '127.0.0.1', 'smtp_port': smtp_port, 'smtp_starttls': False,
+            'imap_host': '127.0.0.1', 'imap_port': imap_port, 'imap_ssl': False,
+        }, f)
+    timer = PhaseTimer()
+    instrument(timer)
+    import santa_wishlist_gated as gated
+
+    participants = {f'p{i:06d}': {'email': f'p{i:06d}@bench.test'} for i in range(size)}
+    steps = [
+        ('setup', lambda: gated.setup_secret_santa(dry_run=False, participants=participants,
+                                                   concurrent=concurrent)),
+        ('collect', lambda: gated.check_wishlists(dry_run=False)),
+        ('send', lambda: gated.send_assignments(dry_run=False, concurrent=concurrent)),
+    ]
+    wall = {}
+    with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+        started = time.perf_counter()
+        for step, run in steps:
+            step_started = time.perf_counter()
+            run()
+            wall[step] = time.perf_counter() - step_started
+        total = time.perf_counter() - started
+    timer.totals['other'] = total - sum(timer.totals.values())
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return {'size': size, 'wall': wall, 'total': total, 'phases': timer.totals, 'peak_rss_mb': peak / 1024}
+
+
+def benchmark(size, smtp, imap, concurrent=False):
+    """
+    Seed the fake inbox and run one size in a fresh process and scratch directory.
+    :param size: number of participants
+    :param smtp: running FakeSMTPServer
+    :param imap: running FakeIMAPServer
+    :param concurrent: send over several connections at once
+    :return: dictionary of results from run_size()
+    """
+    imap.seed((f'p{i:06d}@bench.test', f"Wishlist number {i}: socks, a good book and chocolate")
+              for i in range(size))
+    smtp.reset()
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as scratch:
+        command = [sys.executable, os.path.join(here, 'benchmark.py'), '--child', str(size),
+                   str(smtp.port), str(imap.port)] + (['--concurrent'] if concurrent else [])
+        output = subprocess.run(command, cwd=scratch, stdout=subprocess.PIPE, check=True).stdout
+    result = json.loads(output.decode().splitlines()[-1])
+    if smtp.messages != 2 * size:
+        print(f"⚠️  expected {2 * size} emails at the SMTP server, it got {smtp.messages}")
+    return result
+
+
+def print_result(result):
+    size = result['size']
+    print(f"\n👥 {size} participants: {result['total']:.2f}s, peak memory {result['peak_rss_mb']:.0f} MB")
+    for step, seconds in result['wall'].items():
+        print(f"   {step:<8} {seconds:8.2f}s  {size / seconds if seconds else 0:10.0f} emails/s")
+    split = '  '.join(f"{phase} {result['phases'][phase] / result['total']:.0%}" for phase in PHASES)
+    print(f"   time: {split}")
+
+
+def startup(runs=STARTUP_RUNS, size=1000):
+    """
+    Time status.py from a cold start, in a scratch directory holding a game of size participants and no
+    email_auth.json, next to a bare Python start for comparison.
+    :param runs: cold starts to time, the median is reported
+    :param size: participants in the game
+    :return: None
+    """
+    from santa_wishlist_gated import save_game_state
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    names = [f'p{i:06d}' for i in range(size)]
+    with tempfile.TemporaryDirectory() as scratch, open(os.devnull, 'w') as quiet:
+        with redirect_stdout(quiet):
+            save_game_state(list(zip(names, names[1:] + names[:1])), {name: {'email': f'{name}@bench.test'}
+                                                                     for name in names},
+                            filename=os.path.join(scratch, 'santa_game_state.json'))
+
+        def median_ms(command):
+            times = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                subprocess.run(command, cwd=scratch, stdout=quiet, check=True)
+                times.append(time.perf_counter() - started)
+            return sorted(times)[len(times) // 2] * 1000
+
+        status = median_ms([sys.executable, os.path.join(here, 'status.py')])
+        bare = median_ms([sys.executable, '-c', 'pass'])
+        check = (f"import runpy, sys; runpy.run_path({os.path.join(here, 'status.py')!r}, run_name='__main__'); "
+                 f"print(' '.join(m for m in {NETWORK_MODULES!r} if m in sys.modules), file=sys.stderr)")
+        loaded = subprocess.run([sys.executable, '-c', check], cwd=scratch, stdout=quiet, stderr=subprocess.PIPE,
+                                env=dict(os.environ, PYTHONPATH=here), check=True).stderr.decode().split()
+    print(f"\n⏱️  status.py cold start ({size} participants, no email_auth.json): {status:.0f} ms median of {runs}, "
+          f"{status - bare:.0f} ms more than starting Python")
+    if loaded:
+        print(f"   ⚠️  it loaded mail modules it doesn't need: {', '.join(loaded)}")
+    else:
+        print("   no mail modules loaded")
+
+
+def main(args):
+    if '--startup' in args:
+        startup()
+        return
+    concurrent = '--concurrent' in args
+    sizes = [int(arg) for arg in args if arg.isdigit()] or SIZES
+    with FakeSMTPServer() as smtp, FakeIMAPServer() as imap:
+        for size in sizes:
+            print_result(benchmark(size, smtp, imap, concurrent=concurrent))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        size, smtp_port, imap_port = map(int, sys.argv[2:5])
+        print(json.dumps(run_size(size, smtp_port, imap_port, concurrent='--concurrent' in sys.argv)))
+    else:
+        main(sys.argv[1:])
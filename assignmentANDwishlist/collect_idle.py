@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Collect wishlists as they arrive, instead of running collect_safe.py every day.
+Keeps one IMAP connection open and uses IDLE so Gmail tells us about new replies within seconds.
+Like collect_safe.py, this never shows assignments. Stop it with Ctrl+C.
+
+    python collect_idle.py          # collect only
+    python collect_idle.py --send   # also send each assignment or late wishlist update the moment it's due
+"""
+import imaplib
+import random
+import sys
+import time
+
+from santa_inbox import connect_inbox, idle_wait, close_inbox, IDLE_TIMEOUT
+from santa_config import mail_config
+from santa_dispatch import Dispatcher
+from santa_wishlist_gated import collect_wishlists, load_game_state
+
+MAX_BACKOFF = 5 * 60
+
+
+def run_collector(game_state_file="santa_game_state.json", idle_timeout=IDLE_TIMEOUT, max_backoff=MAX_BACKOFF,
+                  dispatch=False):
+    """
+    Collect wishlists forever over one long-lived IMAP connection.
+    Each time the server reports new mail, only the messages after the saved checkpoint are processed. IDLE is
+    renewed every idle_timeout seconds, and a dropped connection is re-opened with exponential backoff.
+
+    :param game_state_file: path to game state JSON
+    :param idle_timeout: seconds before IDLE is renewed, must be below the server's 30 minute limit
+    :param max_backoff: longest wait in seconds between reconnection attempts
+    :param dispatch: if True, send the emails each wishlist makes due as soon as it's saved, over one SMTP login
+        kept for the whole run (see santa_dispatch)
+    :return: None
+    """
+    config = mail_config()
+    # when dispatching, the SMTP logins are kept across IMAP reconnects, each re-opened by itself if it drops
+    with Dispatcher() as dispatcher:
+        on_wishlist = dispatcher.on_wishlist if dispatch else None
+        backoff = 1
+        while True:
+            mail = None
+            try:
+                mail = connect_inbox(config.username, config.password, **config.inbox_options)
+                print("📬 Connected. Waiting for wishlists... (Ctrl+C to stop)\n")
+                new_mail = True  # catch up on anything that arrived while we weren't connected
+                while True:
+                    if new_mail:
+                        game_state = load_game_state(game_state_file)
+                        if not game_state:
+                            return
+                        collect_wishlists(mail, game_state, dry_run=False, game_state_file=game_state_file,
+                                          on_wishlist=on_wishlist)
+                        received = sum(1 for p in game_state['participants'].values() if p['wishlist_received'])
+                        print(f"   Wishlists received: {received}/{len(game_state['participants'])}")
+                    new_mail = idle_wait(mail, timeout=idle_timeout)
+                    # a full IDLE round trip means the connection is healthy again
+                    backoff = 1
+            except (imaplib.IMAP4.abort, imaplib.IMAP4.error, OSError) as e:
+                wait = backoff + random.uniform(0, backoff / 2)
+                print(f"⚠️  Connection problem ({e}). Reconnecting in {wait:.0f}s...")
+            except KeyboardInterrupt:
+                print("\nStopped collecting. Run 'python status.py' to see details")
+                return
+            finally:
+                # however we leave, including when the game state can't be loaded
+                if mail is not None:
+                    close_inbox(mail)
+            time.sleep(wait)
+            backoff = min(backoff * 2, max_backoff)
+
+
+if __name__ == '__main__':
+    run_collector(dispatch='--send' in sys.argv)
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 """
 Safely collect wishlists without showing assignments.
+Run with --send to also send each assignment or late wishlist update a new wishlist makes due, over one login.
 """
+import sys
+
+from santa_dispatch import Dispatcher
 from santa_wishlist_gated import check_wishlists, load_game_state
 
 print("Collecting wishlists from Gmail...\n")
 
 # Collect wishlists
-game_state = check_wishlists(dry_run=False)
+with Dispatcher() as dispatcher:
+    game_state = check_wishlists(dry_run=False, on_wishlist=dispatcher.on_wishlist if '--send' in sys.argv else None)
 
 if game_state:
     # Count without showing names
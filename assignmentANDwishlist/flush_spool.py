@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Send the emails waiting in the spool.
+With "transport": "spool" in email_auth.json the other scripts write their emails to outgoing_mail/ instead of
+sending them. This sends them all over SMTP, shared across every account in email_auth.json and within their daily
+limits. Run it again to send whatever didn't go.
+"""
+import time
+
+from santa_async import make_accounts, print_report, QUOTA_WINDOW
+from santa_store import StateStore, game_exists
+from santa_transport import flush_spool, spooled, transport_from_config, SPOOL_DIR
+from santa_config import mail_config
+
+
+def flush(directory):
+    """
+    Send the spool over SMTP, counting what goes against each account's daily limit if there is a game to keep
+    the count in.
+    :param directory: spool directory
+    :return: None
+    """
+    config = mail_config()
+    smtp, options = transport_from_config(dict(config.email_auth, transport='smtp'))
+    store = StateStore.open() if game_exists() else None
+    used = {}
+    if store is not None:
+        used = {account: sent for account, (sent, _) in store.quota_usage(time.time(), QUOTA_WINDOW).items()}
+
+    def count(path, result):
+        if store is not None and result['status'] == 'sent':
+            store.count_sent(result['account'], time.time(), QUOTA_WINDOW)
+
+    try:
+        report = flush_spool(make_accounts(config.accounts, used=used, session_class=smtp, **options), directory,
+                             on_result=count)
+    finally:
+        if store is not None:
+            store.close()
+    print_report(report)
+
+
+if __name__ == '__main__':
+    directory = mail_config().email_auth.get('spool_dir', SPOOL_DIR)
+    waiting = len(spooled(directory))
+    print(f"{waiting} email(s) waiting in {directory}/new")
+    if waiting:
+        flush(directory)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Force send Secret Santa assignments, even if some people haven't responded.
+For people who didn't send wishlists, includes a note in the assignment email.
+NO SPOILERS - Keeps assignments secret from you!
+"""
+
+from santa_outbox import plan_batch, deliver
+from santa_store import StateStore
+from santa_templates import load as load_template
+from santa_wishlist_gated import load_game_state, sending_accounts, sender_domain
+
+def force_send_assignments(dry_run=True):
+    """
+    Send assignments to EVERYONE, even if their recipient didn't submit wishlist.
+    """
+    # Load game state
+    game_state = load_game_state()
+    if not game_state:
+        return
+    
+    # Count status
+    total = len(game_state['participants'])
+    received = sum(1 for p in game_state['participants'].values() if p['wishlist_received'])
+    
+    print("=" * 60)
+    print("FORCE SEND ASSIGNMENTS")
+    print("=" * 60)
+    print(f"\nStatus: {received}/{total} wishlists received")
+    print()
+    
+    if received < total:
+        print("⚠️  WARNING: Not everyone has sent their wishlist!")
+        print("   Assignments will include a note for missing wishlists.\n")
+    
+    if not dry_run:
+        response = input("Continue? (yes/no): ")
+        if response.lower() != 'yes':
+            print("Cancelled.")
+            return
+    
+    print()
+    assignments_sent = 0
+    skipped = 0
+    
+    def mark_sent(giver_name):
+        nonlocal assignments_sent
+        print(f"✉️  Sent assignment email")
+        game_state['participants'][giver_name]['assignment_sent'] = True
+        assignments_sent += 1
+    
+    # templates/assignment.txt, or assignment_no_wishlist.txt for someone whose recipient never sent one
+    letter = load_template('assignment')
+    no_wishlist_letter = load_template('assignment_no_wishlist')
+    
+    def due(store):
+        nonlocal skipped
+        for giver_name, receiver_name in game_state['assignments'].items():
+            giver_details = game_state['participants'][giver_name]
+            receiver_details = game_state['participants'][receiver_name]
+        
+            # Skip if already sent
+            if giver_details.get('assignment_sent', False):
+                skipped += 1
+                continue
+        
+            if receiver_details['wishlist_received']:
+                # Receiver sent wishlist - normal email
+                yield giver_name, giver_details['email'], letter, {
+                    'receiver': receiver_name.capitalize(),
+                    'wishlist': store.wishlist(receiver_name),
+                }
+            else:
+                # Receiver didn't send wishlist - modified email
+                yield giver_name, giver_details['email'], no_wishlist_letter, {'receiver': receiver_name.capitalize()}
+    
+    with StateStore.open() as store:
+        if dry_run:
+            # Don't show who gets who - keep it secret!
+            assignments_sent = sum(1 for _ in due(store))
+        else:
+            # Queue them in the outbox, each marked sent once the mail server accepts it
+            plan_batch(store, 'assignment', due(store), sender_domain())
+            deliver(store, 'assignment', sending_accounts(store), on_sent=mark_sent)
+    
+    if not dry_run and assignments_sent > 0:
+        print(f"\n✅ Sent {assignments_sent} assignment(s)!")
+        if skipped > 0:
+            print(f"⏭️  Skipped {skipped} (already sent)")
+    elif dry_run:
+        print(f"\n⚠️  DRY RUN - Would send {assignments_sent} assignment(s)")
+        if skipped > 0:
+            print(f"⏭️  Would skip {skipped} (already sent)")
+    else:
+        print(f"\n⚠️  No new assignments sent")
+
+if __name__ == '__main__':
+    import sys
+    
+    # Check for --force flag
+    if '--force' in sys.argv or '-f' in sys.argv:
+        print("\n🚨 FORCE MODE - Sending assignments for real!\n")
+        force_send_assignments(dry_run=False)
+    else:
+        print("\n📋 DRY RUN - Testing what would be sent\n")
+        print("To actually send, run: python force_send.py --force\n")
+        force_send_assignments(dry_run=True)
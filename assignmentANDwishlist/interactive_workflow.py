@@ -10,6 +10,7 @@ from santa_wishlist_gated import (
     check_wishlists, 
     send_assignments
 )
+from santa_store import game_exists
 import os
 import sys
 
@@ -47,12 +48,12 @@ Make sure you've already:
     wait_for_enter()
     
     # Check if game state exists
-    if os.path.exists('santa_game_state.json'):
+    if game_exists():
         print_header("⚠️  Existing Game Detected")
-        print("Found santa_game_state.json from a previous game.")
+        print("Found santa_game_state.db from a previous game.")
         response = input("\nContinue with existing game? (yes/no): ")
         if response.lower() != 'yes':
-            print("\nPlease delete santa_game_state.json to start fresh.")
+            print("\nPlease delete santa_game_state.db (and any old santa_game_state.json) to start fresh.")
             print("Or run the functions manually to continue existing game.")
             return
     else:
@@ -60,7 +61,7 @@ Make sure you've already:
         print_header("STEP 1: Initial Setup")
         print("This will:")
         print("  • Create random Secret Santa assignments")
-        print("  • Save them to santa_game_state.json")
+        print("  • Save them to santa_game_state.db")
         print("  • Send wishlist request emails to everyone")
         print()
         
@@ -107,17 +108,16 @@ Make sure you've already:
             print_header("Collect Wishlists")
             print("Checking Gmail for wishlist replies...\n")
             
-            # Test first
-            game_state = check_wishlists(dry_run=True)
-            
-            if game_state:
+            def confirm(plan):
                 print("\n" + "-"*60)
                 response = input("\nCollect these wishlists? (yes/no): ")
-                if response.lower() == 'yes':
-                    check_wishlists(dry_run=False)
-                    print("\n✅ Wishlists collected!")
-                else:
+                if response.lower() != 'yes':
                     print("Skipped.")
+                    return False
+                return True
+            
+            # Preview first, then save exactly what was previewed (one download, nothing new sneaks in)
+            check_wishlists(dry_run=False, confirm=confirm)
             
             wait_for_enter()
             
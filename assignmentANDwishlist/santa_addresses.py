@@ -0,0 +1,77 @@
+GMAIL_DOMAINS = ('gmail.com', 'googlemail.com')
+
+
+def normalize_address(address):
+    """
+    Reduce an email address to the form that identifies the mailbox, so different spellings of one address match.
+    Case is ignored, and for Gmail a +tag, the dots in the name and googlemail.com are ignored too, e.g.
+    'Alice.Smith+santa@GoogleMail.com' -> 'alicesmith@gmail.com'. Other domains keep their +tag: only some
+    providers use it for subaddressing, elsewhere a+x@ and a+y@ can be different mailboxes (list those as aliases).
+    :param address: bare email address
+    :return: normalized address
+    """
+    address = (address or '').strip().lower()
+    local, at, domain = address.rpartition('@')
+    if not at:
+        return address
+    if domain in GMAIL_DOMAINS:
+        local = local.split('+', 1)[0].replace('.', '')
+        domain = 'gmail.com'
+    return f'{local}@{domain}'
+
+
+class ParticipantIndex:
+    """
+    Lookup tables for a loaded game, built once so each incoming email or late wishlist is a dictionary lookup
+    rather than a scan over every participant:
+
+    - address -> name, for every participant's email and any 'aliases' they have
+    - lowercased name -> name
+    - receiver -> giver
+    """
+
+    def __init__(self, game_state):
+        """
+        :param game_state: game state dictionary from load_game_state()
+        """
+        self.exact = {}
+        self.normalized = {}
+        self.names = {}
+        for name, details in game_state['participants'].items():
+            self.names[name.lower()] = name
+            for address in [details['email']] + list(details.get('aliases') or []):
+                self.exact.setdefault(address.strip().lower(), name)
+                key = normalize_address(address)
+                if self.normalized.get(key, name) != name:
+                    # two people share a normalized form, only an exact match can tell them apart
+                    self.normalized[key] = None
+                else:
+                    self.normalized[key] = name
+        self.giver_of = {receiver: giver for giver, receiver in game_state['assignments'].items()}
+
+    def by_address(self, address):
+        """
+        Find who an email came from.
+        :param address: bare sender address
+        :return: participant name, or None if the address isn't one of theirs
+        """
+        name = self.exact.get((address or '').strip().lower())
+        if name is None:
+            name = self.normalized.get(normalize_address(address))
+        return name
+
+    def by_name(self, name):
+        """
+        Find a participant by name, ignoring case.
+        :param name: name as typed
+        :return: participant name as stored, or None
+        """
+        return self.names.get(name.lower())
+
+    def giver_for(self, receiver_name):
+        """
+        Find who is buying for someone.
+        :param receiver_name: participant name as stored
+        :return: giver name, or None
+        """
+        return self.giver_of.get(receiver_name)
@@ -0,0 +1,260 @@
+import asyncio
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from santa_mail import MailSession, account_failure, permanent_failure, quota_exceeded
+
+# SMTP connections sending at once. Gmail starts refusing logins well before 10 parallel sessions.
+CONNECTIONS = 4
+# Sending limits. 500 recipients a day is what a personal Gmail account gets; a Google Workspace account can send
+# 2000, set "per_day" for it in email_auth.json.
+PER_MINUTE = 60
+PER_DAY = 500
+# Gmail counts the daily limit over a rolling 24 hours
+QUOTA_WINDOW = 24 * 60 * 60
+# Emails allowed back to back before the per-minute rate kicks in
+BURST = 10
+
+
+class TokenBucket:
+    """
+    Rate limiter for one sending account: tokens refill at per_minute / 60 a second up to burst, and the day's
+    allowance is never refilled (a run that hits it stops, rather than waiting until tomorrow).
+    """
+
+    def __init__(self, per_minute=PER_MINUTE, per_day=PER_DAY, burst=BURST):
+        """
+        :param per_minute: sustained emails per minute, None for no rate limit
+        :param per_day: emails allowed in this run, None for no limit
+        :param burst: emails that can go out back to back
+        """
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.day_left = float('inf') if per_day is None else per_day
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """
+        Wait for permission to send one email.
+        :return: True to go ahead, False if the daily allowance is used up
+        """
+        while True:
+            if self.day_left <= 0:
+                return False
+            if self.rate is None:
+                self.day_left -= 1
+                return True
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.day_left -= 1
+                return True
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class SendAccount:
+    """
+    One sending account: how to log in to it, its own rate limiter and how many connections it may use.
+    """
+
+    def __init__(self, username, open_session, connections=CONNECTIONS, per_minute=PER_MINUTE, per_day=PER_DAY,
+                 used=0, quota_limited=True):
+        """
+        :param username: the account's address, shown in the report
+        :param open_session: callable returning a new transport (e.g. MailSession) for this account
+        :param connections: connections this account may have open at once
+        :param per_minute: sustained emails per minute for this account
+        :param per_day: the account's daily limit
+        :param used: emails it has already sent in the current quota window
+        :param quota_limited: False for transports that don't really send (memory, spool), which skip the limits
+        """
+        self.username = username
+        self.open_session = open_session
+        self.connections = connections
+        self.per_day = per_day
+        self.quota_limited = quota_limited
+        if quota_limited:
+            self.limiter = TokenBucket(per_minute=per_minute, per_day=max(0, per_day - used))
+        else:
+            self.limiter = TokenBucket(per_minute=None, per_day=None)
+        self.exhausted = False
+        # why the account can't send at all (login refused, server unreachable), None while it's fine
+        self.broken = None
+
+    @property
+    def remaining(self):
+        """
+        Emails this account can still send before reaching its daily limit.
+        """
+        return self.limiter.day_left
+
+    def take(self):
+        """
+        Use up one email of the daily allowance, for senders that don't go through the async limiter.
+        :return: True if the account had one left
+        """
+        if self.exhausted or self.broken or self.limiter.day_left <= 0:
+            return False
+        self.limiter.day_left -= 1
+        return True
+
+
+def stopped_reason(accounts):
+    """
+    Say why emails were left unsent once no account would take any more.
+    :param accounts: list of SendAccount
+    :return: short explanation for the report
+    """
+    broken = [account.username for account in accounts if account.broken]
+    if broken:
+        return f"{', '.join(broken)} couldn't log in or connect"
+    return "daily sending limit reached on every account"
+
+
+def make_accounts(accounts, used=None, session_class=MailSession, **session_options):
+    """
+    Turn the accounts from santa_mail.read_accounts() into SendAccounts.
+    :param accounts: list of {'username', 'password', 'per_day', 'per_minute'}
+    :param used: optional dictionary of username: emails already sent in the current quota window
+    :param session_class: transport to send with, see santa_transport.transport_from_config()
+    :param session_options: extra keyword arguments for the transport
+    :return: list of SendAccount
+    """
+    used = used or {}
+    return [
+        SendAccount(
+            account['username'],
+            lambda account=account: session_class(account['username'], account['password'], **session_options),
+            per_minute=account.get('per_minute') or PER_MINUTE,
+            per_day=account.get('per_day') or PER_DAY,
+            used=used.get(account['username'], 0),
+            quota_limited=session_class.quota_limited,
+        )
+        for account in accounts
+    ]
+
+
+async def send_all(messages, accounts, on_result=None):
+    """
+    Send many emails over a few SMTP connections per account, all accounts at once. smtplib blocks, so each
+    connection sends from its own worker thread while asyncio hands out the messages and the rate limiters' tokens.
+    Every connection takes the next message from one shared queue, so when an account reaches its daily limit
+    (its own count, or the server saying so) it just stops taking messages and the other accounts carry on. An
+    account whose login fails stops the same way, handing its message back rather than failing it.
+
+    :param messages: list of (key, EmailMessage), key being whatever identifies the recipient in the report
+    :param accounts: list of SendAccount
+    :param on_result: optional callback(key, result) as each email finishes, called on the event loop thread
+    :return: dictionary of key: {'status': 'sent' | 'failed' | 'deferred', 'error': message or None, 'account':
+        username it went from}, failures also have 'permanent': True if retrying won't help
+    """
+    # the loop running this coroutine (get_running_loop() is Python 3.7+, 3.6 only has get_event_loop())
+    loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+    queue = asyncio.Queue()
+    for item in messages:
+        queue.put_nowait(item)
+    report = {}
+
+    def finish(key, result):
+        report[key] = result
+        if on_result:
+            on_result(key, result)
+
+    async def worker(account, executor):
+        with account.open_session() as session:
+            while True:
+                key, msg = await queue.get()
+                try:
+                    if account.broken:
+                        queue.put_nowait((key, msg))
+                        return
+                    if account.exhausted or not await account.limiter.acquire():
+                        # hand it back for another account and stop
+                        account.exhausted = True
+                        queue.put_nowait((key, msg))
+                        return
+                    try:
+                        await loop.run_in_executor(executor, session.send_message, msg)
+                    except (smtplib.SMTPException, OSError) as e:
+                        if account_failure(e):
+                            # not this email's fault, it waits for another account or the next run
+                            if not account.broken:
+                                print(f"⚠️  {account.username} can't send: {e}")
+                                account.broken = str(e)
+                            queue.put_nowait((key, msg))
+                            return
+                        if quota_exceeded(e):
+                            account.exhausted = True
+                            queue.put_nowait((key, msg))
+                            return
+                        finish(key, {'status': 'failed', 'error': str(e), 'account': account.username,
+                                     'permanent': permanent_failure(e)})
+                    else:
+                        finish(key, {'status': 'sent', 'error': None, 'account': account.username})
+                finally:
+                    queue.task_done()
+
+    per_account = [min(account.connections, len(messages)) for account in accounts]
+    with ThreadPoolExecutor(max_workers=max(1, sum(per_account))) as executor:
+        workers = [asyncio.ensure_future(worker(account, executor))
+                   for account, count in zip(accounts, per_account) for _ in range(count)]
+        everything_sent = asyncio.ensure_future(queue.join())
+        # done when the queue is empty, or when every account has given up and left messages behind
+        while not everything_sent.done() and not all(task.done() for task in workers):
+            await asyncio.wait(workers + [everything_sent], return_when=asyncio.FIRST_COMPLETED)
+        everything_sent.cancel()
+        for task in workers:
+            task.cancel()
+        results = await asyncio.gather(*workers, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+            raise result
+    while not queue.empty():
+        key, msg = queue.get_nowait()
+        finish(key, {'status': 'deferred', 'error': stopped_reason(accounts), 'account': None})
+    return report
+
+
+def send_concurrently(messages, accounts, on_result=None):
+    """
+    Blocking wrapper around send_all() for the (non-async) send scripts.
+    :param messages: list of (key, EmailMessage)
+    :param accounts: list of SendAccount
+    :param on_result: optional callback(key, result) as each email finishes
+    :return: per-recipient report, see send_all()
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(send_all(messages, accounts, on_result=on_result))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def print_report(report):
+    """
+    Print a one-line summary of a concurrent send, plus each email that didn't go out.
+    :param report: report from send_all()
+    :return: None
+    """
+    counts = {'sent': 0, 'failed': 0, 'deferred': 0}
+    by_account = {}
+    for result in report.values():
+        counts[result['status']] += 1
+        if result['status'] == 'sent':
+            by_account[result['account']] = by_account.get(result['account'], 0) + 1
+    print(f"\n📊 Sent {counts['sent']}, failed {counts['failed']}, deferred {counts['deferred']}")
+    if len(by_account) > 1:
+        for username, sent in by_account.items():
+            print(f"   {username}: {sent} sent")
+    for key, result in report.items():
+        if result['status'] != 'sent':
+            print(f"   ⚠️  {key}: {result['status']} ({result['error']})")
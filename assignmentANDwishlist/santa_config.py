@@ -0,0 +1,56 @@
+"""
+The bot's mail settings from email_auth.json. Nothing is read until a command actually sends or collects mail, so
+commands that only look at the saved game (status.py) start quickly and work without credentials.
+"""
+import json
+
+from santa_metrics import configure as configure_metrics
+
+AUTH_FILE = 'email_auth.json'
+
+_loaded = {}  # file name: MailConfig
+
+
+class MailConfig:
+    """
+    Everything email_auth.json says about the bot's accounts and mail servers.
+    """
+
+    def __init__(self, email_auth):
+        """
+        :param email_auth: parsed email_auth.json
+        """
+        # smtplib, imaplib and asyncio come in with these, only once there is mail to handle
+        from santa_inbox import IMAP_HOST
+        from santa_mail import read_accounts
+        from santa_transport import transport_from_config
+
+        # Read in the auth for your mail account (tested with gmail app password only)
+        self.email_auth = email_auth
+        self.accounts = read_accounts(email_auth)
+        # The first account receives the wishlists; bulk sends are shared across all of them
+        self.username = self.accounts[0]['username']
+        self.password = self.accounts[0]['password']
+        # SMTP to Gmail, unless email_auth.json picks the in-memory or spool transport
+        self.transport, self.transport_options = transport_from_config(email_auth)
+        # IMAP server the wishlists are collected from
+        self.inbox_options = {
+            'host': email_auth.get('imap_host', IMAP_HOST),
+            'port': email_auth.get('imap_port'),
+            'ssl': email_auth.get('imap_ssl', True),
+        }
+
+
+def mail_config(filename=AUTH_FILE):
+    """
+    Read email_auth.json the first time it's needed, and turn on metrics if it asks for them (see santa_metrics).
+    :param filename: credentials file
+    :return: MailConfig, the same one on every call
+    """
+    if filename not in _loaded:
+        with open(filename) as f:
+            email_auth = json.load(f)
+        _loaded[filename] = MailConfig(email_auth)
+        # Optional timing trace and Prometheus textfile, see santa_metrics.py
+        configure_metrics(email_auth.get('metrics_trace'), email_auth.get('metrics_textfile_dir'))
+    return _loaded[filename]
@@ -0,0 +1,81 @@
+"""
+Send the emails a wishlist makes due the moment it is collected, instead of on the next send_assignments() or
+send_one_late.py run:
+
+    with Dispatcher() as dispatcher:
+        collect_wishlists(mail, game_state, dry_run=False, on_wishlist=dispatcher.on_wishlist)
+
+Recording a wishlist already works out what it makes due (see StateStore.record_wishlist): the sender's own
+assignment and their giver's, once both sides of each have a wishlist in, or a late wishlist update for a giver who
+was sent their assignment before it arrived. The hook writes those emails into the outbox and sends them over one
+login per account, kept for as long as the dispatcher is open and re-opened by the session if the server drops it.
+
+Nothing here prints a name, so a collector that dispatches still never shows who buys for whom.
+"""
+from santa_wishlist_gated import plan_assignments, plan_late_wishlists, sending_accounts
+
+# Kinds of email a wishlist can make due, in the order they are sent
+KINDS = ('assignment', 'late_wishlist')
+
+
+class Dispatcher:
+    """
+    Ingest hook that sends assignments and late wishlist updates as soon as a wishlist is saved. Use it as a
+    context manager so its connections are closed.
+    """
+
+    def __init__(self):
+        self.sessions = {}  # account username: open transport
+        self.sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Log out of every account. Safe to call more than once.
+        :return: None
+        """
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
+
+    def _session(self, account):
+        if account.username not in self.sessions:
+            self.sessions[account.username] = account.open_session()  # connects on its first send
+        return self.sessions[account.username]
+
+    def on_wishlist(self, store, name):
+        """
+        Write and send whatever the wishlist just saved made due. Pass this as the on_wishlist hook of
+        collect_wishlists(), commit_wishlists() or check_wishlists().
+        :param store: open StateStore the wishlist was saved in
+        :param name: participant whose wishlist it is (which emails are due was worked out when it was saved)
+        :return: number of emails sent
+        """
+        return self.dispatch(store)
+
+    def dispatch(self, store):
+        """
+        Write the queued assignments and late wishlist updates into the outbox and send what's due there.
+        :param store: open StateStore
+        :return: number of emails sent
+        """
+        from santa_outbox import deliver
+
+        plan_assignments(store)
+        plan_late_wishlists(store)
+        # built afresh each time so the daily limits count from what is really sent, the logins are kept
+        accounts = sending_accounts(store)
+        sessions = [self._session(account) for account in accounts]
+        sent = []
+        for kind in KINDS:
+            # a failed send isn't waited for here, the next wishlist or send_queued_emails() retries it
+            deliver(store, kind, accounts, on_sent=sent.append, max_wait=0, sessions=sessions, quiet=True)
+        if sent:
+            print(f"✉️  Sent {len(sent)} email(s) this wishlist made due")
+        self.sent += len(sent)
+        return len(sent)
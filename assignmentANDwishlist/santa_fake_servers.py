@@ -0,0 +1,217 @@
+"""
+Stand-in SMTP and IMAP servers on localhost, so the whole setup / collect / send pipeline can be run and timed
+without a Gmail account. They speak just enough of each protocol for smtplib and imaplib as this project uses them,
+accept any login, and keep everything in memory.
+
+    with FakeSMTPServer() as smtp, FakeIMAPServer() as imap:
+        imap.seed([('alice@example.com', 'socks'), ...])
+        ...point email_auth.json at smtp.port / imap.port with "smtp_starttls": false and "imap_ssl": false...
+"""
+import re
+import socketserver
+import threading
+import time
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _FakeServer:
+    handler = None
+
+    def __init__(self, host='127.0.0.1', port=0):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free one
+        """
+        self.server = _Server((host, port), self.handler)
+        self.server.owner = self
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, *lines):
+        self.wfile.write(b''.join(line + b'\r\n' for line in lines))
+
+    def handle(self):
+        owner = self.server.owner
+        self.reply(b'220 fake-smtp ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply(b'250-fake-smtp', b'250-AUTH PLAIN LOGIN', b'250-8BITMIME', b'250 SMTPUTF8')
+            elif command == b'AUTH':
+                if line.split()[1].upper() == b'LOGIN':
+                    # username and password each come on their own line
+                    self.reply(b'334 VXNlcm5hbWU6')
+                    self.rfile.readline()
+                    self.reply(b'334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                self.reply(b'235 2.7.0 Accepted')
+            elif command == b'DATA':
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                for data in iter(self.rfile.readline, b''):
+                    if data == b'.\r\n':
+                        break
+                    size += len(data)
+                if owner.delay:
+                    time.sleep(owner.delay)
+                owner.received(size)
+                self.reply(b'250 2.0.0 OK queued')
+            elif command == b'QUIT':
+                self.reply(b'221 2.0.0 Bye')
+                return
+            elif command in (b'HELO', b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self.reply(b'250 2.0.0 OK')
+            else:
+                self.reply(b'502 5.5.2 Command not implemented')
+
+
+class FakeSMTPServer(_FakeServer):
+    """
+    Accepts every email and just counts them. Connect with MailSession(..., starttls=False).
+    """
+
+    handler = _SMTPHandler
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free one
+        :param delay: seconds to wait before accepting each email, to stand in for a real server's round trip
+        """
+        super().__init__(host, port)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+
+    def received(self, size):
+        with self.lock:
+            self.messages += 1
+            self.bytes += size
+
+    def reset(self):
+        with self.lock:
+            self.messages = 0
+            self.bytes = 0
+
+
+def _uids(sequence_set, last):
+    uids = []
+    for part in sequence_set.split(','):
+        lo, _, hi = part.partition(':')
+        lo = last if lo == '*' else int(lo)
+        hi = lo if not hi else last if hi == '*' else int(hi)
+        uids.extend(range(min(lo, hi), max(lo, hi) + 1))
+    return [uid for uid in uids if 1 <= uid <= last]
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        owner = self.server.owner
+        self.wfile.write(b'* OK [CAPABILITY IMAP4rev1 IDLE] fake-imap ready\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.rstrip(b'\r\n').decode('utf-8', 'replace').partition(' ')
+            command, _, args = rest.partition(' ')
+            command = command.upper()
+            if command == 'UID':
+                command, _, args = args.partition(' ')
+                command = 'UID ' + command.upper()
+            out = []
+            if command == 'CAPABILITY':
+                out.append(b'* CAPABILITY IMAP4rev1 IDLE\r\n')
+            elif command == 'SELECT':
+                out.append(f'* {len(owner.messages)} EXISTS\r\n'.encode())
+                out.append(f'* OK [UIDVALIDITY {owner.uidvalidity}] UIDs valid\r\n'.encode())
+                out.append(f'* OK [UIDNEXT {len(owner.messages) + 1}] next UID\r\n'.encode())
+            elif command == 'STATUS':
+                out.append(f'* STATUS INBOX (UIDVALIDITY {owner.uidvalidity})\r\n'.encode())
+            elif command == 'UID SEARCH':
+                match = re.search(r'UID (\d+):', args)
+                first = int(match.group(1)) if match else 1
+                uids = list(range(first, len(owner.messages) + 1))
+                if not uids and owner.messages:
+                    # n:* always matches the newest message, even when n is past it
+                    uids = [len(owner.messages)]
+                out.append(b'* SEARCH ' + ' '.join(map(str, uids)).encode() + b'\r\n')
+            elif command == 'UID FETCH':
+                sequence_set, _, items = args.partition(' ')
+                for uid in _uids(sequence_set, len(owner.messages)):
+                    out.append(owner.fetch_item(uid, items))
+            elif command == 'LOGOUT':
+                self.wfile.write(b'* BYE fake-imap logging out\r\n' + tag.encode() + b' OK LOGOUT completed\r\n')
+                return
+            elif command not in ('LOGIN', 'CLOSE', 'NOOP', 'UID STORE', 'EXAMINE'):
+                self.wfile.write(tag.encode() + b' BAD unknown command\r\n')
+                continue
+            out.append(tag.encode() + b' OK ' + command.encode() + b' completed\r\n')
+            self.wfile.write(b''.join(out))
+
+
+class FakeIMAPServer(_FakeServer):
+    """
+    An inbox holding synthetic wishlist replies, one single-part text/plain email per seeded reply with UIDs from
+    1 up. Connect with connect_inbox(..., ssl=False).
+    """
+
+    handler = _IMAPHandler
+
+    def __init__(self, host='127.0.0.1', port=0, uidvalidity=1):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free one
+        :param uidvalidity: UIDVALIDITY reported for the inbox
+        """
+        super().__init__(host, port)
+        self.uidvalidity = uidvalidity
+        self.messages = []
+
+    def seed(self, replies, subject="Re: Secret Santa - Send Your Wishlist to Get Your Assignment!"):
+        """
+        Replace the inbox with one reply per (address, wishlist) pair.
+        :param replies: iterable of (sender address, wishlist text)
+        :param subject: subject of every reply
+        :return: None
+        """
+        self.messages = []
+        for number, (address, wishlist) in enumerate(replies, start=1):
+            headers = (f"From: <{address}>\r\nSubject: {subject}\r\n"
+                       f"Message-ID: <reply-{number}@fake-imap>\r\n\r\n").encode('utf-8')
+            self.messages.append((headers, wishlist.encode('utf-8') + b'\r\n'))
+
+    def fetch_item(self, uid, items):
+        headers, body = self.messages[uid - 1]
+        if 'BODYSTRUCTURE' in items:
+            lines = body.count(b'\n')
+            structure = f'("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL "7BIT" {len(body)} {lines})'
+            return (f'* {uid} FETCH (UID {uid} BODYSTRUCTURE {structure} '
+                    f'BODY[HEADER.FIELDS (FROM SUBJECT MESSAGE-ID)] {{{len(headers)}}}\r\n').encode() + headers + b')\r\n'
+        return f'* {uid} FETCH (UID {uid} BODY[1] {{{len(body)}}}\r\n'.encode() + body + b')\r\n'
@@ -0,0 +1,386 @@
+import base64
+import imaplib
+import quopri
+import select
+import time
+from email.parser import BytesHeaderParser
+from ssl import SSLWantReadError
+
+from santa_metrics import timed
+
+IMAP_HOST = 'imap.gmail.com'
+MAILBOX = 'inbox'
+SEARCH_SUBJECT = 'Secret Santa'
+
+
+@timed('imap_login')
+def connect_inbox(username, password, host=IMAP_HOST, port=None, ssl=True):
+    """
+    Log in to the bot's mailbox over IMAP.
+    :param username: mail account to log in with
+    :param password: app password for the account
+    :param host: IMAP server
+    :param port: IMAP port, defaults to 993 (or 143 without SSL)
+    :param ssl: if False, connect without TLS (only for a local test server)
+    :return: logged in imaplib.IMAP4_SSL connection (imaplib.IMAP4 without SSL)
+    """
+    if ssl:
+        mail = imaplib.IMAP4_SSL(host, port or imaplib.IMAP4_SSL_PORT)
+    else:
+        mail = imaplib.IMAP4(host, port or imaplib.IMAP4_PORT)
+    mail.login(username, password)
+    return mail
+
+
+@timed('imap_select')
+def select_inbox(mail, mailbox=MAILBOX):
+    """
+    Open the mailbox and read its UIDVALIDITY. UIDs are only comparable between runs while this stays the same.
+    :param mail: logged in IMAP connection
+    :param mailbox: mailbox to open
+    :return: UIDVALIDITY as an int
+    """
+    mail.select(mailbox)
+    _, data = mail.response('UIDVALIDITY')
+    if not data or data[0] is None:
+        # not every server volunteers it on SELECT, so ask explicitly
+        _, data = mail.status(mailbox, '(UIDVALIDITY)')
+        return int(data[0].split(b'UIDVALIDITY')[1].strip(b' ()'))
+    return int(data[0])
+
+
+# IMAP dates have English month names, whatever the locale
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def imap_date(when):
+    """
+    Write a date the way IMAP SEARCH takes it, e.g. 01-Nov-2024
+    :param when: date or datetime
+    :return: date string
+    """
+    return f"{when.day:02d}-{MONTHS[when.month - 1]}-{when.year}"
+
+
+@timed('imap_search')
+def search_new_uids(mail, sync, uidvalidity, subject=SEARCH_SUBJECT, since=None):
+    """
+    Find the UIDs of Secret Santa emails we haven't processed yet.
+    Only messages after the saved checkpoint are searched. If the mailbox's UIDVALIDITY has changed since the
+    checkpoint was saved (or there is no checkpoint yet) the old UIDs mean nothing, so the whole mailbox is searched,
+    from the day the game was set up when since is given so replies to earlier years' games stay out.
+    :param mail: IMAP connection with the mailbox selected
+    :param sync: saved checkpoint {'uidvalidity': int, 'last_uid': int}, or None
+    :param uidvalidity: the mailbox's current UIDVALIDITY
+    :param subject: subject text the replies contain
+    :param since: optional date to start a full resync from
+    :return: (sorted list of new UIDs, True if this was a full resync), or (None, resync) if the search failed
+    """
+    resync = not sync or sync.get('uidvalidity') != uidvalidity
+    last_uid = 0 if resync else sync['last_uid']
+    if not resync:
+        criteria = f'UID {last_uid + 1}:* SUBJECT "{subject}"'
+    elif since:
+        criteria = f'SINCE {imap_date(since)} SUBJECT "{subject}"'
+    else:
+        criteria = f'SUBJECT "{subject}"'
+    status, data = mail.uid('SEARCH', None, criteria)
+    if status != 'OK':
+        return None, resync
+    # "n:*" always matches the newest message, even when its UID is below n
+    uids = sorted(int(uid) for uid in data[0].split())
+    return [uid for uid in uids if uid > last_uid], resync
+
+
+def close_inbox(mail):
+    """
+    Close the mailbox and log out, ignoring a connection that has already gone away.
+    :param mail: IMAP connection
+    :return: None
+    """
+    try:
+        if mail.state == 'SELECTED':
+            mail.close()
+        mail.logout()
+    except (imaplib.IMAP4.error, OSError):
+        pass
+
+
+# Servers drop an IDLE after 30 minutes (RFC 2177), so we leave and re-enter it well before that
+IDLE_TIMEOUT = 25 * 60
+
+
+def _buffered(mail):
+    """
+    Check for server output already read off the socket but not yet consumed, which select() can't see: imaplib
+    reads into a buffered file, so an "* N EXISTS" that arrived in the same packet as the IDLE continuation is
+    already in it, and so is anything SSL has decrypted but not handed over.
+    :param mail: IMAP connection
+    :return: True if a read would return data straight away
+    """
+    timeout = mail.sock.gettimeout()
+    # peek() only goes to the socket when the buffer is empty, and non-blocking it gives up at once
+    mail.sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, SSLWantReadError):
+        return False
+    finally:
+        mail.sock.settimeout(timeout)
+
+
+def idle_wait(mail, timeout=IDLE_TIMEOUT, tag=b'SANTAIDLE'):
+    """
+    Block in IMAP IDLE until the server reports new mail or the timeout passes. The mailbox must be selected.
+    :param mail: logged in IMAP connection
+    :param timeout: seconds to wait before leaving IDLE so it can be renewed
+    :param tag: command tag to use for the IDLE command
+    :return: True if new mail arrived, False if we timed out
+    """
+    mail.send(tag + b' IDLE\r\n')
+    line = mail.readline()
+    if not line.startswith(b'+'):
+        raise imaplib.IMAP4.error(f"IDLE refused: {line.decode(errors='replace').strip()}")
+    new_mail = False
+    deadline = time.monotonic() + timeout
+    while not new_mail:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # wait on the socket itself: a read timeout would leave imaplib's buffered file unusable
+        if not _buffered(mail) and not select.select([mail.sock], [], [], remaining)[0]:
+            break
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed during IDLE")
+        if line.startswith(b'*') and line.rstrip().upper().endswith(b'EXISTS'):
+            new_mail = True
+    mail.send(b'DONE\r\n')
+    # read up to the tagged reply, ignoring any other untagged updates
+    while True:
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("connection closed leaving IDLE")
+        if line.startswith(tag + b' '):
+            if not line[len(tag) + 1:].upper().startswith(b'OK'):
+                raise imaplib.IMAP4.error(f"IDLE failed: {line.decode(errors='replace').strip()}")
+            return new_mail
+
+
+HEADER_FIELDS = 'BODY.PEEK[HEADER.FIELDS (FROM SUBJECT MESSAGE-ID)]'
+# UIDs per FETCH command, keeps command lines a sensible length on huge inboxes
+FETCH_CHUNK = 1000
+
+
+def uid_set(uids):
+    """
+    Write a list of UIDs as a compact IMAP sequence set, e.g. [1, 2, 3, 7] -> "1:3,7"
+    :param uids: UIDs in any order
+    :return: sequence set string
+    """
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(lo) if lo == hi else f'{lo}:{hi}' for lo, hi in ranges)
+
+
+def _chunks(uids, size=FETCH_CHUNK):
+    uids = sorted(uids)
+    for i in range(0, len(uids), size):
+        yield uids[i:i + size]
+
+
+def _scan(line):
+    """
+    Split one line of an IMAP response into tokens: '(' and ')', strings (atoms and quoted strings), None for NIL.
+    A trailing literal marker {n} is dropped, the literal itself comes as the next item from imaplib.
+    """
+    text = line.decode('utf-8', 'replace')
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch in ' \r\n':
+            i += 1
+        elif ch in '()':
+            yield ch
+            i += 1
+        elif ch == '"':
+            i += 1
+            value = []
+            while text[i] != '"':
+                if text[i] == '\\':
+                    i += 1
+                value.append(text[i])
+                i += 1
+            i += 1
+            yield ''.join(value)
+        elif ch == '{' and text.rstrip().endswith('}') and text.rfind('{') == i:
+            return
+        else:
+            start = i
+            depth = 0
+            # atoms like BODY[HEADER.FIELDS (FROM SUBJECT)] can contain spaces and brackets
+            while i < len(text) and (depth or text[i] not in ' ()\r\n'):
+                if text[i] == '[':
+                    depth += 1
+                elif text[i] == ']':
+                    depth -= 1
+                i += 1
+            atom = text[start:i]
+            yield None if atom.upper() == 'NIL' else atom
+
+
+def _tokens(data):
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            yield from _scan(item[0])
+            yield item[1]
+        else:
+            yield from _scan(item)
+
+
+@timed('mime_parse')
+def parse_fetch_response(data):
+    """
+    Turn imaplib's FETCH output into a dictionary per message.
+    :param data: second element of the (status, data) returned by mail.uid('FETCH', ...)
+    :return: dictionary of UID: {item name: value}, where lists are python lists, literals are bytes and NIL is None
+    """
+    stack = [[]]
+    for token in _tokens(data):
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            done = stack.pop()
+            stack[-1].append(done)
+        else:
+            stack[-1].append(token)
+    messages = {}
+    for item in stack[0]:
+        if not isinstance(item, list):
+            continue  # the message sequence number and the FETCH keyword
+        fields = {str(key).upper(): value for key, value in zip(item[0::2], item[1::2])}
+        # unsolicited flag updates can arrive mixed in, and carry no UID
+        if 'UID' in fields:
+            messages[int(fields['UID'])] = fields
+    return messages
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def find_text_part(structure, section=''):
+    """
+    Find the first text/plain part of a message from its BODYSTRUCTURE, so we can download just that part.
+    :param structure: parsed BODYSTRUCTURE list
+    :param section: section number of this part ('' for the whole message)
+    :return: (section, transfer encoding, charset), or None if there is no plain text part
+    """
+    if isinstance(structure[0], list):
+        children = []
+        for child in structure:
+            if not isinstance(child, list):
+                break  # the multipart subtype, followed by extension data
+            children.append(child)
+        for number, child in enumerate(children, start=1):
+            found = find_text_part(child, f'{section}.{number}' if section else str(number))
+            if found:
+                return found
+        return None
+    content_type = f'{_text(structure[0])}/{_text(structure[1])}'.lower()
+    if content_type != 'text/plain' and section:
+        return None
+    params = structure[2] or []
+    charset = 'utf-8'
+    for key, value in zip(params[0::2], params[1::2]):
+        if _text(key).lower() == 'charset' and value:
+            charset = _text(value)
+    encoding = (_text(structure[5]) or '7bit').lower()
+    # a single-part message's body is section 1, whatever its type
+    return section or '1', encoding, charset
+
+
+@timed('mime_parse')
+def decode_part(payload, encoding, charset):
+    """
+    Undo the transfer encoding of a downloaded body part.
+    :param payload: raw part bytes
+    :param encoding: Content-Transfer-Encoding from the BODYSTRUCTURE
+    :param charset: charset from the BODYSTRUCTURE
+    :return: text
+    """
+    if encoding == 'base64':
+        payload = base64.b64decode(payload)
+    elif encoding == 'quoted-printable':
+        payload = quopri.decodestring(payload)
+    try:
+        return payload.decode(charset, 'replace')
+    except LookupError:
+        return payload.decode('utf-8', 'replace')
+
+
+@timed('imap_fetch')
+def fetch_headers(mail, uids):
+    """
+    Download only the From/Subject/Message-ID headers and the MIME structure of many messages, one command per chunk
+    of UIDs rather than one per message.
+    :param mail: IMAP connection with the mailbox selected
+    :param uids: UIDs to fetch
+    :return: dictionary of UID: {'headers': email.message.Message, 'text_part': find_text_part() result}
+    """
+    parser = BytesHeaderParser()
+    found = {}
+    for chunk in _chunks(uids):
+        status, data = mail.uid('FETCH', uid_set(chunk), f'(UID BODYSTRUCTURE {HEADER_FIELDS})')
+        if status != 'OK':
+            continue
+        for uid, fields in parse_fetch_response(data).items():
+            headers = b''
+            for key, value in fields.items():
+                if key.startswith('BODY[HEADER') and value:
+                    headers = value.encode('utf-8') if isinstance(value, str) else value
+            structure = fields.get('BODYSTRUCTURE')
+            found[uid] = {
+                'headers': parser.parsebytes(headers),
+                'text_part': find_text_part(structure) if structure else None,
+            }
+    return found
+
+
+@timed('imap_fetch')
+def fetch_text_bodies(mail, parts):
+    """
+    Download just the plain text part of the given messages, batched by section number (one FETCH can only ask for
+    one section, but nearly every reply has its text at 1 or 1.1).
+    :param mail: IMAP connection with the mailbox selected
+    :param parts: dictionary of UID: (section, encoding, charset) from find_text_part()
+    :return: dictionary of UID: decoded text
+    """
+    by_section = {}
+    for uid, part in parts.items():
+        by_section.setdefault(part[0], []).append(uid)
+    bodies = {}
+    for section, uids in by_section.items():
+        for chunk in _chunks(uids):
+            status, data = mail.uid('FETCH', uid_set(chunk), f'(UID BODY.PEEK[{section}])')
+            if status != 'OK':
+                continue
+            for uid, fields in parse_fetch_response(data).items():
+                if uid not in parts:
+                    continue
+                payload = fields.get(f'BODY[{section}]')
+                if payload is None:
+                    continue
+                if isinstance(payload, str):
+                    payload = payload.encode('utf-8')
+                _, encoding, charset = parts[uid]
+                bodies[uid] = decode_part(payload, encoding, charset)
+    return bodies
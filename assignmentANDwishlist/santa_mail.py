@@ -0,0 +1,263 @@
+import abc
+import smtplib
+from email.message import EmailMessage
+
+from santa_metrics import count, span
+
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 587
+
+# Errors that mean the server hung up on us, rather than rejected the message
+DISCONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionResetError, BrokenPipeError)
+# Errors about the account or its connection (wrong app password, server refusing the sender) rather than one email
+ACCOUNT_ERRORS = (smtplib.SMTPAuthenticationError, smtplib.SMTPConnectError, smtplib.SMTPHeloError,
+                  smtplib.SMTPNotSupportedError, smtplib.SMTPSenderRefused)
+# 530 authentication required, 534 login refused (e.g. app passwords turned off), 535 bad username or password
+ACCOUNT_CODES = (530, 534, 535)
+
+
+def connection_dropped(error):
+    """
+    Work out whether a send failed because the connection went away (worth reconnecting and retrying)
+    :param error: exception raised by smtplib
+    :return: True if we should reconnect
+    """
+    if isinstance(error, DISCONNECT_ERRORS):
+        return True
+    # 421 is the server saying it is closing the connection, smtplib has already closed its end
+    return getattr(error, 'smtp_code', None) == 421
+
+
+def quota_exceeded(error):
+    """
+    Work out whether a send failed because the account has used up its daily sending limit (Gmail answers
+    550 5.4.5), so another account should take over
+    :param error: exception raised by smtplib
+    :return: True if this account shouldn't send any more for now
+    """
+    text = getattr(error, 'smtp_error', b'') or b''
+    if isinstance(text, str):
+        text = text.encode('utf-8', 'replace')
+    return b'5.4.5' in text or b'quota' in text.lower()
+
+
+def account_failure(error):
+    """
+    Work out whether a send failed because of the account rather than the email (the login was refused, or the
+    server couldn't be reached at all), so every other email would fail the same way until someone fixes it
+    :param error: exception raised by smtplib
+    :return: True if this account can't send anything
+    """
+    if isinstance(error, ACCOUNT_ERRORS) or getattr(error, 'smtp_code', None) in ACCOUNT_CODES:
+        return True
+    # a socket error of its own (refused, timed out, no such host); MailSession already reconnects after a drop
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def permanent_failure(error):
+    """
+    Work out whether a send failed for good because of this email (address or message rejected) rather than for
+    now, or because of the account (see account_failure())
+    :param error: exception raised by smtplib
+    :return: True if sending the same message again won't help
+    """
+    if account_failure(error) or quota_exceeded(error):
+        return False
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    code = getattr(error, 'smtp_code', None)
+    return code is not None and 500 <= code < 600
+
+
+def read_accounts(email_auth):
+    """
+    List the sending accounts in email_auth.json. The top-level gmail_username/gmail_app_password pair comes first
+    (it's also the inbox wishlists arrive in), followed by any extra senders under "accounts":
+
+        {"gmail_username": "...", "gmail_app_password": "...",
+         "accounts": [{"gmail_username": "...", "gmail_app_password": "...", "per_day": 500}]}
+
+    :param email_auth: parsed email_auth.json
+    :return: list of {'username', 'password', 'per_day', 'per_minute'} (limits are None where not given)
+    """
+    entries = []
+    if 'gmail_username' in email_auth:
+        entries.append(email_auth)
+    entries.extend(email_auth.get('accounts', []))
+    accounts = []
+    for entry in entries:
+        if any(account['username'] == entry['gmail_username'] for account in accounts):
+            continue
+        accounts.append({
+            'username': entry['gmail_username'],
+            'password': entry['gmail_app_password'],
+            'per_day': entry.get('per_day'),
+            'per_minute': entry.get('per_minute'),
+        })
+    if not accounts:
+        raise KeyError("email_auth.json needs gmail_username and gmail_app_password (or a list of accounts)")
+    return accounts
+
+
+def build_message(recipient, message, sender="Santa's Workshop", subject="Secret Santa", reply_to=None):
+    """
+    Build the email for one participant.
+    :param recipient: email recipient
+    :param message: email message
+    :param sender: sender name
+    :param subject: email subject
+    :param reply_to: optional reply-to address
+    :return: EmailMessage
+    """
+    msg = EmailMessage()
+    msg.set_content(message)
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = recipient
+    if reply_to:
+        msg['Reply-To'] = reply_to
+    return msg
+
+
+class Transport(abc.ABC):
+    """
+    How emails leave the bot. MailSession sends them over SMTP; santa_transport has stand-ins that keep them in
+    memory or write them to disk, so a big run can be tried out without a mail account.
+
+    A transport is a context manager with send_message() for a built EmailMessage and send() to build and send one.
+    Subclasses implement send_message(), and open()/close() if they hold a connection.
+    """
+
+    # whether what goes through this transport counts towards the account's daily sending limit
+    quota_limited = True
+
+    def __init__(self, username=None, password=None):
+        """
+        :param username: account the emails are sent as
+        :param password: password for the account
+        """
+        self.username = username
+        self.password = password
+        self.sent = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    @abc.abstractmethod
+    def send_message(self, msg):
+        """
+        Send one email.
+        :param msg: EmailMessage
+        :return: None
+        """
+
+    def send(self, recipient, message, sender="Santa's Workshop", subject="Secret Santa", reply_to=None):
+        """
+        Send one email.
+        :param recipient: email recipient
+        :param message: email message
+        :param sender: sender name
+        :param subject: email subject
+        :param reply_to: optional reply-to address
+        :return: None
+        """
+        self.send_message(build_message(recipient, message, sender=sender, subject=subject, reply_to=reply_to))
+
+
+class MailSession(Transport):
+    """
+    A single logged-in SMTP connection that can send many emails.
+    The connection is opened on the first send (connect/EHLO/STARTTLS/EHLO/login happen once)
+    and re-opened automatically if the server drops it part way through a batch.
+
+    Use it as a context manager so the connection is always closed:
+
+        with MailSession(gmail_username, gmail_app_password) as session:
+            for name, details in participants.items():
+                session.send(details['email'], msg)
+    """
+
+    def __init__(self, username, password, host=SMTP_HOST, port=SMTP_PORT, timeout=60, starttls=True):
+        """
+        :param username: mail account to log in with
+        :param password: app password for the account
+        :param host: SMTP server
+        :param port: SMTP submission port (STARTTLS)
+        :param timeout: socket timeout in seconds
+        :param starttls: if False, log in without TLS (only for a local test server)
+        """
+        super().__init__(username, password)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.starttls = starttls
+        self.server = None
+        self.reconnects = 0
+
+    def open(self):
+        """
+        Connect and log in, unless we are already connected.
+        :return: None
+        """
+        if self.server is not None:
+            return
+        server = None
+        try:
+            with span('smtp_connect'):
+                server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+                server.ehlo()
+                if self.starttls:
+                    server.starttls()
+                    server.ehlo()
+            with span('smtp_login'):
+                server.login(self.username, self.password)
+        except Exception:
+            if server is not None:
+                server.close()
+            raise
+        self.server = server
+
+    def close(self):
+        """
+        Log out and close the connection. Safe to call more than once.
+        :return: None
+        """
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            # The server already went away, nothing left to say goodbye to
+            self.server.close()
+        self.server = None
+
+    def send_message(self, msg):
+        """
+        Send an already built EmailMessage, reconnecting once if the connection was dropped.
+        :param msg: EmailMessage to send
+        :return: None
+        """
+        self.open()
+        try:
+            with span('smtp_send'):
+                self.server.send_message(msg)
+        except (smtplib.SMTPException, OSError) as e:
+            if not connection_dropped(e):
+                raise
+            self.server.close()
+            self.server = None
+            self.reconnects += 1
+            count('smtp_reconnects')
+            self.open()
+            with span('smtp_send'):
+                self.server.send_message(msg)
+        self.sent += 1
@@ -0,0 +1,429 @@
+import random
+
+from santa_metrics import count, timed
+
+
+def compile_blocked(blocked_matches):
+    """
+    Turn the organiser's blocked pairs into a lookup table, so checking a pair is O(1) however long the list is.
+    Each entry may also be a whole group, e.g. a household or department ({'alice', 'bob', 'chris'}): nobody in the
+    group is matched with anyone else in it.
+    :param blocked_matches: list of sets of blocked names in format ({'alice', 'bob'},), or an already compiled table
+    :return: dictionary of name: frozenset of names they must not be matched with (in either direction)
+    """
+    if isinstance(blocked_matches, dict):
+        return blocked_matches
+    table = {}
+    for group in blocked_matches:
+        for name in group:
+            table.setdefault(name, set()).update(group)
+    return {name: frozenset(others - {name}) for name, others in table.items()}
+
+
+def _blocked(giver, receiver, blocked):
+    """
+    Check whether a giver:receiver pair has been ruled out by the organiser
+    :param giver: giver name
+    :param receiver: receiver name
+    :param blocked: table from compile_blocked()
+    :return: True if the pair must not be used
+    """
+    return receiver in blocked.get(giver, ())
+
+
+def _fixed_point_ratios(n):
+    """
+    Probability table for random_derangement(). Entry u is (u-1) * D(u-2) / D(u), where D(u) is the number of
+    derangements of u items. This is the chance that the item swapped in closes a 2-cycle while u items are still
+    unsettled. Built from the ratio D(u-1) / D(u) so we never touch the (huge) derangement numbers themselves.
+    :param n: number of participants
+    :return: list of probabilities indexed by u
+    """
+    close_cycle = [0.0] * (n + 1)
+    if n >= 2:
+        close_cycle[2] = 1.0
+    ratio = 0.0  # D(u-1) / D(u) for u = 2
+    for u in range(3, n + 1):
+        previous = ratio
+        ratio = 1.0 / ((u - 1) * (1.0 + previous))
+        close_cycle[u] = (u - 1) * previous * ratio
+    return close_cycle
+
+
+def random_derangement(n, rng=random):
+    """
+    Uniformly random permutation of range(n) in which nothing stays in its own place, built directly in
+    linear expected time (Martinez, Panholzer & Prodinger, "Generating random derangements", 2008).
+    Unlike shuffling until nobody has themselves, this never needs a retry.
+    :param n: number of items
+    :param rng: random number generator (anything with randrange/random, e.g. random.Random(seed))
+    :return: list where position i holds the item i is matched to, or None if n == 1
+    """
+    if n == 1:
+        return None
+    perm = list(range(n))
+    settled = [False] * n
+    close_cycle = _fixed_point_ratios(n)
+    i = n - 1
+    unsettled = n
+    while unsettled >= 2:
+        if not settled[i]:
+            j = rng.randrange(i)
+            while settled[j]:
+                j = rng.randrange(i)
+            perm[i], perm[j] = perm[j], perm[i]
+            if rng.random() < close_cycle[unsettled]:
+                # i and j swap with each other, so j is finished too
+                settled[j] = True
+                unsettled -= 1
+            unsettled -= 1
+        i -= 1
+    return perm
+
+
+def _repair(candidates, perm, blocked, rng, attempts):
+    """
+    Fix up blocked pairs in a derangement by swapping receivers with other givers.
+    :param candidates: participant names, perm indexes into this list
+    :param perm: derangement to repair in place
+    :param blocked: table from compile_blocked()
+    :param rng: random number generator
+    :param attempts: how many swap partners to try for each blocked giver before giving up
+    :return: True if every blocked pair was removed
+    """
+    n = len(candidates)
+    tried = 0
+    for g in range(n):
+        if not _blocked(candidates[g], candidates[perm[g]], blocked):
+            continue
+        count('match_blocked_pairs')
+        for _ in range(attempts):
+            tried += 1
+            h = rng.randrange(n)
+            new_g, new_h = perm[h], perm[g]
+            if new_g == g or new_h == h:
+                continue
+            if _blocked(candidates[g], candidates[new_g], blocked):
+                continue
+            if _blocked(candidates[h], candidates[new_h], blocked):
+                continue
+            perm[g], perm[h] = new_g, new_h
+            break
+        else:
+            count('match_swap_attempts', tried)
+            return False
+    count('match_swap_attempts', tried)
+    return True
+
+
+def _allowed(candidates, g, r, blocked):
+    """
+    Check whether giver index g may buy for receiver index r
+    :param candidates: participant names
+    :param g: giver index
+    :param r: receiver index
+    :param blocked: table from compile_blocked()
+    :return: True if the edge is in the allowed giver->receiver graph
+    """
+    return g != r and not _blocked(candidates[g], candidates[r], blocked)
+
+
+def _reach(candidates, g, remaining, blocked):
+    """
+    Split the receivers not yet visited by a search into those giver g may buy for and the rest.
+    The allowed graph is nearly complete, so rather than storing it we walk the unvisited receivers: every receiver
+    we look at is either visited now or is g itself / blocked for g, so a whole search costs O(people + blocked pairs)
+    instead of O(people^2).
+    :param candidates: participant names
+    :param g: giver index
+    :param remaining: receiver indexes not yet visited
+    :param blocked: table from compile_blocked()
+    :return: (reached receivers, receivers still unvisited)
+    """
+    reached = []
+    kept = []
+    not_for_g = blocked.get(candidates[g], ())
+    for r in remaining:
+        if r != g and candidates[r] not in not_for_g:
+            reached.append(r)
+        else:
+            kept.append(r)
+    return reached, kept
+
+
+def _augment(candidates, root, layers, receiver_of, giver_of, blocked):
+    """
+    Depth-first search for one shortest augmenting path from a free giver through the layered graph, flipping it
+    into the matching if found. Receivers are removed from their layer once tried, so the paths found within a
+    phase never share anyone and a phase never looks at a receiver twice.
+    :param candidates: participant names
+    :param root: unmatched giver index
+    :param layers: layers[d] lists the untried receivers reachable from givers at depth d
+    :param receiver_of: matching, receiver for each giver (updated in place)
+    :param giver_of: matching, giver for each receiver (updated in place)
+    :param blocked: table from compile_blocked()
+    :return: True if the matching grew
+    """
+    givers = [root]
+    receivers = []
+    while givers:
+        u = givers[-1]
+        layer = layers[len(givers) - 1]
+        not_for_u = blocked.get(candidates[u], ())
+        for i, v in enumerate(layer):
+            if v != u and candidates[v] not in not_for_u:
+                del layer[i]
+                break
+        else:
+            # dead end, back up to the previous giver
+            givers.pop()
+            if receivers:
+                receivers.pop()
+            continue
+        receivers.append(v)
+        if giver_of[v] == -1:
+            for g, r in zip(givers, receivers):
+                receiver_of[g] = r
+                giver_of[r] = g
+            return True
+        givers.append(giver_of[v])
+    return False
+
+
+def _max_matching(candidates, blocked, rng, seed=None):
+    """
+    Maximum bipartite matching between givers and receivers (Hopcroft-Karp). Each phase runs one breadth-first
+    search from every unmatched giver to layer the graph, then augments along vertex-disjoint shortest paths.
+    :param candidates: participant names
+    :param blocked: table from compile_blocked()
+    :param rng: random number generator, used to shuffle search order so the result isn't predictable
+    :param seed: optional permutation to start from, its allowed edges are kept. Defaults to a random derangement,
+    which leaves only the blocked givers to be matched by searching
+    :return: (receiver for each giver, giver for each receiver), -1 where unmatched
+    """
+    n = len(candidates)
+    receiver_of = [-1] * n
+    giver_of = [-1] * n
+    if seed is None:
+        seed = random_derangement(n, rng)
+    if seed is not None:
+        for g, r in enumerate(seed):
+            if _allowed(candidates, g, r, blocked):
+                receiver_of[g] = r
+                giver_of[r] = g
+
+    while True:
+        free_givers = [g for g in range(n) if receiver_of[g] == -1]
+        if not free_givers:
+            break
+        remaining = list(range(n))
+        rng.shuffle(remaining)
+        layers = []
+        frontier = free_givers
+        reached_free = False
+        while frontier and not reached_free:
+            layer = []
+            for g in frontier:
+                reached, remaining = _reach(candidates, g, remaining, blocked)
+                layer.extend(reached)
+            layers.append(layer)
+            frontier = [giver_of[r] for r in layer if giver_of[r] != -1]
+            reached_free = len(frontier) < len(layer)
+        if not reached_free:
+            break
+        # only the free receivers in the last layer end a shortest path
+        layers[-1] = [r for r in layers[-1] if giver_of[r] == -1]
+        for g in free_givers:
+            _augment(candidates, g, layers, receiver_of, giver_of, blocked)
+    return receiver_of, giver_of
+
+
+def _hall_violation(candidates, blocked, receiver_of, giver_of, start):
+    """
+    Find the group of givers that makes the roster impossible, starting from a giver left unmatched by a maximum
+    matching. Everyone this group can buy for is already taken by someone in the group, so the group always has
+    one more giver than it has possible receivers.
+    :param candidates: participant names
+    :param blocked: table from compile_blocked()
+    :param receiver_of: maximum matching, receiver for each giver
+    :param giver_of: maximum matching, giver for each receiver
+    :param start: unmatched giver index
+    :return: (givers, receivers) as lists of names
+    """
+    givers = [start]
+    receivers = []
+    remaining = list(range(len(candidates)))
+    frontier = [start]
+    while frontier:
+        next_frontier = []
+        for g in frontier:
+            reached, remaining = _reach(candidates, g, remaining, blocked)
+            for r in reached:
+                receivers.append(r)
+                givers.append(giver_of[r])
+                next_frontier.append(giver_of[r])
+        frontier = next_frontier
+    return [candidates[g] for g in givers], [candidates[r] for r in receivers]
+
+
+def _solve(candidates, blocked, rng, seed=None):
+    """
+    Run the matching solver over a list of names.
+    :return: (pairs, None) if a full assignment exists, otherwise (None, (givers, receivers)) naming a blocking group
+    """
+    receiver_of, giver_of = _max_matching(candidates, blocked, rng, seed=seed)
+    for g, r in enumerate(receiver_of):
+        if r == -1:
+            return None, _hall_violation(candidates, blocked, receiver_of, giver_of, g)
+    return [(giver, candidates[r]) for giver, r in zip(candidates, receiver_of)], None
+
+
+def find_blocking_group(email_dict, blocked_matches=()):
+    """
+    Check whether any valid assignment exists before trying to make one.
+    :param email_dict: Dictionary of participants and their details. We only use the keys of this dict
+    :param blocked_matches: optional list of sets of blocked pairs in format ({'alice', 'bob'}), or a table from
+    compile_blocked()
+    :return: None if the roster can be matched, otherwise (givers, receivers): a group of givers who between them
+    can only buy for the listed receivers, of which there are too few
+    """
+    _, blocking = _solve(list(email_dict.keys()), compile_blocked(blocked_matches), random.Random(0))
+    return blocking
+
+
+def _list_names(names, limit=10):
+    if not names:
+        return "nobody"
+    if len(names) <= limit:
+        return ", ".join(names)
+    return f"{', '.join(names[:limit])} and {len(names) - limit} more"
+
+
+def _report_blocking(blocking):
+    givers, receivers = blocking
+    print(f"❌ No valid assignment exists! {_list_names(givers)} ({len(givers)} people) "
+          f"can only buy for {_list_names(receivers)} ({len(receivers)} people).")
+    print("   Remove some blocked pairs involving these people and try again.")
+
+
+def solve_matches(email_dict, blocked_matches=(), rng=random, seed=None):
+    """
+    Make a giver:receiver assignment with a bipartite matching solver (Hopcroft-Karp). Takes polynomial time however
+    many pairs are blocked, and reports straight away if the blocked pairs make an assignment impossible.
+    :param email_dict: Dictionary of participants and their details. We only use the keys of this dict
+    :param blocked_matches: optional list of sets of blocked pairs in format ({'alice', 'bob'}), or a table from
+    compile_blocked()
+    :param rng: random number generator, shuffles the search so the assignment isn't predictable
+    :param seed: optional permutation of participant indexes to start from
+    :return: list of tuples in format [(giver, receiver)], or False if no valid assignment exists
+    """
+    pairs, blocking = _solve(list(email_dict.keys()), compile_blocked(blocked_matches), rng, seed=seed)
+    if blocking:
+        _report_blocking(blocking)
+        return False
+    return pairs
+
+
+@timed('matching')
+def make_matches(email_dict, blocked_matches=(), rng=random, attempts=100, solver="derangement"):
+    """
+    Randomise a list of participants and match them into giver:receiver pairs, ensuring that no-one is assigned
+    themselves and that (optionally) certain pairings are blocked.
+    The default solver draws a uniformly random derangement (so with no blocked pairs every valid assignment is
+    equally likely), then swaps receivers between givers to get rid of any blocked pairs. If that gets stuck it hands
+    over to the matching solver, which either finishes the job or reports which people make the roster impossible.
+    :param email_dict: Dictionary of participants and their details. We only use the keys of this dict
+    :param blocked_matches: optional list of sets of blocked pairs in format ({'alice', 'bob'}) where we don't want
+    Alice or Bob to be assigned each other
+    :param rng: random number generator, pass random.Random(seed) for a repeatable draw
+    :param attempts: swap partners to try per blocked pair before handing over to the matching solver
+    :param solver: "derangement" (default) or "matching" to go straight to the matching solver, which is quicker
+    for heavily blocked rosters
+    :return: list of tuples in format [(giver, receiver)], or False if no valid assignment exists
+    """
+    candidates = list(email_dict.keys())
+    # compiled once here and shared by the repair step and the solver
+    blocked = compile_blocked(blocked_matches)
+    if solver == "matching":
+        return solve_matches(email_dict, blocked, rng)
+    if solver != "derangement":
+        raise ValueError(f"Unknown solver {solver!r}, expected 'derangement' or 'matching'")
+    perm = random_derangement(len(candidates), rng)
+    if perm is not None:
+        if not blocked or _repair(candidates, perm, blocked, rng, attempts):
+            return [(giver, candidates[receiver]) for giver, receiver in zip(candidates, perm)]
+    # note that blocked_matches is empty by default. Santa only cheats if you tell him to!
+    count('match_solver_fallbacks')
+    return solve_matches(email_dict, blocked, rng, seed=perm)
+
+
+def _rematch(assignments, blocked, rng):
+    """
+    Fill the hole left in an assignment by someone joining or leaving, with the matching solver started from the
+    current pairs. Every pair that is still allowed is kept, so only the givers along one augmenting path change.
+    :param assignments: dictionary of giver: receiver for everyone, with None for the one giver who has nobody
+    :param blocked: table from compile_blocked()
+    :param rng: random number generator
+    :return: dictionary of giver: new receiver for just the givers that changed, or False if no valid assignment
+    exists
+    """
+    candidates = list(assignments.keys())
+    position = {name: i for i, name in enumerate(candidates)}
+    # the giver with nobody starts off matched to themselves, which the solver treats as unmatched
+    seed = [i if assignments[giver] is None else position[assignments[giver]] for i, giver in enumerate(candidates)]
+    pairs, blocking = _solve(candidates, blocked, rng, seed=seed)
+    if blocking:
+        _report_blocking(blocking)
+        return False
+    return {giver: receiver for giver, receiver in pairs if assignments[giver] != receiver}
+
+
+def add_participant(assignments, name, blocked_matches=(), rng=random):
+    """
+    Fit a newcomer into an existing assignment with as few changes as possible. Usually one giver:receiver pair is
+    split in two (giver -> newcomer -> receiver), so only that giver's assignment changes. If blocked pairs rule
+    that out for every pair, the matching solver finds the shortest chain of changes instead.
+    :param assignments: dictionary of giver: receiver
+    :param name: the newcomer
+    :param blocked_matches: optional list of sets of blocked pairs in format ({'alice', 'bob'}), or a table from
+    compile_blocked()
+    :param rng: random number generator, picks which pair the newcomer goes into
+    :return: dictionary of giver: new receiver for the givers that change (the newcomer included), or False if no
+    valid assignment exists
+    """
+    blocked = compile_blocked(blocked_matches)
+    givers = list(assignments.keys())
+    start = rng.randrange(len(givers)) if givers else 0
+    for i in range(len(givers)):
+        giver = givers[(start + i) % len(givers)]
+        receiver = assignments[giver]
+        if not _blocked(giver, name, blocked) and not _blocked(name, receiver, blocked):
+            return {giver: name, name: receiver}
+    current = dict(assignments)
+    current[name] = None
+    return _rematch(current, blocked, rng)
+
+
+def remove_participant(assignments, name, blocked_matches=(), rng=random):
+    """
+    Take someone out of an existing assignment with as few changes as possible. Usually whoever was buying for them
+    takes over their receiver, so only that giver's assignment changes. If that isn't allowed (the two were buying
+    for each other, or the pair is blocked) the matching solver finds the shortest chain of changes instead.
+    :param assignments: dictionary of giver: receiver
+    :param name: the participant leaving
+    :param blocked_matches: optional list of sets of blocked pairs in format ({'alice', 'bob'}), or a table from
+    compile_blocked()
+    :param rng: random number generator
+    :return: dictionary of giver: new receiver for the givers that change, or False if no valid assignment exists
+    """
+    blocked = compile_blocked(blocked_matches)
+    receiver = assignments[name]
+    giver = next(giver for giver, their_receiver in assignments.items() if their_receiver == name)
+    if giver != receiver and not _blocked(giver, receiver, blocked):
+        return {giver: receiver}
+    rest = {other: their_receiver for other, their_receiver in assignments.items() if other != name}
+    if len(rest) < 2:
+        print("❌ No valid assignment exists! A Secret Santa needs at least two people.")
+        return False
+    rest[giver] = None
+    return _rematch(rest, blocked, rng)
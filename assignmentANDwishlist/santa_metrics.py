@@ -0,0 +1,187 @@
+"""
+Optional timing and counters for the slow parts of a run: SMTP and IMAP round trips, MIME parsing, matching and
+saving state. Off unless email_auth.json asks for it:
+
+    "metrics_trace": "santa_trace.jsonl",
+    "metrics_textfile_dir": "/var/lib/node_exporter/textfile_collector"
+
+The trace gets one JSON line per timed step as it finishes plus a summary line per run. The textfile directory gets
+santa_<script>.prom at the end of each run, in the Prometheus text format node_exporter's textfile collector reads.
+Span times are inclusive, so a fetch that parses counts the parsing in both.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+_enabled = False
+_trace = None  # open trace file
+_textfile_dir = None
+_lock = threading.Lock()
+_spans = {}  # (name, labels): [calls, seconds, slowest, errors]
+_counters = {}  # (name, labels): value
+_run = {'id': os.urandom(6).hex(), 'started': time.time(),
+        'script': os.path.splitext(os.path.basename(sys.argv[0]))[0].lstrip('-') or 'python'}
+
+
+def configure(trace=None, textfile_dir=None):
+    """
+    Turn metrics on. Does nothing if neither output is given, so it can be called with whatever the config has.
+    :param trace: path of the JSON-lines trace file, appended to
+    :param textfile_dir: directory to write santa_<script>.prom into at exit
+    :return: None
+    """
+    global _enabled, _trace, _textfile_dir
+    if not trace and not textfile_dir:
+        return
+    if trace and _trace is None:
+        _trace = open(trace, 'a', encoding='utf-8')
+    _textfile_dir = textfile_dir or _textfile_dir
+    if not _enabled:
+        atexit.register(flush)
+    _enabled = True
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _write(record):
+    # called with _lock held
+    if _trace is not None:
+        _trace.write(json.dumps(record) + '\n')
+
+
+@contextmanager
+def span(name, **labels):
+    """
+    Time a block of code, e.g. with span('smtp_send'): ...
+    :param name: what is being timed
+    :param labels: extra fields for the trace and Prometheus labels
+    """
+    if not _enabled:
+        yield
+        return
+    started = time.time()
+    clock = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - clock
+        with _lock:
+            totals = _spans.setdefault(_key(name, labels), [0, 0.0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            totals[3] += error is not None
+            record = dict(labels, ts=round(started, 6), run=_run['id'], span=name, seconds=round(seconds, 6))
+            if error:
+                record['error'] = error
+            _write(record)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as a span.
+    :param name: span name
+    """
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1, **labels):
+    """
+    Add to a counter, e.g. count('messages_sent', kind='assignment').
+    :param name: counter name
+    :param value: amount to add
+    :param labels: Prometheus labels
+    :return: None
+    """
+    if not _enabled:
+        return
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def prometheus_text(now=None):
+    """
+    Render everything measured so far in the Prometheus text exposition format.
+    :param now: end of the run, defaults to the current time
+    :return: text of the .prom file
+    """
+    now = now or time.time()
+    script = (('script', _run['script']),)
+    lines = [
+        '# HELP santa_run_timestamp_seconds When the run finished.',
+        '# TYPE santa_run_timestamp_seconds gauge',
+        f"santa_run_timestamp_seconds{_labels(script)} {now:.3f}",
+        '# HELP santa_run_duration_seconds How long the run took.',
+        '# TYPE santa_run_duration_seconds gauge',
+        f"santa_run_duration_seconds{_labels(script)} {now - _run['started']:.6f}",
+    ]
+    with _lock:
+        spans = sorted(_spans.items())
+        counters = sorted(_counters.items())
+    for metric, kind, help_text, column in (
+            ('santa_span_seconds_total', 'counter', 'Time spent in each step.', 1),
+            ('santa_span_calls_total', 'counter', 'Times each step ran.', 0),
+            ('santa_span_max_seconds', 'gauge', 'Slowest single run of each step.', 2),
+            ('santa_span_errors_total', 'counter', 'Times each step raised an error.', 3)):
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+        for (name, labels), totals in spans:
+            lines.append(f"{metric}{_labels(script + (('span', name),) + labels)} {totals[column]}")
+    declared = set()
+    for (name, labels), value in counters:
+        metric = f'santa_{name}_total'
+        if metric not in declared:
+            declared.add(metric)
+            lines.append(f'# TYPE {metric} counter')
+        lines.append(f"{metric}{_labels(script + labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def flush():
+    """
+    Write the run summary to the trace and the .prom file. Runs by itself at exit once metrics are configured.
+    :return: None
+    """
+    if not _enabled:
+        return
+    now = time.time()
+    with _lock:
+        if _trace is not None:
+            _write({
+                'ts': round(now, 6), 'run': _run['id'], 'script': _run['script'],
+                'seconds': round(now - _run['started'], 6),
+                'counters': {name + _labels(labels): value for (name, labels), value in sorted(_counters.items())},
+            })
+            _trace.flush()
+    if _textfile_dir:
+        path = os.path.join(_textfile_dir, f"santa_{_run['script']}.prom")
+        # written aside and renamed, so the collector never reads half a file
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(prometheus_text(now))
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,239 @@
+import hashlib
+import smtplib
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from email import message_from_bytes, policy
+
+from santa_async import send_concurrently, stopped_reason, QUOTA_WINDOW
+from santa_mail import account_failure, permanent_failure, quota_exceeded
+from santa_metrics import count
+from santa_templates import render_batch
+
+# Sends per email before it is given up on, and the wait before the first retry (doubling each time after)
+MAX_ATTEMPTS = 5
+BACKOFF = 2
+# Sends per email in one run; the rest of its attempts are left for later runs
+TRIES_PER_RUN = 2
+# Longest a run will sit waiting for a retry to come due; anything later is left for the next run
+MAX_WAIT = 60
+# How long an email a run has claimed is left to it; only a run that died takes longer to send one
+LEASE = 10 * 60
+
+
+def message_id(created_at, kind, name, domain, revision=0):
+    """
+    Make the Message-ID for one email of a game. It is the same every time it's worked out, so an email that is
+    sent again after a crash carries the same ID as the first try. Some mail systems drop a second copy with an ID
+    they've already delivered, but many don't: delivery is at least once, and an email that was in flight when a
+    run died can arrive twice.
+    :param created_at: when the game was set up, which tells games apart
+    :param kind: what the email is, e.g. 'assignment'
+    :param name: participant it goes to
+    :param domain: domain of the sending account
+    :param revision: how many times this person's emails have been replaced (see StateStore.change_roster), so a
+        replacement isn't dropped as a duplicate of the email it replaces
+    :return: Message-ID header value
+    """
+    key = f"{created_at or ''}/{kind}/{name}" + (f"/{revision}" if revision else '')
+    key = key.encode('utf-8')
+    return f"<santa-{kind}-{hashlib.sha1(key).hexdigest()[:20]}@{domain}>"
+
+
+def plan(store, kind, name, msg, domain, draft=False):
+    """
+    Put an email in the outbox. Nothing is sent until deliver() runs.
+    :param store: open StateStore
+    :param kind: what the email is
+    :param name: participant it goes to
+    :param msg: EmailMessage
+    :param domain: domain of the sending account, for the Message-ID
+    :param draft: if True, deliver() leaves it alone until store.release_drafts() (a dry run's prepared emails)
+    :return: None
+    """
+    msg_id = message_id(store.get_meta('created_at'), kind, name, domain, store.revisions().get(name, 0))
+    msg['Message-ID'] = msg_id
+    store.plan_message(kind, name, msg_id, msg.as_bytes(), status='draft' if draft else 'planned')
+
+
+def plan_batch(store, kind, emails, domain, draft=False):
+    """
+    Put a batch of emails in the outbox, each rendered from its template just as the store takes it, so the batch
+    is never all in memory at once. Nothing is sent until deliver() runs.
+    :param store: open StateStore
+    :param kind: what the emails are
+    :param emails: iterable of (name, recipient, template, values), see santa_templates.render_batch()
+    :param domain: domain of the sending account, for the Message-IDs
+    :param draft: if True, deliver() leaves them alone until store.release_drafts()
+    :return: number of emails added (people who already had one keep it)
+    """
+    created_at = store.get_meta('created_at')
+    revisions = store.revisions()
+    rendered = render_batch(emails, lambda name: message_id(created_at, kind, name, domain, revisions.get(name, 0)))
+    return store.plan_messages(kind, rendered, status='draft' if draft else 'planned')
+
+
+def deliver(store, kind, accounts, concurrent=False, on_sent=None, max_attempts=MAX_ATTEMPTS,
+            tries_per_run=TRIES_PER_RUN, backoff=BACKOFF, max_wait=MAX_WAIT, lease=LEASE, sessions=None, quiet=False):
+    """
+    Send everything in the outbox of one kind that is still outstanding. Each email is claimed for this run (marked
+    in flight with a lease) before it goes and sent as soon as the server accepts it, so two runs at once never send
+    the same one, and a run that dies part way is picked up where it stopped: once the lease runs out, the emails it
+    was in the middle of sending are sent again (at least once, see message_id()).
+    Failures are retried with exponential backoff, at most tries_per_run times in one run and max_attempts times in
+    all (see StateStore.rearm_failed() to start again); one that's permanent (address rejected) is given up at once.
+    An account that can't log in or connect sends nothing more this run, and its emails stay planned for the next.
+
+    Only as many emails are sent as the accounts have left of their daily limits (counted in the state store
+    across runs). The rest are held back until the first account's quota window rolls over, so a later run sends
+    them and a big round finishes over several days without the bot ever hitting the provider's limit.
+
+    :param store: open StateStore
+    :param kind: what the emails are, e.g. 'assignment'
+    :param accounts: list of santa_async.SendAccount, used in order (or all at once when concurrent); build them
+        with the store's quota_usage() so they know what they've already sent
+    :param concurrent: if True, send over several connections per account at once (see santa_async)
+    :param on_sent: optional callback(name) for each email the server accepts
+    :param max_attempts: sends per email before giving up on it, over all runs
+    :param tries_per_run: sends per email in this run, later ones wait for the next run
+    :param backoff: seconds before the first retry, doubling each time after
+    :param max_wait: longest to wait in this run for a retry to come due
+    :param lease: seconds a claimed email is left to this run before another may take it over
+    :param sessions: optional open transports to send with, one per account in the same order, left open afterwards
+        so a long-running caller keeps its logins; by default each account opens one just for this call (not used
+        when concurrent)
+    :param quiet: if True, say how many emails failed instead of who each was for, for emails whose failure printed
+        next to other names would give away who buys for whom (the errors are still kept in the outbox table)
+    :return: dictionary of status: count for this kind of email once we're done
+    """
+    # marks the emails this run claims
+    owner = uuid.uuid4().hex
+    names = {}
+    attempts = {}
+    # sends of each email in this run, and when the ones still due another try in this run can have it
+    tried = Counter()
+    waiting = {}
+    # emails that have failed and not gone since, and those of them given up on, for the quiet summary
+    failed = set()
+    gave_up = set()
+    stop = []
+    limited = {account.username: account.quota_limited for account in accounts}
+
+    def record(msg_id, result):
+        count(f"messages_{result['status']}", kind=kind)
+        if result['status'] == 'sent':
+            failed.discard(msg_id)
+            store.mark_sent(msg_id)
+            if limited[result['account']]:
+                store.count_sent(result['account'], time.time(), QUOTA_WINDOW)
+            if on_sent:
+                on_sent(names[msg_id])
+        elif result['status'] == 'deferred':
+            if not stop:
+                print(f"⏸️  Stopped sending ({result['error']}), the rest stay in the outbox for the next run.")
+            store.mark_deferred(msg_id)
+            stop.append(msg_id)
+        else:
+            if result.get('permanent') or attempts[msg_id] >= max_attempts:
+                retry = None
+            else:
+                retry = time.time() + backoff * 2 ** (attempts[msg_id] - 1)
+                if tried[msg_id] < tries_per_run:
+                    waiting[msg_id] = retry
+            store.mark_failed(msg_id, result['error'], retry)
+            failed.add(msg_id)
+            if not retry:
+                gave_up.add(msg_id)
+            if quiet:
+                return
+            later = '' if msg_id in waiting else ' (left for the next run)'
+            print(f"⚠️  Couldn't send to {names[msg_id]}: {result['error']}{later if retry else ' (giving up)'}")
+
+    def fit_quota(due):
+        room = sum(account.remaining for account in accounts if not account.exhausted)
+        if len(due) <= room:
+            return due
+        # the first account to start a new window frees up room, one with no window yet starts one now
+        now = time.time()
+        usage = store.quota_usage(now, QUOTA_WINDOW)
+        send_after = min(usage.get(account.username, (0, now))[1] for account in accounts) + QUOTA_WINDOW
+        store.defer_until([row[0] for row in due[room:]], send_after)
+        print(f"📅 {len(due) - room} email(s) would go over the daily sending limit, "
+              f"they'll be sent on a run after {datetime.fromtimestamp(send_after):%a %d %b %H:%M}")
+        return due[:room]
+
+    own_sessions = sessions is None
+    if own_sessions:
+        sessions = [account.open_session() for account in accounts]  # each only connects when first used
+    current = 0
+    try:
+        while not stop:
+            now = time.time()
+            due = fit_quota([row for row in store.due_messages(kind, now, max_attempts)
+                             if tried[row[0]] < tries_per_run])
+            if not due:
+                # only retries this run set up itself are waited for (and not ones held back for the quota since)
+                retry_at = min((at for at in waiting.values() if at > now), default=None)
+                if retry_at is None or retry_at - time.time() > max_wait:
+                    break
+                time.sleep(max(0, retry_at - time.time()))
+                continue
+            if concurrent:
+                # the whole batch is held for as long as the rate limits could take to get through it
+                rate = sum(account.limiter.rate or float('inf') for account in accounts)
+                claimed = set(store.claim([row[0] for row in due], owner, time.time(), lease + len(due) / rate))
+                due = [row for row in due if row[0] in claimed]
+            for msg_id, name, raw, tries in due:
+                names[msg_id] = name
+                attempts[msg_id] = tries + 1
+                tried[msg_id] += 1
+                waiting.pop(msg_id, None)
+                if tries:
+                    count('send_retries', kind=kind)
+            if concurrent:
+                send_concurrently([(row[0], message_from_bytes(row[2], policy=policy.default)) for row in due],
+                                  accounts, on_result=record)
+                for account in accounts:
+                    if account.exhausted:
+                        store.fill_quota(account.username, account.per_day, time.time(), QUOTA_WINDOW)
+                continue
+            for msg_id, name, raw, tries in due:
+                if stop:
+                    break
+                if not store.claim([msg_id], owner, time.time(), lease):
+                    # another run got to it first
+                    continue
+                while True:
+                    while current < len(accounts) and not accounts[current].take():
+                        current += 1
+                    if current == len(accounts):
+                        result = {'status': 'deferred', 'error': stopped_reason(accounts)}
+                        break
+                    try:
+                        sessions[current].send_message(message_from_bytes(raw, policy=policy.default))
+                        result = {'status': 'sent', 'error': None, 'account': accounts[current].username}
+                    except (smtplib.SMTPException, OSError) as e:
+                        if account_failure(e):
+                            # a wrong app password fails every email the same way, so it fails none of them
+                            print(f"⚠️  {accounts[current].username} can't send: {e}")
+                            accounts[current].broken = str(e)
+                            continue
+                        if quota_exceeded(e):
+                            # the server knows better than our count, this account is done for today
+                            print(f"⚠️  {accounts[current].username} reached its sending limit")
+                            accounts[current].exhausted = True
+                            store.fill_quota(accounts[current].username, accounts[current].per_day, time.time(),
+                                             QUOTA_WINDOW)
+                            continue
+                        result = {'status': 'failed', 'error': str(e), 'permanent': permanent_failure(e)}
+                    break
+                record(msg_id, result)
+    finally:
+        if own_sessions:
+            for session in sessions:
+                session.close()
+    if quiet and failed:
+        print(f"⚠️  Couldn't send {len(failed)} email(s), {len(gave_up)} of them given up on (the errors are in "
+              f"the outbox table)")
+    return store.outbox_counts(kind)
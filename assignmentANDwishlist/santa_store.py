@@ -0,0 +1,692 @@
+import json
+import os
+import sqlite3
+
+from santa_metrics import timed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS participants (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    email TEXT NOT NULL,
+    wishlist_received INTEGER NOT NULL DEFAULT 0,
+    assignment_sent INTEGER NOT NULL DEFAULT 0,
+    aliases TEXT
+);
+-- kept apart from participants so listing who has replied never reads the wishlists themselves
+CREATE TABLE IF NOT EXISTS wishlists (
+    name TEXT PRIMARY KEY,
+    content TEXT
+);
+-- running totals for check_status(), kept up to date with every wishlist and sent assignment
+CREATE TABLE IF NOT EXISTS summary (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    giver TEXT PRIMARY KEY,
+    receiver TEXT NOT NULL UNIQUE
+);
+-- givers whose assignment can be written (both wishlists are in) but isn't in the outbox yet, so a run of
+-- send_assignments() only looks at the new work
+CREATE TABLE IF NOT EXISTS ready (
+    giver TEXT PRIMARY KEY
+);
+-- givers who were sent their assignment before their recipient's wishlist came in, and are owed it
+CREATE TABLE IF NOT EXISTS late (
+    giver TEXT PRIMARY KEY
+);
+-- how many times a participant's emails have been replaced by a change to who's playing, so each replacement
+-- gets its own Message-ID
+CREATE TABLE IF NOT EXISTS revisions (
+    name TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS quota (
+    account TEXT PRIMARY KEY,
+    window_start REAL NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    message_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    message BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'planned',  -- draft (from a dry run, not sent until released), planned,
+                                             -- in_flight, sent or failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL DEFAULT 0,  -- not before this time (retry backoff or quota); NULL once we've given up
+    error TEXT,
+    claimed_by TEXT,  -- the run sending it while in_flight, which has it until lease_until
+    lease_until REAL,
+    UNIQUE (kind, name)
+);
+-- what is still to send, without reading past everything already sent
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (kind, status);
+"""
+
+
+def store_path(game_state_file):
+    """
+    Where the database for a game lives: next to the old JSON file, e.g. santa_game_state.json -> santa_game_state.db
+    :param game_state_file: path to game state JSON (or the .db itself)
+    :return: path to the SQLite database
+    """
+    root, ext = os.path.splitext(game_state_file)
+    return game_state_file if ext == '.db' else root + '.db'
+
+
+def game_exists(game_state_file="santa_game_state.json"):
+    """
+    Check whether a game has been set up, either in the database or in an old JSON file still to be imported.
+    :param game_state_file: path to game state JSON
+    :return: True if there is a game to load
+    """
+    return os.path.exists(store_path(game_state_file)) or os.path.exists(game_state_file)
+
+
+class StateStore:
+    """
+    Game state kept in SQLite (WAL mode), so recording one wishlist or one sent assignment is a single row update
+    that is on disk as soon as the call returns, rather than a rewrite of the whole state file.
+
+    Open it with StateStore.open(game_state_file), which imports an existing santa_game_state.json the first time.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path to the SQLite database, created if missing
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # FULL: a committed wishlist or sent flag survives a power cut, not just a crash
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+        if self.conn.execute("SELECT COUNT(*) FROM summary").fetchone()[0] == 0:
+            with self.conn:
+                self._rebuild_summary()
+
+    @classmethod
+    def open(cls, game_state_file="santa_game_state.json"):
+        """
+        Open the store for a game, importing the JSON state file once if there is no database yet.
+        :param game_state_file: path to game state JSON
+        :return: StateStore
+        """
+        path = store_path(game_state_file)
+        fresh = not os.path.exists(path)
+        store = cls(path)
+        if fresh and path != game_state_file and os.path.exists(game_state_file):
+            store.import_json(game_state_file)
+            print(f"Imported {game_state_file} into {path} (the JSON file is no longer updated)")
+        return store
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _rebuild_summary(self):
+        self.conn.execute("DELETE FROM summary")
+        self.conn.execute(
+            "INSERT INTO summary (key, value) "
+            "SELECT 'participants', COUNT(*) FROM participants UNION ALL "
+            "SELECT 'wishlists_received', COUNT(*) FROM participants WHERE wishlist_received UNION ALL "
+            "SELECT 'assignments_sent', COUNT(*) FROM participants WHERE assignment_sent"
+        )
+
+    def _add_to_summary(self, key, amount):
+        if amount:
+            self.conn.execute("UPDATE summary SET value = value + ? WHERE key = ?", (amount, key))
+
+    def _queue_ready(self, name=None):
+        # queue the assignments that just became ready, for everyone or only those name gives or receives
+        where = "(a.giver = :name OR a.receiver = :name) AND " if name is not None else ""
+        self.conn.execute(
+            "INSERT OR IGNORE INTO ready (giver) "
+            "SELECT a.giver FROM assignments a "
+            "JOIN participants g ON g.name = a.giver JOIN participants r ON r.name = a.receiver "
+            f"WHERE {where}g.wishlist_received AND r.wishlist_received AND NOT g.assignment_sent "
+            "AND NOT EXISTS (SELECT 1 FROM outbox WHERE kind = 'assignment' AND outbox.name = a.giver)",
+            {'name': name}
+        )
+
+    def is_empty(self):
+        return self.conn.execute("SELECT COUNT(*) FROM participants").fetchone()[0] == 0
+
+    @timed('state_save')
+    def reset(self, game_state):
+        """
+        Replace everything with a freshly set up game.
+        :param game_state: game state dictionary in the same shape load() returns
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM meta")
+            self.conn.execute("DELETE FROM participants")
+            self.conn.execute("DELETE FROM wishlists")
+            self.conn.execute("DELETE FROM assignments")
+            self.conn.execute("DELETE FROM outbox")
+            self.conn.execute("DELETE FROM ready")
+            self.conn.execute("DELETE FROM late")
+            self.conn.execute("DELETE FROM revisions")
+            self._insert(game_state)
+            self._rebuild_summary()
+            self._queue_ready()
+
+    @timed('state_save')
+    def import_json(self, json_file):
+        """
+        One-time import of a game saved by an older version as JSON.
+        :param json_file: path to santa_game_state.json
+        :return: None
+        """
+        with open(json_file, 'r') as f:
+            self.reset(json.load(f))
+
+    def _insert(self, game_state):
+        self.conn.executemany(
+            "INSERT INTO participants (name, position, email, wishlist_received, assignment_sent, aliases) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (name, position, details['email'], int(details.get('wishlist_received', False)),
+                 int(details.get('assignment_sent', False)),
+                 json.dumps(details['aliases']) if details.get('aliases') else None)
+                for position, (name, details) in enumerate(game_state['participants'].items())
+            ]
+        )
+        self.conn.executemany(
+            "INSERT INTO wishlists (name, content) VALUES (?, ?)",
+            [(name, details['wishlist_content']) for name, details in game_state['participants'].items()
+             if details.get('wishlist_content') is not None]
+        )
+        self.conn.executemany("INSERT INTO assignments (giver, receiver) VALUES (?, ?)",
+                              game_state['assignments'].items())
+        for key, value in game_state.items():
+            if key not in ('participants', 'assignments'):
+                self.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    @timed('state_load')
+    def load(self):
+        """
+        Read the game into the dictionary the rest of the scripts work with. The wishlists themselves are left out,
+        read each with wishlist() when composing the email it goes in.
+        :return: {'assignments': {giver: receiver}, 'participants': {name: {...}}, 'created_at': ..., ...}
+        """
+        game_state = {'assignments': {}, 'participants': {}}
+        rows = self.conn.execute(
+            "SELECT name, email, wishlist_received, assignment_sent, aliases FROM participants ORDER BY position"
+        )
+        for name, email, wishlist_received, assignment_sent, aliases in rows:
+            game_state['participants'][name] = {
+                'email': email,
+                'wishlist_received': bool(wishlist_received),
+                'assignment_sent': bool(assignment_sent),
+            }
+            if aliases:
+                game_state['participants'][name]['aliases'] = json.loads(aliases)
+        rows = self.conn.execute(
+            "SELECT giver, receiver FROM assignments JOIN participants ON name = giver ORDER BY position"
+        )
+        game_state['assignments'] = dict(rows)
+        for key, value in self.conn.execute("SELECT key, value FROM meta"):
+            game_state[key] = json.loads(value)
+        return game_state
+
+    @timed('state_save')
+    def record_wishlist(self, name, content):
+        """
+        Save one participant's wishlist.
+        :param name: participant name
+        :param content: wishlist text
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO wishlists (name, content) VALUES (?, ?)", (name, content))
+            new = self.conn.execute(
+                "UPDATE participants SET wishlist_received = 1 WHERE name = ? AND NOT wishlist_received", (name,)
+            ).rowcount
+            self._add_to_summary('wishlists_received', new)
+            if new:
+                self._queue_ready(name)
+                # whoever already has an assignment for this person got it without the wishlist
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO late (giver) "
+                    "SELECT giver FROM assignments JOIN participants ON participants.name = giver "
+                    "WHERE receiver = ? AND (assignment_sent OR EXISTS "
+                    "(SELECT 1 FROM outbox WHERE kind = 'assignment' AND outbox.name = giver))",
+                    (name,)
+                )
+
+    def wishlist(self, name):
+        """
+        :param name: participant name
+        :return: their wishlist text, or None if they haven't sent one
+        """
+        row = self.conn.execute("SELECT content FROM wishlists WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def summary(self):
+        """
+        The totals check_status() shows, without reading any participant rows.
+        :return: {'participants': int, 'wishlists_received': int, 'assignments_sent': int}
+        """
+        totals = {'participants': 0, 'wishlists_received': 0, 'assignments_sent': 0}
+        totals.update(self.conn.execute("SELECT key, value FROM summary"))
+        return totals
+
+    def roster(self):
+        """
+        Everyone's name, address and whether their wishlist is in, in sign-up order.
+        :return: list of (name, email, wishlist received)
+        """
+        return [(name, email, bool(received)) for name, email, received in self.conn.execute(
+            "SELECT name, email, wishlist_received FROM participants ORDER BY position"
+        )]
+
+    def participant(self, name):
+        """
+        :param name: participant name
+        :return: {'email': str, 'wishlist_received': bool, 'assignment_sent': bool}, or None if they aren't playing
+        """
+        row = self.conn.execute(
+            "SELECT email, wishlist_received, assignment_sent FROM participants WHERE name = ?", (name,)
+        ).fetchone()
+        if not row:
+            return None
+        return {'email': row[0], 'wishlist_received': bool(row[1]), 'assignment_sent': bool(row[2])}
+
+    def assignments(self):
+        """
+        :return: dictionary of giver: receiver
+        """
+        return dict(self.conn.execute(
+            "SELECT giver, receiver FROM assignments JOIN participants ON name = giver ORDER BY position"
+        ))
+
+    def told(self, givers):
+        """
+        Which of these givers have been told their assignment: it was sent, or handed to the mail server.
+        :param givers: iterable of giver names
+        :return: list of giver names
+        """
+        return [giver for giver in givers if self.conn.execute(
+            "SELECT 1 FROM participants WHERE name = :giver AND (assignment_sent OR EXISTS "
+            "(SELECT 1 FROM outbox WHERE kind = 'assignment' AND name = :giver AND status IN ('sent', 'in_flight')))",
+            {'giver': giver}
+        ).fetchone()]
+
+    def revisions(self):
+        """
+        :return: dictionary of name: revision for everyone whose emails have been replaced
+        """
+        return dict(self.conn.execute("SELECT name, revision FROM revisions"))
+
+    def _revise(self, name):
+        self.conn.execute("INSERT OR IGNORE INTO revisions (name, revision) VALUES (?, 0)", (name,))
+        self.conn.execute("UPDATE revisions SET revision = revision + 1 WHERE name = ?", (name,))
+
+    @timed('state_save')
+    def change_roster(self, changes, joined=None, left=None, blocked_matches=None):
+        """
+        Apply a change to who's playing without touching anyone it doesn't affect: add or remove one participant
+        and give the givers in changes their new receivers.
+
+        A changed giver's earlier assignment and late wishlist emails are dropped from the outbox (their
+        replacements get new Message-IDs). If they hadn't been told their assignment yet, the new one just goes on
+        the ready queue when both wishlists are in; if they had, it's up to the caller to tell them.
+        :param changes: dictionary of giver: new receiver, from santa_matching.add_participant() or
+            remove_participant()
+        :param joined: optional (name, email, aliases) of someone joining
+        :param left: optional name of someone leaving
+        :param blocked_matches: optional blocked pairs the change kept to, saved with it for the next one
+        :return: the changed givers who had already been told their assignment
+        """
+        with self.conn:
+            if blocked_matches is not None:
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('blocked_matches', ?)",
+                                  (json.dumps(sorted({tuple(sorted(group)) for group in blocked_matches})),))
+            told = self.told(giver for giver in changes if joined is None or giver != joined[0])
+            if left is not None:
+                received, sent = self.conn.execute(
+                    "SELECT wishlist_received, assignment_sent FROM participants WHERE name = ?", (left,)
+                ).fetchone()
+                for table, column in (('participants', 'name'), ('wishlists', 'name'), ('assignments', 'giver'),
+                                      ('ready', 'giver'), ('late', 'giver'), ('outbox', 'name')):
+                    self.conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (left,))
+                # in case they come back
+                self._revise(left)
+                self._add_to_summary('participants', -1)
+                self._add_to_summary('wishlists_received', -received)
+                self._add_to_summary('assignments_sent', -sent)
+            if joined is not None:
+                name, email, aliases = joined
+                self.conn.execute(
+                    "INSERT INTO participants (name, position, email, aliases) "
+                    "SELECT ?, COALESCE(MAX(position), -1) + 1, ?, ? FROM participants",
+                    (name, email, json.dumps(aliases) if aliases else None)
+                )
+                self._add_to_summary('participants', 1)
+            # every changed row goes before any is written back, so no receiver is ever held twice
+            self.conn.executemany("DELETE FROM assignments WHERE giver = ?", ((giver,) for giver in changes))
+            self.conn.executemany("INSERT INTO assignments (giver, receiver) VALUES (?, ?)", changes.items())
+            for giver in changes:
+                if joined is not None and giver == joined[0]:
+                    continue
+                self.conn.execute(
+                    "DELETE FROM outbox WHERE kind IN ('assignment', 'late_wishlist') AND name = ?", (giver,)
+                )
+                self.conn.execute("DELETE FROM ready WHERE giver = ?", (giver,))
+                self.conn.execute("DELETE FROM late WHERE giver = ?", (giver,))
+                self._revise(giver)
+                self._add_to_summary('assignments_sent', -self.conn.execute(
+                    "UPDATE participants SET assignment_sent = 0 WHERE name = ? AND assignment_sent", (giver,)
+                ).rowcount)
+                if giver not in told:
+                    self._queue_ready(giver)
+        return told
+
+    def ready_assignments(self):
+        """
+        The assignments waiting to be written, in the order the wishlists that completed them came in.
+        :return: list of (giver, giver's email, receiver)
+        """
+        return self.conn.execute(
+            "SELECT giver, email, receiver FROM ready JOIN participants ON name = giver "
+            "JOIN assignments USING (giver) ORDER BY ready.rowid"
+        ).fetchall()
+
+    @timed('state_save')
+    def dequeue_ready(self, givers):
+        """
+        Take givers off the ready queue once their assignment is in the outbox, which sees it through from there.
+        :param givers: iterable of giver names
+        :return: None
+        """
+        with self.conn:
+            self.conn.executemany("DELETE FROM ready WHERE giver = ?", ((giver,) for giver in givers))
+
+    def late_wishlists(self):
+        """
+        The late wishlist updates waiting to be written: the wishlist came in after the giver's assignment.
+        :return: list of (giver, giver's email, receiver whose wishlist it is)
+        """
+        return self.conn.execute(
+            "SELECT giver, email, receiver FROM late JOIN participants ON name = giver "
+            "JOIN assignments USING (giver) ORDER BY late.rowid"
+        ).fetchall()
+
+    @timed('state_save')
+    def dequeue_late(self, givers):
+        """
+        Take givers off the late queue once their update is in the outbox.
+        :param givers: iterable of giver names
+        :return: None
+        """
+        with self.conn:
+            self.conn.executemany("DELETE FROM late WHERE giver = ?", ((giver,) for giver in givers))
+
+    def mark_assignment_sent(self, name):
+        """
+        Record that a giver has been sent their assignment.
+        :param name: giver name
+        :return: None
+        """
+        with self.conn:
+            new = self.conn.execute(
+                "UPDATE participants SET assignment_sent = 1 WHERE name = ? AND NOT assignment_sent", (name,)
+            ).rowcount
+            self._add_to_summary('assignments_sent', new)
+
+    @timed('state_save')
+    def plan_message(self, kind, name, message_id, message, status='planned'):
+        """
+        Add an email to the outbox, unless this person already has one of this kind (then the earlier message, with
+        its Message-ID, is the one that gets sent).
+        :param kind: what the email is, e.g. 'assignment'
+        :param name: participant it goes to
+        :param message_id: stable Message-ID header value
+        :param message: the whole email as bytes
+        :param status: 'draft' to keep it back until release_drafts()
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO outbox (message_id, kind, name, message, status) VALUES (?, ?, ?, ?, ?)",
+                (message_id, kind, name, message, status)
+            )
+
+    def plan_messages(self, kind, messages, status='planned'):
+        """
+        Add a batch of emails to the outbox in one transaction, skipping anyone who already has one of this kind.
+        :param kind: what the emails are
+        :param messages: iterable of (name, message_id, email as bytes), read one at a time (it can be a generator)
+        :param status: 'draft' to keep them back until release_drafts()
+        :return: number of emails added
+        """
+        with self.conn:
+            return self.conn.executemany(
+                "INSERT OR IGNORE INTO outbox (message_id, kind, name, message, status) VALUES (?, ?, ?, ?, ?)",
+                ((message_id, kind, name, message, status) for name, message_id, message in messages)
+            ).rowcount
+
+    def release_drafts(self, kind):
+        """
+        Let the drafts of one kind be sent, exactly as they were written.
+        :param kind: what the emails are
+        :return: number of drafts released
+        """
+        with self.conn:
+            return self.conn.execute(
+                "UPDATE outbox SET status = 'planned' WHERE kind = ? AND status = 'draft'", (kind,)
+            ).rowcount
+
+    def due_messages(self, kind, now, max_attempts):
+        """
+        Outbox emails to send now: new ones, ones left in flight by a run whose claim has run out (it died), and failed
+        ones whose retry time has come. Another run may pick the same ones, so claim() each before sending it.
+        :param kind: what the emails are
+        :param now: current unix time
+        :param max_attempts: attempts after which a message is given up on
+        :return: list of (message_id, name, message bytes, attempts so far)
+        """
+        return self.conn.execute(
+            "SELECT message_id, name, message, attempts FROM outbox "
+            "WHERE kind = ? AND status IN ('planned', 'in_flight', 'failed') AND attempts < ? "
+            "AND next_attempt IS NOT NULL "
+            "AND (CASE status WHEN 'in_flight' THEN lease_until IS NULL OR lease_until <= ? "
+            "ELSE next_attempt <= ? END) "
+            "ORDER BY rowid",
+            (kind, max_attempts, now, now)
+        ).fetchall()
+
+    def given_up(self, kind, max_attempts):
+        """
+        :param kind: what the emails are
+        :param max_attempts: attempts after which a message is given up on
+        :return: number of emails of this kind that failed for good, or ran out of attempts
+        """
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM outbox WHERE kind = ? AND status = 'failed' "
+            "AND (next_attempt IS NULL OR attempts >= ?)",
+            (kind, max_attempts)
+        ).fetchone()[0]
+
+    def rearm_failed(self, kind, max_attempts):
+        """
+        Give the emails of this kind that were given up on a fresh set of attempts, e.g. once the problem that
+        stopped them is fixed.
+        :param kind: what the emails are
+        :param max_attempts: attempts after which a message is given up on
+        :return: number of emails planned again
+        """
+        with self.conn:
+            return self.conn.execute(
+                "UPDATE outbox SET status = 'planned', attempts = 0, next_attempt = 0, error = NULL "
+                "WHERE kind = ? AND status = 'failed' AND (next_attempt IS NULL OR attempts >= ?)",
+                (kind, max_attempts)
+            ).rowcount
+
+    def claim(self, message_ids, owner, now, lease):
+        """
+        Mark emails in flight for one run, which is about to hand them to the mail server. Each is only taken if
+        it's still due and no other run holds it, checked in the same UPDATE, so two runs sending from the same
+        outbox (a collector dispatching and a cron job) never both send it.
+        :param message_ids: outbox Message-IDs, from due_messages()
+        :param owner: something unique to the claiming run
+        :param now: current unix time
+        :param lease: seconds the run has to send them before another may take them over
+        :return: list of the Message-IDs claimed
+        """
+        claimed = []
+        with self.conn:
+            for message_id in message_ids:
+                if self.conn.execute(
+                    "UPDATE outbox SET status = 'in_flight', attempts = attempts + 1, claimed_by = ?, lease_until = ? "
+                    "WHERE message_id = ? AND CASE status "
+                    "WHEN 'in_flight' THEN lease_until IS NULL OR lease_until <= ? "
+                    "WHEN 'planned' THEN next_attempt <= ? WHEN 'failed' THEN next_attempt <= ? ELSE 0 END",
+                    (owner, now + lease, message_id, now, now, now)
+                ).rowcount:
+                    claimed.append(message_id)
+        return claimed
+
+    @timed('state_save')
+    def mark_sent(self, message_id):
+        """
+        Record that the mail server accepted an email, and for an assignment that the giver has had theirs.
+        :param message_id: outbox Message-ID
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute("UPDATE outbox SET status = 'sent', error = NULL WHERE message_id = ?", (message_id,))
+            new = self.conn.execute(
+                "UPDATE participants SET assignment_sent = 1 "
+                "WHERE name = (SELECT name FROM outbox WHERE message_id = ? AND kind = 'assignment') "
+                "AND NOT assignment_sent",
+                (message_id,)
+            ).rowcount
+            self._add_to_summary('assignments_sent', new)
+
+    @timed('state_save')
+    def mark_failed(self, message_id, error, next_attempt):
+        """
+        Record a failed send, to be retried after next_attempt.
+        :param message_id: outbox Message-ID
+        :param error: what went wrong
+        :param next_attempt: unix time to retry after, or None to give up on it
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'failed', error = ?, next_attempt = ? WHERE message_id = ?",
+                (error, next_attempt, message_id)
+            )
+
+    def mark_deferred(self, message_id):
+        """
+        Put an email we didn't get to back to planned, without counting it as an attempt.
+        :param message_id: outbox Message-ID
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'planned', attempts = attempts - 1 WHERE message_id = ?", (message_id,)
+            )
+
+    def defer_until(self, message_ids, send_after):
+        """
+        Hold planned emails back until a later quota window.
+        :param message_ids: outbox Message-IDs
+        :param send_after: unix time they may go out from
+        :return: None
+        """
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'planned', next_attempt = ? WHERE message_id = ?",
+                [(send_after, message_id) for message_id in message_ids]
+            )
+
+    def scheduled(self, kind, now):
+        """
+        :return: (number of emails of this kind held back for a later window, unix time the first may go)
+        """
+        return self.conn.execute(
+            "SELECT COUNT(*), MIN(next_attempt) FROM outbox WHERE kind = ? AND status = 'planned' AND next_attempt > ?",
+            (kind, now)
+        ).fetchone()
+
+    def message_status(self, kind, name):
+        """
+        :param kind: what the email is
+        :param name: participant it goes to
+        :return: status of their outbox email of this kind, or None if there isn't one
+        """
+        row = self.conn.execute("SELECT status FROM outbox WHERE kind = ? AND name = ?", (kind, name)).fetchone()
+        return row[0] if row else None
+
+    def outbox_counts(self, kind):
+        """
+        :return: dictionary of status: number of emails of this kind
+        """
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM outbox WHERE kind = ? GROUP BY status", (kind,)))
+
+    def quota_usage(self, now, window):
+        """
+        How much of their daily limit each account has used. The quota table isn't cleared by reset(): the limit
+        belongs to the account, not the game.
+        :param now: current unix time
+        :param window: length of a quota window in seconds
+        :return: dictionary of account: (emails sent in its current window, unix time the window started)
+        """
+        rows = self.conn.execute("SELECT account, sent, window_start FROM quota WHERE window_start > ?",
+                                 (now - window,))
+        return {account: (sent, window_start) for account, sent, window_start in rows}
+
+    def count_sent(self, account, now, window, count=1):
+        """
+        Add to an account's count for its quota window, starting a new window if the last one has run out.
+        :param account: username it was sent from
+        :param now: current unix time
+        :param window: length of a quota window in seconds
+        :param count: emails sent
+        :return: None
+        """
+        with self.conn:
+            row = self.conn.execute("SELECT window_start FROM quota WHERE account = ?", (account,)).fetchone()
+            if row and row[0] > now - window:
+                self.conn.execute("UPDATE quota SET sent = sent + ? WHERE account = ?", (count, account))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO quota (account, window_start, sent) VALUES (?, ?, ?)",
+                                  (account, now, count))
+
+    def fill_quota(self, account, limit, now, window):
+        """
+        Record an account as having used all of its limit, when the server says so before our own count does.
+        :param account: username
+        :param limit: the account's daily limit
+        :param now: current unix time
+        :param window: length of a quota window in seconds
+        :return: None
+        """
+        used, _ = self.quota_usage(now, window).get(account, (0, now))
+        if used < limit:
+            self.count_sent(account, now, window, count=limit - used)
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    @timed('state_save')
+    def set_meta(self, key, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
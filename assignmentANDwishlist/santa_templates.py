@@ -0,0 +1,190 @@
+"""
+The emails the bot writes. Each one's subject and text live in a file under templates/, so the wording can be changed
+without touching the code:
+
+    Subject: 🎅 Your Secret Santa Assignment: $receiver!
+
+    Ho ho ho! 🎅
+    ...
+
+$receiver (or ${receiver}) is filled in for each email. A $ that isn't followed by a field name is left as it is,
+so "under $10" needs no escaping.
+
+A template is read and split into text and fields once per run, and the headers that are the same on every email
+it writes (From, Reply-To and the MIME headers) are encoded once. render() then goes straight to the bytes the
+outbox stores, and render_batch() yields them one email at a time, so planning 100,000 assignments never builds an
+EmailMessage or holds more than one email in memory.
+"""
+import base64
+import os
+import string
+from email.utils import formataddr, parseaddr
+
+# templates/ next to this file in a checkout; pip installs it beside the modules as santa_email_templates
+_HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(_HERE, 'templates')
+if not os.path.isdir(TEMPLATE_DIR):
+    TEMPLATE_DIR = os.path.join(_HERE, 'santa_email_templates')
+# Longest line a 7bit body may have before it has to be encoded
+MAX_LINE = 78
+# Bytes of text per encoded word in a non-ASCII header, so each one stays within MAX_LINE
+WORD_BYTES = 39
+
+_compiled = {}  # (path, sender, reply_to): MessageTemplate
+
+
+def _is_ascii(text):
+    try:
+        text.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _encoded_words(value):
+    # RFC 2047 base64 words, each short enough to fit on a header line, never splitting a character
+    words = []
+    chunk = b''
+    for char in value:
+        encoded = char.encode('utf-8')
+        if len(chunk) + len(encoded) > WORD_BYTES:
+            words.append(chunk)
+            chunk = b''
+        chunk += encoded
+    words.append(chunk)
+    return '\n '.join(f"=?utf-8?b?{base64.b64encode(word).decode('ascii')}?=" for word in words)
+
+
+def _header(name, value):
+    """
+    One header line, encoded if it isn't plain short ASCII.
+    :return: bytes ending in a newline
+    """
+    line = f"{name}: {value}\n"
+    if _is_ascii(value) and len(line) <= MAX_LINE:
+        return line.encode('ascii')
+    return f"{name}: {_encoded_words(value)}\n".encode('ascii')
+
+
+def _address_header(name, value):
+    """
+    One address header (To, Reply-To). Only the display name is ever encoded, the address itself has to stay as it
+    is for the mail server to deliver to it; a long one is folded before the address instead.
+    :return: bytes ending in a newline
+    """
+    display, address = parseaddr(value)
+    if not display:
+        return f"{name}: {value}\n".encode('ascii')
+    value = formataddr((display, address), 'utf-8')
+    line = f"{name}: {value}\n"
+    if len(line) > MAX_LINE:
+        line = f"{name}: {value[:-len(address) - 3]}\n <{address}>\n"
+    return line.encode('ascii')
+
+
+def _compile(text):
+    """
+    Split template text into literal pieces and fields.
+    :return: list of str (literal) and 1-tuples (field name)
+    """
+    parts = []
+    literal = []
+    position = 0
+    for match in string.Template.pattern.finditer(text):
+        literal.append(text[position:match.start()])
+        field = match.group('named') or match.group('braced')
+        if field:
+            parts.append(''.join(literal))
+            parts.append((field,))
+            literal = []
+        elif match.group('escaped') is not None:
+            literal.append('$')
+        else:
+            literal.append(match.group())
+        position = match.end()
+    literal.append(text[position:])
+    parts.append(''.join(literal))
+    return [part for part in parts if part]
+
+
+def _fill(parts, values):
+    return ''.join(part if isinstance(part, str) else str(values[part[0]]) for part in parts)
+
+
+class MessageTemplate:
+    """
+    One compiled email template, with the headers it shares across every email already encoded. Get one with load().
+    """
+
+    def __init__(self, text, sender="Santa's Workshop", reply_to=None):
+        """
+        :param text: template file contents, a Subject: line, a blank line and the body
+        :param sender: sender name
+        :param reply_to: optional reply-to address
+        """
+        first, _, body = text.partition('\n\n')
+        if not first.startswith('Subject:'):
+            raise ValueError("an email template starts with a 'Subject:' line followed by a blank line")
+        self.subject = _compile(first[len('Subject:'):].strip())
+        self.body = _compile(body)
+        shared = _header('From', sender) + (_address_header('Reply-To', reply_to) if reply_to else b'')
+        shared += b'MIME-Version: 1.0\n'
+        # the encoding depends on the body, so both endings are kept ready
+        self.plain = shared + b'Content-Type: text/plain; charset="us-ascii"\nContent-Transfer-Encoding: 7bit\n\n'
+        self.encoded = shared + b'Content-Type: text/plain; charset="utf-8"\nContent-Transfer-Encoding: base64\n\n'
+
+    def text(self, **values):
+        """
+        Fill in the subject and body, e.g. for a dry run to print.
+        :param values: a value for each field in the template
+        :return: (subject, body)
+        """
+        return _fill(self.subject, values), _fill(self.body, values)
+
+    def render(self, recipient, message_id=None, **values):
+        """
+        Write one complete email.
+        :param recipient: email recipient
+        :param message_id: optional Message-ID header value
+        :param values: a value for each field in the template
+        :return: the email as bytes, as the outbox stores it
+        """
+        subject, body = self.text(**values)
+        if not body.endswith('\n'):
+            body += '\n'
+        head = _address_header('To', recipient) + _header('Subject', subject)
+        if message_id:
+            head += f"Message-ID: {message_id}\n".encode('ascii')
+        if _is_ascii(body) and max(len(line) for line in body.split('\n')) <= MAX_LINE:
+            return head + self.plain + body.encode('ascii')
+        return head + self.encoded + base64.encodebytes(body.encode('utf-8'))
+
+
+def load(name, sender="Santa's Workshop", reply_to=None, directory=TEMPLATE_DIR):
+    """
+    Get a template by name, reading and compiling it the first time it's asked for.
+    :param name: file name under the template directory without .txt, e.g. 'assignment'
+    :param sender: sender name
+    :param reply_to: optional reply-to address
+    :param directory: where the template files are
+    :return: MessageTemplate
+    """
+    path = os.path.join(directory, name + '.txt')
+    key = (path, sender, reply_to)
+    if key not in _compiled:
+        with open(path, encoding='utf-8') as f:
+            _compiled[key] = MessageTemplate(f.read(), sender=sender, reply_to=reply_to)
+    return _compiled[key]
+
+
+def render_batch(emails, message_ids):
+    """
+    Render a batch of emails one at a time, as they're consumed.
+    :param emails: iterable of (name, recipient, template, values) where template is a MessageTemplate and values
+        a dictionary of its fields; a generator keeps the batch out of memory
+    :param message_ids: function giving the Message-ID for a name
+    :return: generator of (name, message_id, email as bytes)
+    """
+    for name, recipient, template, values in emails:
+        msg_id = message_ids(name)
+        yield name, msg_id, template.render(recipient, msg_id, **values)
@@ -0,0 +1,126 @@
+import itertools
+import os
+import time
+from email import message_from_bytes, policy
+
+from santa_async import send_concurrently
+from santa_mail import MailSession, Transport, SMTP_HOST, SMTP_PORT
+
+SPOOL_DIR = 'outgoing_mail'
+
+
+class MemoryTransport(Transport):
+    """
+    Keeps emails in a list instead of sending them, for tests and benchmarks. Each session has its own list
+    unless given one to share.
+    """
+
+    quota_limited = False
+
+    def __init__(self, username=None, password=None, outbox=None):
+        """
+        :param username: account the emails would be sent as
+        :param password: unused
+        :param outbox: list to append sent emails to, a new one if not given
+        """
+        super().__init__(username, password)
+        self.outbox = [] if outbox is None else outbox
+
+    def send_message(self, msg):
+        self.outbox.append(msg)
+        self.sent += 1
+
+
+class SpoolTransport(Transport):
+    """
+    Writes each email to its own .eml file instead of sending it, maildir style: the file is written in tmp/ and
+    moved into new/ once complete, so a crash never leaves half an email for flush_spool() to send.
+    """
+
+    quota_limited = False
+    _counter = itertools.count()
+
+    def __init__(self, username=None, password=None, directory=SPOOL_DIR):
+        """
+        :param username: account the emails will be sent as
+        :param password: unused
+        :param directory: spool directory, created if missing
+        """
+        super().__init__(username, password)
+        self.directory = directory
+        for sub in ('tmp', 'new', 'cur'):
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+
+    def send_message(self, msg):
+        name = f"{time.time():.6f}.{os.getpid()}.{next(self._counter)}.eml"
+        tmp = os.path.join(self.directory, 'tmp', name)
+        with open(tmp, 'wb') as f:
+            f.write(msg.as_bytes())
+        os.replace(tmp, os.path.join(self.directory, 'new', name))
+        self.sent += 1
+
+
+TRANSPORTS = {
+    'smtp': MailSession,
+    'memory': MemoryTransport,
+    'spool': SpoolTransport,
+}
+
+
+def transport_from_config(email_auth):
+    """
+    Work out how to send from email_auth.json. SMTP to Gmail unless it says otherwise, e.g.
+
+        "transport": "spool", "spool_dir": "outgoing_mail"
+        "transport": "smtp", "smtp_host": "localhost", "smtp_port": 2525, "smtp_starttls": false
+
+    :param email_auth: parsed email_auth.json
+    :return: (transport class, keyword arguments for it besides username and password)
+    """
+    name = email_auth.get('transport', 'smtp')
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown transport {name!r} in email_auth.json, expected one of {', '.join(TRANSPORTS)}")
+    options = {}
+    if name == 'smtp':
+        options = {
+            'host': email_auth.get('smtp_host', SMTP_HOST),
+            'port': email_auth.get('smtp_port', SMTP_PORT),
+            'starttls': email_auth.get('smtp_starttls', True),
+        }
+    elif name == 'spool':
+        options = {'directory': email_auth.get('spool_dir', SPOOL_DIR)}
+    return TRANSPORTS[name], options
+
+
+def spooled(directory=SPOOL_DIR):
+    """
+    :param directory: spool directory
+    :return: paths of the emails waiting to be sent, oldest first
+    """
+    new = os.path.join(directory, 'new')
+    if not os.path.isdir(new):
+        return []
+    return [os.path.join(new, name) for name in sorted(os.listdir(new))]
+
+
+def flush_spool(accounts, directory=SPOOL_DIR, on_result=None):
+    """
+    Send everything in the spool in one go, over all the accounts at once (see santa_async.send_all). Each email
+    that is accepted moves from new/ to cur/, so running it again only sends what's left.
+    :param accounts: list of santa_async.SendAccount that really send, e.g. over SMTP
+    :param directory: spool directory
+    :param on_result: optional callback(path, result) as each email finishes
+    :return: per-file report, see santa_async.send_all()
+    """
+    messages = []
+    for path in spooled(directory):
+        with open(path, 'rb') as f:
+            messages.append((path, message_from_bytes(f.read(), policy=policy.default)))
+
+    def done(path, result):
+        if result['status'] == 'sent':
+            os.replace(path, os.path.join(directory, 'cur', os.path.basename(path)))
+        if on_result:
+            on_result(path, result)
+
+    return send_concurrently(messages, accounts, on_result=done)
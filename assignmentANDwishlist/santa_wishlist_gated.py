@@ -1,17 +1,18 @@
-import random
-import copy
-import smtplib
-from email.message import EmailMessage
+import hashlib
 import json
-import imaplib
-import email
+import random
+import time
 from datetime import datetime
 
-with open("email_auth.json") as f:
-    # Read in the auth for your mail account (tested with gmail app password only)
-    email_auth = json.load(f)
-    gmail_username = email_auth['gmail_username']
-    gmail_app_password = email_auth['gmail_app_password']
+from santa_addresses import ParticipantIndex
+from santa_config import mail_config
+from santa_matching import add_participant as match_newcomer, make_matches, remove_participant as match_without
+from santa_metrics import count, span
+from santa_store import StateStore, game_exists, store_path
+
+# The mail modules (santa_inbox, santa_mail, santa_outbox, santa_async) pull in imaplib, smtplib and asyncio, so
+# they're imported by the functions that send or collect. status.py never loads them, nor email_auth.json.
+
 
 def mailer(recipient, message, sender="Santa's Workshop", subject="Secret Santa", reply_to=None):
     """
@@ -23,47 +24,40 @@ def mailer(recipient, message, sender="Santa's Workshop", subject="Secret Santa"
     :param reply_to: optional reply-to address
     :return: None
     """
-    msg = EmailMessage()
-    msg.set_content(message)
-    msg['Subject'] = subject
-    msg['From'] = sender
-    msg['To'] = recipient
-    if reply_to:
-        msg['Reply-To'] = reply_to
-    server = smtplib.SMTP('smtp.gmail.com', 25)
-    server.connect('smtp.gmail.com', 587)
-    server.ehlo()
-    server.starttls()
-    server.ehlo()
-    server.login(gmail_username, gmail_app_password)
-    server.send_message(msg)
-    server.quit()
-    
-
-def make_matches(email_dict, blocked_matches=()):
-    """
-    Randomise a list of participants and match them into giver:receiver pairs, ensuring that no-one is assigned
-    themselves and that (optionally) certain pairings are blocked
-    :param email_dict: Dictionary of participants and their details. We only use the keys of this dict
-    :param blocked_matches: optional list of sets of blocked pairs in format ({'alice', 'bob'}) where we don't want
-    Alice or Bob to be assigned each other
-    :return: list of tuples in format [(giver, receiver)]
-    """
-    candidates = list(email_dict.keys())
-    receivers = copy.copy(candidates)
-    random.shuffle(receivers)
-    pairs = []
-    for giver, receiver in zip(candidates, receivers):
-        if giver == receiver:
-            # we can't have someone send a gift to themselves!
-            print(f"self santa detected! {giver} buys for {receiver}. Retrying")
-            return False
-        if {giver, receiver} in blocked_matches:
-            # note that blocked_matches is empty by default. Santa only cheats if you tell him to!
-            print(f"undesirable secret santa detected! {giver} buys for {receiver}. Retrying")
-            return False
-        pairs.append((giver, receiver))
-    return pairs
+    with open_mail_session() as session:
+        session.send(recipient, message, sender=sender, subject=subject, reply_to=reply_to)
+
+
+def open_mail_session():
+    """
+    Open a reusable session with the bot credentials, for sending many emails over one login.
+    :return: transport from santa_transport, a MailSession unless configured otherwise (use as a context manager)
+    """
+    config = mail_config()
+    return config.transport(config.username, config.password, **config.transport_options)
+
+
+def sending_accounts(store=None):
+    """
+    Every account in email_auth.json, each with its own connections and daily limit, for the bulk senders.
+    :param store: optional open StateStore, so each account starts from what it has already sent today
+    :return: list of santa_async.SendAccount
+    """
+    from santa_async import make_accounts, QUOTA_WINDOW
+
+    config = mail_config()
+    used = {}
+    if store is not None:
+        used = {account: sent for account, (sent, _) in store.quota_usage(time.time(), QUOTA_WINDOW).items()}
+    return make_accounts(config.accounts, used=used, session_class=config.transport, **config.transport_options)
+
+
+def sender_domain():
+    """
+    Domain of the bot's address, used in the Message-IDs of the emails we send.
+    :return: e.g. 'gmail.com'
+    """
+    return mail_config().username.split('@')[-1]
 
 
 def save_game_state(matches, participants, filename="santa_game_state.json"):
@@ -76,7 +70,7 @@ def save_game_state(matches, participants, filename="santa_game_state.json"):
     """
     game_state = {
         'assignments': {},  # giver: receiver
-        'participants': {},  # name: {email, wishlist_received, wishlist_content}
+        'participants': {},  # name: {email, wishlist_received, assignment_sent}
         'created_at': datetime.now().isoformat()
     }
     
@@ -89,189 +83,317 @@ def save_game_state(matches, participants, filename="santa_game_state.json"):
         game_state['participants'][name] = {
             'email': details['email'],
             'wishlist_received': False,
-            'wishlist_content': None,
             'assignment_sent': False
         }
+        if details.get('aliases'):
+            # other addresses they might reply from
+            game_state['participants'][name]['aliases'] = list(details['aliases'])
     
-    with open(filename, 'w') as f:
-        json.dump(game_state, f, indent=2)
+    with StateStore(store_path(filename)) as store:
+        store.reset(game_state)
     
-    print(f"Game state saved to {filename}")
+    print(f"Game state saved to {store.path}")
     return game_state
 
 
 def load_game_state(filename="santa_game_state.json"):
     """
     Load the saved game state
-    :param filename: Name of file to load
-    :return: game_state dictionary or None if file doesn't exist
+    :param filename: Name of file to load (a santa_game_state.json from an older version is imported the first time)
+    :return: game_state dictionary or None if file doesn't exist (without the wishlists, see load_wishlist())
     """
-    try:
-        with open(filename, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        print(f"Error: {filename} not found. Run setup_secret_santa() first!")
+    if not game_exists(filename):
+        print(f"Error: {store_path(filename)} not found. Run setup_secret_santa() first!")
         return None
+    with StateStore.open(filename) as store:
+        return store.load()
+
+
+def load_wishlist(name, filename="santa_game_state.json"):
+    """
+    Read one participant's wishlist, for the email that passes it on to their Secret Santa
+    :param name: participant name
+    :param filename: Name of the game state file
+    :return: wishlist text, or None if they haven't sent one
+    """
+    with StateStore.open(filename) as store:
+        return store.wishlist(name)
 
 
-def send_initial_requests(participants, dry_run=True):
+def send_initial_requests(participants, dry_run=True, concurrent=False, game_state_file="santa_game_state.json"):
     """
     Send the initial wishlist request emails to all participants.
     They must send their wishlist to receive their assignment!
     
     :param participants: Dictionary of participants with names and emails
-    :param dry_run: if True, doesn't send real emails
+    :param dry_run: if True, doesn't send real emails, but keeps them in the outbox as drafts that the real run
+        sends exactly as shown
+    :param concurrent: if True, send over several rate-limited connections at once (for big groups)
+    :param game_state_file: path to game state JSON, the requests go through its outbox
     :return: None
     """
-    msg_template = """Ho ho ho from the North Pole! 🎅
-
-In order to get your Secret Santa assignment, you need to send a letter to Santa with a list of your interests or a wishlist of items under $10!
-
-Simply REPLY to this email with your wishlist or interests, and Santa will reveal your Secret Santa assignment once everyone has responded!
+    from santa_outbox import plan_batch, deliver
+    from santa_templates import load as load_template
 
-Merry Christmas! 🎄
-
-P.S. Don't forget to actually reply to this email with your wishlist!
-"""
+    # templates/wishlist_request.txt; replies have to come back to the inbox we collect from, whichever account sends it
+    letter = load_template('wishlist_request', reply_to=mail_config().username)
     
     print("=" * 60)
     print("SENDING WISHLIST REQUESTS")
     print("=" * 60)
     
-    for name, details in participants.items():
+    def mark_sent(name):
+        print(f"✉️  Sent wishlist request to {name} ({participants[name]['email']})")
+    
+    with StateStore.open(game_state_file) as store:
         if dry_run:
-            print(f"\nDRY RUN - Would send to {details['email']} ({name}):")
-            print(msg_template)
-        else:
-            mailer(
-                details['email'], 
-                msg_template,
-                subject="🎅 Secret Santa - Send Your Wishlist to Get Your Assignment!"
-            )
-            print(f"✉️  Sent wishlist request to {name} ({details['email']})")
+            subject, msg = letter.text()
+            for name, details in participants.items():
+                print(f"\nDRY RUN - Would send to {details['email']} ({name}):")
+                print(msg)
+        # Anyone the dry run already wrote to keeps that draft, Message-ID and all
+        plan_batch(store, 'request', ((name, details['email'], letter, {}) for name, details in participants.items()),
+                   sender_domain(), draft=dry_run)
+        
+        if not dry_run:
+            store.release_drafts('request')
+            counts = deliver(store, 'request', sending_accounts(store), concurrent=concurrent, on_sent=mark_sent)
     
     if not dry_run:
-        print("\n✅ All wishlist requests sent!")
+        if counts.get('sent', 0) == len(participants):
+            print("\n✅ All wishlist requests sent!")
+        else:
+            print(f"\n⚠️  {len(participants) - counts.get('sent', 0)} wishlist request(s) not sent yet.")
+            print("   Run send_queued_emails() later to send them.")
         print("Run check_wishlists() to see who has responded.")
 
 
-def check_wishlists(dry_run=True, game_state_file="santa_game_state.json"):
+def sender_address(from_header):
+    """
+    Pull the bare email address out of a From header, e.g. 'Alice <alice@example.com>' -> 'alice@example.com'
+    :param from_header: From header value
+    :return: email address
+    """
+    from_header = from_header or ""
+    if "<" in from_header:
+        return from_header.split("<")[1].split(">")[0].strip()
+    return from_header.strip()
+
+
+def check_wishlists(dry_run=True, game_state_file="santa_game_state.json", confirm=None, on_wishlist=None):
     """
     Check for wishlist replies and update game state.
-    Does NOT send assignments - use send_assignments() for that.
+    Does NOT send assignments - use send_assignments() for that, or pass a santa_dispatch.Dispatcher's hook.
     
     :param dry_run: if True, doesn't mark emails as read or update state
     :param game_state_file: path to game state JSON
+    :param confirm: optional callback(plan) asked after the preview of a real run (dry_run=False), before anything
+        is saved. The wishlists it was shown are then saved exactly as fetched, without logging in or downloading
+        them a second time. A dry run only previews, without asking
+    :param on_wishlist: optional hook called as on_wishlist(store, name) right after each wishlist is saved
     :return: game_state with updated wishlist info
     """
+    from santa_inbox import connect_inbox, close_inbox
+
+    config = mail_config()
     # Load game state
     game_state = load_game_state(game_state_file)
     if not game_state:
         return None
     
     # Connect to Gmail IMAP
-    mail = imaplib.IMAP4_SSL("imap.gmail.com")
-    mail.login(gmail_username, gmail_app_password)
-    mail.select("inbox")
+    mail = connect_inbox(config.username, config.password, **config.inbox_options)
+    try:
+        if confirm is None or dry_run:
+            collect_wishlists(mail, game_state, dry_run=dry_run, game_state_file=game_state_file,
+                              on_wishlist=on_wishlist)
+        else:
+            plan = plan_wishlists(mail, game_state)
+            if plan and (not plan['wishlists'] or confirm(plan)):
+                commit_wishlists(plan, game_state, mail=mail, game_state_file=game_state_file,
+                                 on_wishlist=on_wishlist)
+    finally:
+        close_inbox(mail)
     
-    # Search for unread emails with "Secret Santa" in subject
-    status, messages = mail.search(None, 'UNSEEN SUBJECT "Secret Santa"')
+    return game_state
+
+
+def collect_wishlists(mail, game_state, dry_run=True, game_state_file="santa_game_state.json", on_wishlist=None):
+    """
+    Process new wishlist replies over an already logged in IMAP connection, so a long-running collector can reuse
+    one connection. check_wishlists() is the one-shot version of this.
     
-    if status != "OK":
+    Only emails that arrived since the last run are fetched: the game state remembers the last processed UID and
+    the mailbox's UIDVALIDITY, so opening a reply in the Gmail web UI no longer hides it from us.
+    
+    :param mail: logged in IMAP connection
+    :param game_state: loaded game state, updated in place
+    :param dry_run: if True, doesn't mark emails as read or update state
+    :param game_state_file: path to game state JSON
+    :param on_wishlist: optional hook called as on_wishlist(store, name) the moment each wishlist is saved, e.g.
+        santa_dispatch.Dispatcher.on_wishlist to send the emails it makes due straight away
+    :return: number of new wishlists found
+    """
+    plan = plan_wishlists(mail, game_state)
+    if not plan:
+        return 0
+    if dry_run:
+        if plan['wishlists']:
+            print(f"⚠️  DRY RUN - {len(plan['wishlists'])} wishlists found but not saved.")
+            print("   Run with dry_run=False to actually save them.\n")
+        return len(plan['wishlists'])
+    return commit_wishlists(plan, game_state, mail=mail, game_state_file=game_state_file, on_wishlist=on_wishlist)
+
+
+def plan_wishlists(mail, game_state):
+    """
+    Fetch and read the new wishlist replies, printing a preview of each, without saving anything or marking
+    anything as read. commit_wishlists() saves the result.
+    
+    :param mail: logged in IMAP connection
+    :param game_state: loaded game state
+    :return: ingest plan {'wishlists': [(uid, name, email, text)], 'seen': UIDs to mark as read, 'sync': the
+        checkpoint it started from, 'next_sync': the checkpoint once saved}, or None if there is nothing new
+    """
+    from santa_inbox import select_inbox, search_new_uids, fetch_headers, fetch_text_bodies
+
+    uidvalidity = select_inbox(mail)
+    
+    # Search for Secret Santa emails we haven't processed yet
+    sync = game_state.get('inbox_sync')
+    # a game that was just set up (or whose mailbox was rebuilt) only looks at replies from this year's round
+    created_at = game_state.get('created_at')
+    since = datetime.strptime(created_at[:10], '%Y-%m-%d') if created_at else None
+    uids, resync = search_new_uids(mail, sync, uidvalidity, since=since)
+    
+    if uids is None:
         print("No messages found!")
-        mail.close()
-        mail.logout()
-        return game_state
+        return None
     
-    email_ids = messages[0].split()
+    if resync and sync:
+        print("ℹ️  Mailbox UIDVALIDITY changed - rescanning the inbox since the game was set up.")
     
-    if not email_ids:
+    if not uids:
         print("No new wishlist emails found.")
-        mail.close()
-        mail.logout()
-        return game_state
+        return None
     
-    print(f"Found {len(email_ids)} unread Secret Santa emails\n")
+    print(f"Found {len(uids)} new Secret Santa emails\n")
+    count('imap_messages', len(uids))
+    
+    # One batched FETCH for the headers and MIME structure of everything new. Bodies are only downloaded for
+    # participants who haven't sent a wishlist yet, and then only the plain text part.
+    headers = fetch_headers(mail, uids)
+    
+    index = ParticipantIndex(game_state)
+    wishlists = []
+    wanted = {}  # uid: (sender_name, sender_email)
+    done = []  # uids to mark as read
+    failed = set()  # uids to try again next run
+    claimed = set()  # participants with a wishlist in this batch already
+    for uid in uids:
+        if uid not in headers:
+            print(f"Error fetching email {uid}")
+            failed.add(uid)
+            continue
+        
+        sender_email = sender_address(headers[uid]['headers'].get("From"))
+        
+        # Find who this person is (any case, +tag or alias of their address)
+        sender_name = index.by_address(sender_email)
+        
+        if not sender_name:
+            print(f"⚠️  Email from {sender_email} not in participants list. Skipping.")
+            continue
+        
+        # Check if they already sent wishlist
+        if game_state['participants'][sender_name]['wishlist_received'] or sender_name in claimed:
+            print(f"ℹ️  {sender_name} already sent their wishlist. Skipping.")
+            done.append(uid)
+            continue
+        
+        claimed.add(sender_name)
+        wanted[uid] = (sender_name, sender_email)
     
-    new_wishlists = 0
+    text_parts = {uid: headers[uid]['text_part'] for uid in wanted if headers[uid]['text_part']}
+    bodies = fetch_text_bodies(mail, text_parts)
     
-    for email_id in email_ids:
-        # Fetch the email
-        status, msg_data = mail.fetch(email_id, "(RFC822)")
-        
-        if status != "OK":
-            print(f"Error fetching email {email_id}")
+    for uid, (sender_name, sender_email) in wanted.items():
+        if uid in text_parts and uid not in bodies:
+            print(f"Error fetching email {uid}")
+            failed.add(uid)
             continue
+        body = bodies.get(uid, "")
         
-        # Parse email
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-                
-                # Get sender
-                from_header = msg.get("From")
-                if "<" in from_header:
-                    sender_email = from_header.split("<")[1].split(">")[0].strip()
-                else:
-                    sender_email = from_header.strip()
-                
-                # Get email body
-                body = ""
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        if part.get_content_type() == "text/plain":
-                            body = part.get_payload(decode=True).decode()
-                            break
-                else:
-                    body = msg.get_payload(decode=True).decode()
-                
-                # Find who this person is
-                sender_name = None
-                for name, details in game_state['participants'].items():
-                    if details['email'].lower() == sender_email.lower():
-                        sender_name = name
-                        break
-                
-                if not sender_name:
-                    print(f"⚠️  Email from {sender_email} not in participants list. Skipping.")
-                    continue
-                
-                # Check if they already sent wishlist
-                if game_state['participants'][sender_name]['wishlist_received']:
-                    print(f"ℹ️  {sender_name} already sent their wishlist. Skipping.")
-                    if not dry_run:
-                        mail.store(email_id, '+FLAGS', '\\Seen')
-                    continue
-                
-                # New wishlist!
-                new_wishlists += 1
-                print(f"🎁 NEW WISHLIST from {sender_name}:")
-                print(f"   Email: {sender_email}")
-                print(f"   Content preview: {body[:100]}...")
-                print()
-                
-                if not dry_run:
-                    # Update game state
-                    game_state['participants'][sender_name]['wishlist_received'] = True
-                    game_state['participants'][sender_name]['wishlist_content'] = body
-                    
-                    # Save updated state
-                    with open(game_state_file, 'w') as f:
-                        json.dump(game_state, f, indent=2)
-                    
-                    # Mark as read
-                    mail.store(email_id, '+FLAGS', '\\Seen')
-    
-    mail.close()
-    mail.logout()
-    
-    if dry_run and new_wishlists > 0:
-        print(f"⚠️  DRY RUN - {new_wishlists} wishlists found but not saved.")
-        print("   Run with dry_run=False to actually save them.\n")
-    elif new_wishlists > 0:
-        print(f"✅ Processed {new_wishlists} new wishlist(s)!\n")
+        # New wishlist!
+        print(f"🎁 NEW WISHLIST from {sender_name}:")
+        print(f"   Email: {sender_email}")
+        print(f"   Content preview: {body[:100]}...")
+        print()
+        wishlists.append((uid, sender_name, sender_email, body))
+        done.append(uid)
+    
+    # The checkpoint only moves up to the first message we couldn't read
+    last_uid = 0 if resync else sync['last_uid']
+    for uid in uids:
+        if uid in failed:
+            break
+        last_uid = uid
+    
+    return {
+        'wishlists': wishlists,
+        'seen': done,
+        'sync': sync,
+        'next_sync': {'uidvalidity': uidvalidity, 'last_uid': last_uid},
+    }
+
+
+def commit_wishlists(plan, game_state, mail=None, game_state_file="santa_game_state.json", on_wishlist=None):
+    """
+    Save the wishlists of a plan from plan_wishlists() exactly as they were previewed, and move the inbox
+    checkpoint past them. Nothing is downloaded again.
     
-    return game_state
+    :param plan: ingest plan from plan_wishlists()
+    :param game_state: loaded game state, updated in place
+    :param mail: optional IMAP connection to mark the emails as read with (the checkpoint is what stops them being
+        collected twice, so a connection that has gone away in the meantime only leaves them unread)
+    :param game_state_file: path to game state JSON
+    :param on_wishlist: optional hook called as on_wishlist(store, name) right after each wishlist is saved
+    :return: number of wishlists saved
+    """
+    import imaplib
+    from santa_inbox import uid_set
+
+    with StateStore.open(game_state_file) as store:
+        if store.get_meta('inbox_sync') != plan['sync']:
+            # another collector has been through the inbox since the preview, it may have saved these already
+            print("⚠️  Wishlists were collected by another run since this check. Nothing saved, check again.")
+            return 0
+        for uid, sender_name, sender_email, body in plan['wishlists']:
+            # Update game state
+            game_state['participants'][sender_name]['wishlist_received'] = True
+            
+            # Save just this wishlist
+            store.record_wishlist(sender_name, body)
+            count('wishlists_collected')
+            if on_wishlist:
+                on_wishlist(store, sender_name)
+        
+        # Save the inbox checkpoint
+        game_state['inbox_sync'] = plan['next_sync']
+        store.set_meta('inbox_sync', game_state['inbox_sync'])
+    
+    if mail is not None and plan['seen']:
+        # Mark as read, all in one command
+        try:
+            with span('imap_store'):
+                mail.uid('STORE', uid_set(plan['seen']), '+FLAGS', '(\\Seen)')
+        except (imaplib.IMAP4.error, OSError):
+            print("ℹ️  Lost the connection to Gmail, so the collected emails stay unread there.")
+    
+    if plan['wishlists']:
+        print(f"✅ Processed {len(plan['wishlists'])} new wishlist(s)!\n")
+    
+    return len(plan['wishlists'])
 
 
 def check_status(game_state_file="santa_game_state.json"):
@@ -282,32 +404,29 @@ def check_status(game_state_file="santa_game_state.json"):
     :param game_state_file: path to game state JSON
     :return: None
     """
-    game_state = load_game_state(game_state_file)
-    if not game_state:
+    if not game_exists(game_state_file):
+        print(f"Error: {store_path(game_state_file)} not found. Run setup_secret_santa() first!")
         return
     
-    received = []
-    pending = []
-    
-    for name, details in game_state['participants'].items():
-        if details['wishlist_received']:
-            received.append(name)
-        else:
-            pending.append(name)
+    # Just the totals and who has replied, the wishlists themselves are never read
+    with StateStore.open(game_state_file) as store:
+        totals = store.summary()
+        roster = store.roster()
     
     print("=" * 60)
     print("SECRET SANTA STATUS")
     print("=" * 60)
-    print(f"\n✅ WISHLISTS RECEIVED ({len(received)}/{len(game_state['participants'])})")
-    for name in received:
-        email = game_state['participants'][name]['email']
-        print(f"   • {name.capitalize()} ({email})")
+    print(f"\n✅ WISHLISTS RECEIVED ({totals['wishlists_received']}/{totals['participants']})")
+    for name, email, received in roster:
+        if received:
+            print(f"   • {name.capitalize()} ({email})")
     
+    pending = totals['participants'] - totals['wishlists_received']
     if pending:
-        print(f"\n⏳ WAITING FOR WISHLISTS ({len(pending)})")
-        for name in pending:
-            email = game_state['participants'][name]['email']
-            print(f"   • {name.capitalize()} ({email})")
+        print(f"\n⏳ WAITING FOR WISHLISTS ({pending})")
+        for name, email, received in roster:
+            if not received:
+                print(f"   • {name.capitalize()} ({email})")
     else:
         print("\n🎉 ALL WISHLISTS RECEIVED!")
         print("   Ready to send assignments! Run: send_assignments()")
@@ -315,22 +434,77 @@ def check_status(game_state_file="santa_game_state.json"):
     print("\n" + "=" * 60)
 
 
-def send_assignments(dry_run=True, game_state_file="santa_game_state.json"):
+def plan_assignments(store, ready=None):
+    """
+    Write the assignment emails of the givers on the ready queue into the outbox, and take them off the queue.
+    :param store: open StateStore
+    :param ready: the queue as read with store.ready_assignments(), read here if not given
+    :return: number of emails added to the outbox
+    """
+    from santa_outbox import plan_batch
+    from santa_templates import load as load_template
+
+    if ready is None:
+        ready = store.ready_assignments()
+    # templates/assignment.txt, each email written as the outbox takes it
+    letter = load_template('assignment')
+    emails = ((giver_name, email, letter, {'receiver': receiver_name.capitalize(),
+                                           'wishlist': store.wishlist(receiver_name)})
+              for giver_name, email, receiver_name in ready)
+    planned = plan_batch(store, 'assignment', emails, sender_domain())
+    store.dequeue_ready(giver_name for giver_name, _, _ in ready)
+    return planned
+
+
+def plan_late_wishlists(store, late=None):
+    """
+    Write the late wishlist updates on the late queue into the outbox, and take them off the queue. Each goes to
+    the giver, so the person whose wishlist it is never finds out who that is.
+    :param store: open StateStore
+    :param late: the queue as read with store.late_wishlists(), read here if not given
+    :return: number of emails added to the outbox
+    """
+    from santa_outbox import plan_batch
+    from santa_templates import load as load_template
+
+    if late is None:
+        late = store.late_wishlists()
+    # templates/late_wishlist.txt
+    letter = load_template('late_wishlist')
+    emails = ((giver_name, email, letter, {'person': receiver_name, 'wishlist': store.wishlist(receiver_name)})
+              for giver_name, email, receiver_name in late)
+    planned = plan_batch(store, 'late_wishlist', emails, sender_domain())
+    store.dequeue_late(giver_name for giver_name, _, _ in late)
+    return planned
+
+
+def send_assignments(dry_run=True, game_state_file="santa_game_state.json", concurrent=False):
     """
     Send Secret Santa assignments to everyone who has submitted a wishlist.
     Can send to everyone at once (if all wishlists received) or individually as they come in.
     
+    Only the givers on the ready queue are looked at: a giver joins it when the second of their own and their
+    recipient's wishlists is recorded, so a run costs time for the new assignments only, however big the group.
+    
     :param dry_run: if True, doesn't send real emails
     :param game_state_file: path to game state JSON
+    :param concurrent: if True, send over several rate-limited connections at once (for big groups)
     :return: None
     """
-    game_state = load_game_state(game_state_file)
-    if not game_state:
+    from santa_outbox import deliver
+    from santa_templates import load as load_template
+
+    if not game_exists(game_state_file):
+        print(f"Error: {store_path(game_state_file)} not found. Run setup_secret_santa() first!")
         return
     
+    with StateStore.open(game_state_file) as store:
+        totals = store.summary()
+        ready = store.ready_assignments()
+    
     # Count how many have submitted wishlists
-    total = len(game_state['participants'])
-    received = sum(1 for p in game_state['participants'].values() if p['wishlist_received'])
+    total = totals['participants']
+    received = totals['wishlists_received']
     
     if received < total:
         print(f"⚠️  WARNING: Only {received}/{total} people have sent wishlists.")
@@ -343,66 +517,39 @@ def send_assignments(dry_run=True, game_state_file="santa_game_state.json"):
     print("\n" + "=" * 60)
     print("SENDING ASSIGNMENTS")
     print("=" * 60)
+    print(f"📬 {len(ready)} new assignment(s) ready")
     
     assignments_sent = 0
+    emails = {giver_name: email for giver_name, email, _ in ready}
     
-    for giver_name, receiver_name in game_state['assignments'].items():
-        giver_details = game_state['participants'][giver_name]
-        receiver_details = game_state['participants'][receiver_name]
-        
-        # Only send if giver has submitted wishlist and hasn't received assignment yet
-        if not giver_details['wishlist_received']:
-            print(f"⏭️  Skipping {giver_name} - hasn't sent wishlist yet")
-            continue
-        
-        if giver_details['assignment_sent']:
-            print(f"⏭️  Skipping {giver_name} - already received assignment")
-            continue
-        
-        # Only send if receiver has submitted wishlist
-        if not receiver_details['wishlist_received']:
-            print(f"⏭️  Skipping {giver_name} - their recipient ({receiver_name}) hasn't sent wishlist yet")
-            continue
-        
-        # Compose assignment email
-        msg = f"""Ho ho ho! 🎅
-
-You are the Secret Santa for {receiver_name.capitalize()}! Don't tell anyone!
-
-They have sent the following message to the North Pole:
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-{receiver_details['wishlist_content']}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-Remember: Items should be under $10!
-
-If you have any questions, please reach out to Santa's Helper, Asmara.
-
-Merry Christmas! 🎄
-"""
-        
+    def mark_sent(giver_name):
+        nonlocal assignments_sent
+        # emails an earlier run planned but didn't finish are sent too, their addresses aren't loaded
+        address = f" ({emails[giver_name]})" if giver_name in emails else ""
+        print(f"✉️  Sent assignment to {giver_name}{address}")
+        assignments_sent += 1
+    
+    with StateStore.open(game_state_file) as store:
         if dry_run:
-            print(f"\n{'='*60}")
-            print(f"DRY RUN - Would send to {giver_name} ({giver_details['email']}):")
-            print(msg)
-            print(f"{'='*60}\n")
+            # templates/assignment.txt
+            letter = load_template('assignment')
+            for giver_name, email, receiver_name in ready:
+                print(f"\n{'='*60}")
+                print(f"DRY RUN - Would send to {giver_name} ({email}):")
+                print(letter.text(receiver=receiver_name.capitalize(), wishlist=store.wishlist(receiver_name))[1])
+                print(f"{'='*60}\n")
         else:
-            mailer(
-                giver_details['email'],
-                msg,
-                subject=f"🎅 Your Secret Santa Assignment: {receiver_name.capitalize()}!"
-            )
-            print(f"✉️  Sent assignment to {giver_name} ({giver_details['email']})")
-            
-            # Mark as sent
-            game_state['participants'][giver_name]['assignment_sent'] = True
-            assignments_sent += 1
+            # Queue them in the outbox, each only counts as sent once the mail server has accepted it
+            plan_assignments(store, ready)
+            # Sends anything planned now, plus whatever an earlier run didn't finish
+            counts = deliver(store, 'assignment', sending_accounts(store), concurrent=concurrent,
+                             on_sent=mark_sent)
+            outstanding = sum(number for status, number in counts.items() if status != 'sent')
+            if outstanding:
+                print(f"\n⚠️  {outstanding} assignment(s) not sent yet, see the messages above.")
+                print("   Anything not given up on is sent the next time you run send_assignments().")
     
     if not dry_run and assignments_sent > 0:
-        # Save updated state
-        with open(game_state_file, 'w') as f:
-            json.dump(game_state, f, indent=2)
         print(f"\n✅ Sent {assignments_sent} assignment(s)!")
     elif dry_run:
         print(f"\n⚠️  DRY RUN - No emails actually sent.")
@@ -410,25 +557,249 @@ Merry Christmas! 🎄
         print(f"\n⚠️  No new assignments to send.")
 
 
-def setup_secret_santa(dry_run=True):
+def send_queued_emails(game_state_file="santa_game_state.json", concurrent=False, retry_failed=False):
+    """
+    Send what is waiting in the outbox: emails held back because they would have gone over the daily sending limit,
+    and failed ones due another try. Nothing new is sent, so run it once a day until nothing is left.
+    
+    An email that has failed too many times (or was rejected outright) is given up on and only counted here; once
+    whatever stopped it is fixed, retry_failed=True gives those a fresh set of tries.
+    
+    :param game_state_file: path to game state JSON
+    :param concurrent: if True, send over several rate-limited connections at once (for big groups)
+    :param retry_failed: if True, try the emails that were given up on again
+    :return: None
+    """
+    from santa_outbox import deliver, MAX_ATTEMPTS
+
+    if not game_exists(game_state_file):
+        print(f"Error: {store_path(game_state_file)} not found. Run setup_secret_santa() first!")
+        return
+    
+    with StateStore.open(game_state_file) as store:
+        for kind, label in (('request', "wishlist request"), ('assignment', "assignment"),
+                            ('late_wishlist', "late wishlist")):
+            if retry_failed:
+                rearmed = store.rearm_failed(kind, MAX_ATTEMPTS)
+                if rearmed:
+                    print(f"🔁 Trying {rearmed} {label}(s) that were given up on again")
+            counts = deliver(store, kind, sending_accounts(store), concurrent=concurrent,
+                             on_sent=lambda name: print(f"✉️  Sent {label} to {name}"))
+            waiting, send_after = store.scheduled(kind, time.time())
+            given_up = store.given_up(kind, MAX_ATTEMPTS)
+            retrying = counts.get('failed', 0) - given_up
+            if waiting:
+                print(f"📅 {waiting} {label}(s) still queued, the next can go after "
+                      f"{datetime.fromtimestamp(send_after):%a %d %b %H:%M}")
+            if retrying:
+                print(f"🔁 {retrying} {label}(s) failed this time and are tried again on the next run")
+            if given_up:
+                print(f"⚠️  {given_up} {label}(s) given up on (the error is in the outbox table). Once it's fixed, "
+                      f"send_queued_emails(retry_failed=True) tries them again.")
+            if counts and not any(counts.get(status) for status in ('planned', 'in_flight', 'failed')):
+                print(f"✅ No {label}s waiting")
+
+
+def _blocked_pairs(store, undesired_matches=()):
+    """
+    The blocked pairs the game was set up with (or last changed with), plus any more given now.
+    :return: list of sets
+    """
+    saved = store.get_meta('blocked_matches')
+    if saved is None:
+        # set up before the blocked pairs were saved with the game
+        print("⚠️  This game has no blocked pairs saved, only undesired_matches given here are kept to.")
+        print("   Pass every blocked pair from setup in undesired_matches; they're saved with this change.")
+        saved = []
+    return [set(group) for group in saved] + [set(group) for group in undesired_matches]
+
+
+def _change_roster(store, changes, blocked, joined=None, left=None, dry_run=True, concurrent=False):
+    """
+    Apply a change from santa_matching.add_participant() or remove_participant() and send only the emails it makes
+    necessary: a new assignment for each giver whose recipient changed after they were told theirs, and a wishlist
+    request for someone joining. Givers who hadn't been told yet get their new assignment the usual way, from
+    send_assignments() once both wishlists are in.
+    
+    Only how many assignments change is shown, never whose, since that would give away who was buying for whom.
+    
+    :param store: open StateStore
+    :param changes: dictionary of giver: new receiver
+    :param blocked: the blocked pairs the change kept to, from _blocked_pairs(), saved for the next one
+    :param joined: optional (name, email, aliases) of someone joining
+    :param left: optional name of someone leaving
+    :param dry_run: if True, nothing is changed or sent
+    :param concurrent: if True, send over several rate-limited connections at once
+    :return: list of (kind, name) of the emails sent, or that would be
+    """
+    from santa_outbox import plan_batch, deliver
+    from santa_templates import load as load_template
+
+    newcomer = joined[0] if joined else None
+    told = store.told(giver for giver in changes if giver != newcomer)
+    emails = [('assignment', giver) for giver in told] + ([('request', newcomer)] if newcomer else [])
+    
+    print(f"🔀 {len([giver for giver in changes if giver != newcomer])} assignment(s) change, "
+          f"{len(told)} Secret Santa(s) already told theirs get a new one")
+    if newcomer:
+        print(f"✉️  {newcomer} gets the wishlist request")
+    if dry_run:
+        print("\n⚠️  DRY RUN - Nothing changed or sent.")
+        return emails
+    
+    told = store.change_roster(changes, joined=joined, left=left, blocked_matches=blocked)
+    # templates/reassignment.txt, or reassignment_no_wishlist.txt until the new recipient's wishlist is in (it then
+    # follows as a late wishlist)
+    letter = load_template('reassignment')
+    waiting = load_template('reassignment_no_wishlist')
+    
+    def reassignments():
+        for giver in told:
+            receiver = changes[giver]
+            wishlist = store.wishlist(receiver)
+            yield (giver, store.participant(giver)['email'], letter if wishlist is not None else waiting,
+                   {'receiver': receiver.capitalize(), 'wishlist': wishlist})
+    
+    plan_batch(store, 'assignment', reassignments(), sender_domain())
+    if newcomer:
+        # templates/wishlist_request.txt
+        request = load_template('wishlist_request', reply_to=mail_config().username)
+        plan_batch(store, 'request', [(newcomer, joined[1], request, {})], sender_domain())
+    sent = []
+    for kind in ('assignment', 'request'):
+        deliver(store, kind, sending_accounts(store), concurrent=concurrent, on_sent=sent.append, quiet=True)
+    print(f"\n✅ Sent {len(sent)} email(s)")
+    if len(sent) < len(emails):
+        print("   Run send_queued_emails() later to send the rest.")
+    return emails
+
+
+def add_participant(name, email, aliases=None, undesired_matches=(), dry_run=True, concurrent=False,
+                    game_state_file="santa_game_state.json"):
+    """
+    Let someone join a game that is already under way, changing as few assignments as possible: usually they are
+    slotted in between one giver and that giver's recipient, so only that one giver is told about a change.
+    Everyone else keeps the assignment they have.
+    
+    The blocked pairs from setup are kept to, and the same change is made on the real run as the dry run shows.
+    
+    :param name: their name
+    :param email: their email address
+    :param aliases: optional other addresses they might reply from
+    :param undesired_matches: more blocked pairs (or groups) involving them, on top of the ones from setup; saved
+        with the game, so later changes keep to them too
+    :param dry_run: if True, nothing is changed or sent
+    :param concurrent: if True, send over several rate-limited connections at once
+    :param game_state_file: path to game state JSON
+    :return: list of (kind, name) of the emails sent (or that would be), or None if they couldn't be added
+    """
+    if not game_exists(game_state_file):
+        print(f"Error: {store_path(game_state_file)} not found. Run setup_secret_santa() first!")
+        return None
+    
+    print("=" * 60)
+    print(f"ADDING {name.upper()}")
+    print("=" * 60)
+    
+    with StateStore.open(game_state_file) as store:
+        if store.participant(name):
+            print(f"Error: {name} is already playing!")
+            return None
+        # seeded from the game and their name, so the dry run and the real run pick the same spot
+        rng = random.Random(f"{store.get_meta('created_at')}/{name}")
+        blocked = _blocked_pairs(store, undesired_matches)
+        changes = match_newcomer(store.assignments(), name, blocked, rng=rng)
+        if not changes:
+            print(f"❌ Could not fit {name} in!")
+            return None
+        return _change_roster(store, changes, blocked, joined=(name, email, list(aliases or [])), dry_run=dry_run,
+                              concurrent=concurrent)
+
+
+def remove_participant(name, undesired_matches=(), dry_run=True, concurrent=False,
+                       game_state_file="santa_game_state.json"):
+    """
+    Take someone out of a game that is already under way, changing as few assignments as possible: usually
+    whoever was buying for them takes over their recipient, so only that one giver is told about a change.
+    Anything still waiting to be sent to them is dropped.
+    
+    The blocked pairs from setup are kept to, and the same change is made on the real run as the dry run shows.
+    
+    :param name: who is leaving
+    :param undesired_matches: more blocked pairs (or groups), on top of the ones from setup; saved with the game
+    :param dry_run: if True, nothing is changed or sent
+    :param concurrent: if True, send over several rate-limited connections at once
+    :param game_state_file: path to game state JSON
+    :return: list of (kind, name) of the emails sent (or that would be), or None if they couldn't be removed
+    """
+    if not game_exists(game_state_file):
+        print(f"Error: {store_path(game_state_file)} not found. Run setup_secret_santa() first!")
+        return None
+    
+    print("=" * 60)
+    print(f"REMOVING {name.upper()}")
+    print("=" * 60)
+    
+    with StateStore.open(game_state_file) as store:
+        if not store.participant(name):
+            print(f"Error: {name} not found in participants!")
+            return None
+        rng = random.Random(f"{store.get_meta('created_at')}/{name}")
+        blocked = _blocked_pairs(store, undesired_matches)
+        changes = match_without(store.assignments(), name, blocked, rng=rng)
+        if not changes:
+            print(f"❌ Could not take {name} out!")
+            return None
+        return _change_roster(store, changes, blocked, left=name, dry_run=dry_run, concurrent=concurrent)
+
+
+def _roster_fingerprint(participants, undesired_matches):
+    """
+    Identify a roster, so a dry run's plan is only reused for the same people and blocked pairs.
+    :return: hex digest
+    """
+    roster = {name: [details['email'], sorted(details.get('aliases') or [])] for name, details in participants.items()}
+    blocked = sorted(sorted(group) for group in undesired_matches)
+    return hashlib.sha1(json.dumps([roster, blocked], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _planned_setup(fingerprint, game_state_file="santa_game_state.json"):
+    """
+    Check for a dry run of setup_secret_santa() for this roster whose emails haven't gone out yet.
+    :param fingerprint: _roster_fingerprint() of the roster about to be set up
+    :param game_state_file: path to game state JSON
+    :return: True if its assignments and drafts are there to send
+    """
+    if not game_exists(game_state_file):
+        return False
+    with StateStore.open(game_state_file) as store:
+        plan = store.get_meta('setup_plan') or {}
+        return plan.get('roster') == fingerprint and store.outbox_counts('request').get('draft', 0) > 0
+
+
+def setup_secret_santa(dry_run=True, participants=None, undesired_matches=(), concurrent=False):
     """
     Initial setup: Create assignments and send wishlist request emails.
     
     :param dry_run: if True, doesn't send real emails
+    :param participants: optional dictionary of participants, instead of the list configured below
+    :param undesired_matches: pairs (or groups) to keep apart when participants is given
+    :param concurrent: if True, send the wishlist requests over several connections at once
     :return: None
     """
-    # Configure your participants here
-    participants = {
-        'alice': {'email': 'alice@example.com'},
-        'bob': {'email': 'bob@example.com'},
-        'chris': {'email': 'chris@example.com'},
-        'dina': {'email': 'dina@example.com'},
-    }
+    if participants is None:
+        # Configure your participants here
+        participants = {
+            'alice': {'email': 'alice@example.com'},  # add 'aliases': [...] for other addresses they reply from
+            'bob': {'email': 'bob@example.com'},
+            'chris': {'email': 'chris@example.com'},
+            'dina': {'email': 'dina@example.com'},
+        }
 
-    # Optional: block certain pairings (e.g., couples)
-    undesired_matches = (
-        # {'alice', 'bob'},  # Uncomment to prevent Alice and Bob from being matched
-    )
+        # Optional: block certain pairings (e.g., couples)
+        undesired_matches = (
+            # {'alice', 'bob'},  # Uncomment to prevent Alice and Bob from being matched
+        )
 
     print("=" * 60)
     print("SECRET SANTA SETUP")
@@ -438,12 +809,19 @@ def setup_secret_santa(dry_run=True):
         print(f"  • {name.capitalize()}")
     print()
 
-    # Make assignments
-    matches = False
-    while not matches:
-        matches = make_matches(participants, blocked_matches=undesired_matches)
-    
-    if matches:
+    fingerprint = _roster_fingerprint(participants, undesired_matches)
+    if not dry_run and _planned_setup(fingerprint):
+        # The dry run already matched everyone and wrote the emails, send exactly those
+        print("✅ Using the assignments and emails from the dry run\n")
+    else:
+        # Make assignments, from a seed that is saved with them
+        # make_matches only gives up when the blocked pairs make a valid assignment impossible
+        seed = random.SystemRandom().randrange(2 ** 32)
+        matches = make_matches(participants, blocked_matches=undesired_matches, rng=random.Random(seed))
+        if not matches:
+            print("❌ Could not make matches from list!")
+            return
+        
         print("✅ Assignments created!")
         if dry_run:
             print("\nAssignments (DRY RUN - for your eyes only):")
@@ -451,23 +829,24 @@ def setup_secret_santa(dry_run=True):
                 print(f"   {giver.capitalize()} → {receiver.capitalize()}")
         print()
         
-        # Save game state
+        # Save game state, and what it was made from so the real run can reuse a dry run's
         save_game_state(matches, participants)
-        
-        # Send initial wishlist requests
-        send_initial_requests(participants, dry_run=dry_run)
-        
-        if not dry_run:
-            print("\n" + "=" * 60)
-            print("NEXT STEPS")
-            print("=" * 60)
-            print("1. Wait for participants to reply with wishlists")
-            print("2. Run: check_status() to see who has responded")
-            print("3. Run: check_wishlists(dry_run=False) to collect wishlists")
-            print("4. Run: send_assignments(dry_run=False) when ready!")
-    else:
-        print("❌ Could not make matches from list!")
-
+        with StateStore.open() as store:
+            store.set_meta('setup_plan', {'seed': seed, 'roster': fingerprint})
+            # kept to when someone joins or leaves later
+            store.set_meta('blocked_matches', sorted(sorted(group) for group in undesired_matches))
+    
+    # Send initial wishlist requests
+    send_initial_requests(participants, dry_run=dry_run, concurrent=concurrent)
+    
+    if not dry_run:
+        print("\n" + "=" * 60)
+        print("NEXT STEPS")
+        print("=" * 60)
+        print("1. Wait for participants to reply with wishlists")
+        print("2. Run: check_status() to see who has responded")
+        print("3. Run: check_wishlists(dry_run=False) to collect wishlists")
+        print("4. Run: send_assignments(dry_run=False) when ready!")
 
 if __name__ == '__main__':
     # STEP 1: Initial setup (run once)
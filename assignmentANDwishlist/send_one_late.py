@@ -1,35 +1,17 @@
 #!/usr/bin/env python3
 """
-Send ONE late wishlist to whoever is buying for the person who just submitted.
-This is a one-time script - it will send to exactly ONE person.
+Send ONE late wishlist to whoever is buying for the person who just submitted, or with --all every late wishlist
+waiting, in one go.
+Each update is recorded once the mail server accepts it, so running it again doesn't send it again (only one
+that was mid-send when a run died can arrive twice).
 NO SPOILERS - You won't see who gets it!
 """
 
-import json
-import smtplib
-from email.message import EmailMessage
-
-# Load credentials
-with open("email_auth.json") as f:
-    email_auth = json.load(f)
-    gmail_username = email_auth['gmail_username']
-    gmail_app_password = email_auth['gmail_app_password']
-
-def mailer(recipient, message, sender="Santa's Workshop", subject="Secret Santa"):
-    """Send an email"""
-    msg = EmailMessage()
-    msg.set_content(message)
-    msg['Subject'] = subject
-    msg['From'] = sender
-    msg['To'] = recipient
-    server = smtplib.SMTP('smtp.gmail.com', 25)
-    server.connect('smtp.gmail.com', 587)
-    server.ehlo()
-    server.starttls()
-    server.ehlo()
-    server.login(gmail_username, gmail_app_password)
-    server.send_message(msg)
-    server.quit()
+from santa_addresses import ParticipantIndex
+from santa_outbox import deliver
+from santa_store import StateStore, game_exists, store_path
+from santa_templates import load as load_template
+from santa_wishlist_gated import load_game_state, load_wishlist, plan_late_wishlists, sending_accounts
 
 def send_single_late_wishlist(person_name, dry_run=True):
     """
@@ -39,19 +21,14 @@ def send_single_late_wishlist(person_name, dry_run=True):
     :param dry_run: If True, don't actually send
     """
     # Load game state
-    try:
-        with open("santa_game_state.json", 'r') as f:
-            game_state = json.load(f)
-    except FileNotFoundError:
-        print("Error: santa_game_state.json not found!")
+    game_state = load_game_state()
+    if not game_state:
         return
     
+    index = ParticipantIndex(game_state)
+    
     # Find this person in the game (case-insensitive)
-    person_name_key = None
-    for name in game_state['participants'].keys():
-        if name.lower() == person_name.lower():
-            person_name_key = name
-            break
+    person_name_key = index.by_name(person_name)
     
     if not person_name_key:
         print(f"Error: {person_name} not found in participants!")
@@ -65,12 +42,8 @@ def send_single_late_wishlist(person_name, dry_run=True):
         print(f"Error: {person_name_key} hasn't submitted a wishlist yet!")
         return
     
-    # Find who's buying for them (case-insensitive)
-    giver_name = None
-    for g_name, r_name in game_state['assignments'].items():
-        if r_name.lower() == person_name_key.lower():
-            giver_name = g_name
-            break
+    # Find who's buying for them
+    giver_name = index.giver_for(person_name_key)
     
     if not giver_name:
         print(f"Error: Couldn't find who's buying for {person_name_key}")
@@ -84,19 +57,8 @@ def send_single_late_wishlist(person_name, dry_run=True):
     print(f"\nSending late wishlist for: {person_name_key}")
     print("(Their Secret Santa will receive it - keeping secret who!)\n")
     
-    # Compose email
-    msg = f"""Ho ho ho! Looks like {person_name_key}'s letter got lost on the way to the North Pole! Here is their wishlist:
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-{receiver_details['wishlist_content']}
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-Remember: Items should be under $10!
-
-If you have any questions, please reach out to Santa's Helper, Asmara.
-
-Merry Christmas! 🎄
-"""
+    # Compose email from templates/late_wishlist.txt
+    _, msg = load_template('late_wishlist').text(person=person_name_key, wishlist=load_wishlist(person_name_key))
     
     if dry_run:
         print("DRY RUN - Would send late wishlist (keeping secret who gets it!)")
@@ -110,39 +72,104 @@ Merry Christmas! 🎄
             print("Cancelled.")
             return
         
-        try:
-            mailer(
-                giver_details['email'],
-                msg,
-                subject=f"🎅 Update: {person_name_key}'s Wishlist Arrived!"
-            )
-            print(f"\nSent late wishlist! (kept secret who received it)")
-        except Exception as e:
-            print(f"Error sending: {e}")
+        with StateStore.open() as store:
+            if store.message_status('late_wishlist', giver_name) == 'sent':
+                print(f"\n{person_name_key}'s Secret Santa already has their late wishlist, not sending it again.")
+                return
+            plan_late_wishlists(store, [(giver_name, giver_details['email'], person_name_key)])
+            # anything an earlier run couldn't send goes along with it
+            deliver(store, 'late_wishlist', sending_accounts(store),
+                    on_sent=lambda name: print(f"\nSent late wishlist! (kept secret who received it)"), quiet=True)
+
+
+def send_late_wishlists(dry_run=True, game_state_file="santa_game_state.json"):
+    """
+    Send every late wishlist waiting: each person whose wishlist came in after their Secret Santa was sent an
+    assignment. The state store queues them as the wishlists are saved, and finds each giver by its assignment
+    index, so nothing is scanned.
+    
+    One confirmation covers the whole batch and it's sent over one login per account. Each update is recorded
+    as sent as soon as the mail server accepts it, so a run that stops part way only sends again the ones it was in
+    the middle of.
+    
+    :param dry_run: If True, don't actually send
+    :param game_state_file: path to game state JSON
+    """
+    if not game_exists(game_state_file):
+        print(f"Error: {store_path(game_state_file)} not found. Run setup_secret_santa() first!")
+        return
+    
+    with StateStore.open(game_state_file) as store:
+        late = store.late_wishlists()
+        
+        print("=" * 60)
+        print("SEND LATE WISHLISTS")
+        print("=" * 60)
+        
+        if not late:
+            print("\nNo late wishlists waiting.")
+            print("Updates that failed to send earlier are retried by send_queued_emails().")
+            return
+        
+        # Only whose wishlist it is, never who gets it
+        print(f"\n{len(late)} late wishlist(s) to pass on:")
+        for _, _, receiver_name in late:
+            print(f"  - {receiver_name}")
+        
+        if dry_run:
+            # templates/late_wishlist.txt
+            letter = load_template('late_wishlist')
+            print("\nDRY RUN - Would send these late wishlists (keeping secret who gets them!)")
+            for _, _, receiver_name in late:
+                print("-" * 60)
+                print(letter.text(person=receiver_name, wishlist=store.wishlist(receiver_name))[1])
+            print("-" * 60)
+            return
+        
+        response = input(f"\nSend {len(late)} late wishlist(s) to their Secret Santas? (yes/no): ")
+        if response.lower() != 'yes':
+            print("Cancelled.")
+            return
+        
+        sent = []
+        plan_late_wishlists(store, late)
+        counts = deliver(store, 'late_wishlist', sending_accounts(store), on_sent=sent.append, quiet=True)
+    
+    print(f"\n✅ Sent {len(sent)} late wishlist(s)! (kept secret who received them)")
+    outstanding = sum(number for status, number in counts.items() if status not in ('sent', 'draft'))
+    if outstanding:
+        print(f"⚠️  {outstanding} not sent yet, run send_queued_emails() later to retry them (it says if any were "
+              f"given up on).")
+
 
 if __name__ == '__main__':
     import sys
     
+    if '--all' in sys.argv:
+        dry_run = '--send' not in sys.argv and '-s' not in sys.argv
+        print("\nDRY RUN MODE\n" if dry_run else "\nSENDING FOR REAL\n")
+        send_late_wishlists(dry_run=dry_run)
+        sys.exit(0)
+    
     print("\nSEND SINGLE LATE WISHLIST")
     print("=" * 60)
     
     # Get the person's name from command line
     if len(sys.argv) < 2:
-        print("\nUsage: python send_one_late_fixed.py <name> [--send]")
+        print("\nUsage: python send_one_late.py <name> [--send]")
+        print("       python send_one_late.py --all [--send]")
         print("\nExample:")
-        print("  python send_one_late_fixed.py rachael        # dry run")
-        print("  python send_one_late_fixed.py rachael --send # actually send")
+        print("  python send_one_late.py rachael        # dry run")
+        print("  python send_one_late.py rachael --send # actually send")
+        print("  python send_one_late.py --all --send   # every late wishlist waiting, one confirmation")
         print()
         
         # Show available names
-        try:
-            with open("santa_game_state.json", 'r') as f:
-                game_state = json.load(f)
+        game_state = load_game_state()
+        if game_state:
             print("Available names:")
             for name in game_state['participants'].keys():
                 print(f"  - {name}")
-        except:
-            pass
         
         sys.exit(1)
     
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the santa_* modules sit next to this directory rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
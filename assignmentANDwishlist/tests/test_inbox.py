@@ -0,0 +1,98 @@
+"""
+Reading the inbox: which UIDs a run asks for, and how FETCH responses are pulled apart.
+"""
+from datetime import datetime
+
+import pytest
+
+from santa_inbox import parse_fetch_response, search_new_uids, select_inbox
+
+HEADERS = b'From: Alice <alice@example.com>\r\nSubject: Re: Secret Santa\r\n\r\n'
+
+
+class SelectOnly:
+    """
+    Just enough of imaplib.IMAP4 for select_inbox(), with or without UIDVALIDITY in the SELECT response.
+    """
+
+    def __init__(self, uidvalidity, on_select=True):
+        self.uidvalidity = uidvalidity
+        self.on_select = on_select
+
+    def select(self, mailbox):
+        return 'OK', [b'3']
+
+    def response(self, code):
+        return code, [str(self.uidvalidity).encode() if self.on_select else None]
+
+    def status(self, mailbox, names):
+        return 'OK', [f'INBOX (UIDVALIDITY {self.uidvalidity})'.encode()]
+
+
+class SearchRecorder:
+    """
+    Just enough of imaplib.IMAP4 to see what search_new_uids() asks for.
+    """
+
+    def __init__(self, uids):
+        self.uids = uids
+        self.criteria = []
+
+    def uid(self, command, charset, criteria):
+        self.criteria.append(criteria)
+        return 'OK', [' '.join(map(str, self.uids)).encode()]
+
+
+@pytest.mark.parametrize('sync, criteria, uids', [
+    ({'uidvalidity': 7, 'last_uid': 3}, 'UID 4:* SUBJECT "Secret Santa"', [4, 5]),
+    # a fresh game (reset() clears the checkpoint) only reads replies from the day it was set up
+    (None, 'SINCE 01-Nov-2024 SUBJECT "Secret Santa"', [2, 4, 5]),
+    ({'uidvalidity': 6, 'last_uid': 3}, 'SINCE 01-Nov-2024 SUBJECT "Secret Santa"', [2, 4, 5]),
+])
+def test_search_new_uids(sync, criteria, uids):
+    mail = SearchRecorder([5, 2, 4])
+    found, resync = search_new_uids(mail, sync, 7, subject='Secret Santa', since=datetime(2024, 11, 1, 18, 30))
+    assert mail.criteria == [criteria]
+    assert found == uids
+    assert resync == (sync is None or sync['uidvalidity'] != 7)
+
+
+@pytest.mark.parametrize('on_select', [True, False])
+def test_select_inbox_reads_uidvalidity(on_select):
+    assert select_inbox(SelectOnly(1712, on_select)) == 1712
+
+
+def test_a_changed_uidvalidity_searches_again_and_keeps_old_uids():
+    # the mailbox was rebuilt, so UIDs at or below the old checkpoint are new messages now
+    mail = SearchRecorder([1, 2])
+    found, resync = search_new_uids(mail, {'uidvalidity': 1, 'last_uid': 40}, select_inbox(SelectOnly(2)))
+    assert (found, resync) == ([1, 2], True)
+
+
+def test_parse_fetch_response_literals_and_lists():
+    data = [
+        (b'1 (UID 5 BODYSTRUCTURE ("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 12 1) '
+         b'BODY[HEADER.FIELDS (FROM SUBJECT MESSAGE-ID)] {%d}' % len(HEADERS), HEADERS),
+        b')',
+        # two literals for one message
+        (b'2 (UID 7 BODY[1] {5}', b'hello'),
+        (b' BODY[2] {5}', b'(x y)'),
+        b')',
+    ]
+    messages = parse_fetch_response(data)
+    assert sorted(messages) == [5, 7]
+    assert messages[5]['BODYSTRUCTURE'] == ['text', 'plain', ['charset', 'utf-8'], None, None, '7bit', '12', '1']
+    assert messages[5]['BODY[HEADER.FIELDS (FROM SUBJECT MESSAGE-ID)]'] == HEADERS
+    # a literal is taken as it is, brackets and all
+    assert messages[7] == {'UID': '7', 'BODY[1]': b'hello', 'BODY[2]': b'(x y)'}
+
+
+def test_parse_fetch_response_quoted_strings_and_unsolicited_flags():
+    data = [
+        b'3 (FLAGS (\\Seen))',
+        b'4 (UID 9 BODYSTRUCTURE ("text" "plain" ("name" "say \\"hi\\"") NIL NIL "base64" 4 1))',
+        None,
+    ]
+    messages = parse_fetch_response(data)
+    assert list(messages) == [9]
+    assert messages[9]['BODYSTRUCTURE'][2] == ['name', 'say "hi"']
@@ -0,0 +1,149 @@
+"""
+The matcher checked against brute force: on rosters small enough to try every permutation, it must find a valid
+assignment exactly when one exists, and never return an invalid one.
+"""
+import itertools
+import random
+from collections import Counter
+
+import pytest
+
+from santa_matching import (add_participant, compile_blocked, find_blocking_group, make_matches,
+                            random_derangement, remove_participant, solve_matches)
+
+SEEDS = range(200)
+
+
+def _roster(rng, size):
+    """
+    :return: (participants dictionary, list of blocked groups) with a random number of pairs and small groups
+    """
+    names = [f'p{i}' for i in range(size)]
+    blocked = [set(rng.sample(names, rng.choice((2, 2, 2, 3)))) for _ in range(rng.randrange(size + 3))
+               if size >= 3]
+    return {name: {'email': f'{name}@example.com'} for name in names}, blocked
+
+
+def _valid(assignment, names, blocked):
+    table = compile_blocked(blocked)
+    return (sorted(assignment) == sorted(names) and sorted(assignment.values()) == sorted(names)
+            and all(giver != receiver and receiver not in table.get(giver, ()) for giver, receiver in assignment.items()))
+
+
+def _feasible(names, blocked):
+    # every permutation, so only for small rosters
+    return any(_valid(dict(zip(names, receivers)), names, blocked) for receivers in itertools.permutations(names))
+
+
+@pytest.mark.parametrize('n', range(2, 9))
+def test_random_derangement_is_a_derangement(n):
+    rng = random.Random(n)
+    for _ in range(200):
+        perm = random_derangement(n, rng)
+        assert sorted(perm) == list(range(n))
+        assert all(i != j for i, j in enumerate(perm))
+
+
+def test_random_derangement_of_one():
+    assert random_derangement(1) is None
+
+
+def test_random_derangement_is_uniform():
+    # the 9 derangements of 4 items, each should come up about 1/9 of the time
+    rng = random.Random(2024)
+    draws = 18000
+    seen = Counter(tuple(random_derangement(4, rng)) for _ in range(draws))
+    assert len(seen) == 9
+    assert all(abs(times - draws / 9) < 0.1 * draws / 9 for times in seen.values())
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_solvers_agree_with_brute_force(seed, capsys):
+    rng = random.Random(seed)
+    participants, blocked = _roster(rng, rng.randrange(1, 7))
+    names = list(participants)
+    feasible = _feasible(names, blocked)
+
+    blocking = find_blocking_group(participants, blocked)
+    assert (blocking is None) == feasible
+    if blocking:
+        # the givers named really can only buy for the receivers named, and there are too few of them
+        givers, receivers = blocking
+        table = compile_blocked(blocked)
+        assert len(receivers) < len(givers)
+        for giver in givers:
+            allowed = {other for other in names if other != giver and other not in table.get(giver, ())}
+            assert allowed <= set(receivers)
+
+    for matches in (solve_matches(participants, blocked, rng),
+                    make_matches(participants, blocked, rng=rng),
+                    make_matches(participants, blocked, rng=rng, solver='matching')):
+        if feasible:
+            assert _valid(dict(matches), names, blocked)
+        else:
+            assert matches is False
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_add_participant_agrees_with_brute_force(seed, capsys):
+    rng = random.Random(seed)
+    participants, blocked = _roster(rng, rng.randrange(2, 6))
+    matches = make_matches(participants, blocked, rng=rng)
+    if not matches:
+        return
+    names = list(participants) + ['new']
+    blocked += [{'new', name} for name in participants if rng.random() < 0.4]
+    assignment = dict(matches)
+
+    changes = add_participant(assignment, 'new', blocked, rng=rng)
+    if not _feasible(names, blocked):
+        assert changes is False
+        return
+    assert changes
+    assignment.update(changes)
+    assert _valid(assignment, names, blocked)
+    # everyone the change doesn't mention keeps their receiver
+    assert all(assignment[giver] == receiver for giver, receiver in matches if giver not in changes)
+
+
+def test_add_participant_splices_into_one_pair():
+    assignment = {'alice': 'bob', 'bob': 'chris', 'chris': 'alice'}
+    changes = add_participant(assignment, 'dina', [{'dina', 'bob'}], rng=random.Random(1))
+    # dina can't follow alice (alice -> dina -> bob) or bob, so she goes between chris and alice
+    assert changes == {'chris': 'dina', 'dina': 'alice'}
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_remove_participant_agrees_with_brute_force(seed, capsys):
+    rng = random.Random(seed)
+    participants, blocked = _roster(rng, rng.randrange(3, 7))
+    matches = make_matches(participants, blocked, rng=rng)
+    if not matches:
+        return
+    leaving = rng.choice(list(participants))
+    names = [name for name in participants if name != leaving]
+    assignment = {giver: receiver for giver, receiver in matches if giver != leaving}
+
+    changes = remove_participant(dict(matches), leaving, blocked, rng=rng)
+    if not _feasible(names, blocked):
+        assert changes is False
+        return
+    assert changes
+    assignment.update(changes)
+    assert _valid(assignment, names, blocked)
+    assert all(assignment[giver] == receiver for giver, receiver in matches
+               if giver != leaving and giver not in changes)
+
+
+def test_remove_participant_closes_the_gap():
+    assignment = {'alice': 'bob', 'bob': 'chris', 'chris': 'dina', 'dina': 'alice'}
+    assert remove_participant(assignment, 'bob') == {'alice': 'chris'}
+
+
+def test_remove_participant_from_a_pair_of_givers():
+    # alice and bob buy for each other, so bob can't just take over alice's receiver
+    changes = remove_participant({'alice': 'bob', 'bob': 'alice', 'chris': 'dina', 'dina': 'chris'}, 'alice',
+                                 rng=random.Random(0))
+    assignment = {'bob': None, 'chris': 'dina', 'dina': 'chris'}
+    assignment.update(changes)
+    assert _valid(assignment, ['bob', 'chris', 'dina'], [])
@@ -0,0 +1,219 @@
+"""
+The outbox against an in-memory store and transport: what state each email ends up in, and which failures stop a
+run rather than use up an email's tries.
+"""
+import smtplib
+import time
+
+import pytest
+
+from santa_async import QUOTA_WINDOW, SendAccount, make_accounts
+from santa_mail import build_message
+from santa_outbox import deliver, plan
+from santa_store import StateStore
+from santa_transport import MemoryTransport
+
+NAMES = ['alice', 'bob', 'chris']
+
+
+class FailingTransport(MemoryTransport):
+    """
+    Raises the errors listed for the recipient's name (or under None, for any recipient) in turn, one per send,
+    then sends normally.
+    """
+
+    errors = {}
+
+    def send_message(self, msg):
+        for key in (str(msg['To']).split('@')[0], None):
+            if self.errors.get(key):
+                raise self.errors[key].pop(0)
+        super().send_message(msg)
+
+
+@pytest.fixture
+def store():
+    store = StateStore(':memory:')
+    store.set_meta('created_at', '2024-11-01T12:00:00')
+    for name in NAMES:
+        plan(store, 'assignment', name, build_message(f'{name}@example.com', f'Hello {name}'), 'example.com')
+    yield store
+    store.close()
+
+
+def _accounts(transport, count=1):
+    return make_accounts([{'username': f'santa{i}@example.com', 'password': 'x'} for i in range(count)],
+                         session_class=transport)
+
+
+def _statuses(store):
+    return {name: store.message_status('assignment', name) for name in NAMES}
+
+
+def test_ledger_states(capsys):
+    store = StateStore(':memory:')
+    plan(store, 'request', 'alice', build_message('alice@example.com', 'Hello'), 'example.com', draft=True)
+    sent = []
+    accounts = make_accounts([{'username': 'santa@example.com', 'password': 'x'}],
+                             session_class=MemoryTransport, outbox=sent)
+    # a dry run's draft stays put
+    assert deliver(store, 'request', accounts) == {'draft': 1}
+    assert store.release_drafts('request') == 1
+    assert store.outbox_counts('request') == {'planned': 1}
+    # planning it again keeps the first one
+    plan(store, 'request', 'alice', build_message('alice@example.com', 'Hello again'), 'example.com')
+    assert deliver(store, 'request', accounts) == {'sent': 1}
+    assert [msg.get_content() for msg in sent] == ['Hello\n']
+    # and nothing is sent twice
+    assert deliver(store, 'request', accounts) == {'sent': 1}
+    assert len(sent) == 1
+    store.close()
+
+
+class Crash(Exception):
+    pass
+
+
+def test_a_run_that_dies_is_picked_up_where_it_stopped(store, monkeypatch, capsys):
+    monkeypatch.setattr(FailingTransport, 'errors', {'bob': [Crash()]})
+    with pytest.raises(Crash):
+        # lease=0 so the next run needn't wait ten minutes to take over
+        deliver(store, 'assignment', _accounts(FailingTransport), lease=0)
+    assert _statuses(store) == {'alice': 'sent', 'bob': 'in_flight', 'chris': 'planned'}
+
+    sent = []
+    deliver(store, 'assignment', make_accounts([{'username': 'santa@example.com', 'password': 'x'}],
+                                               session_class=MemoryTransport, outbox=sent))
+    assert sorted(str(msg['To']) for msg in sent) == ['bob@example.com', 'chris@example.com']
+    assert set(_statuses(store).values()) == {'sent'}
+
+
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_wrong_password_leaves_everything_planned(store, concurrent, monkeypatch, capsys):
+    error = smtplib.SMTPAuthenticationError(535, b'5.7.8 Username and Password not accepted')
+    monkeypatch.setattr(FailingTransport, 'errors', {None: [error] * 10})
+    deliver(store, 'assignment', _accounts(FailingTransport), concurrent=concurrent, backoff=0)
+    assert set(_statuses(store).values()) == {'planned'}
+    assert store.due_messages('assignment', 0, 5)
+    assert "couldn't log in or connect" in capsys.readouterr().out
+
+
+def test_another_account_takes_over_from_one_that_cant_log_in(store, monkeypatch, capsys):
+    monkeypatch.setattr(FailingTransport, 'errors', {None: [smtplib.SMTPAuthenticationError(535, b'bad password')]})
+    deliver(store, 'assignment', _accounts(FailingTransport, count=2), backoff=0)
+    assert set(_statuses(store).values()) == {'sent'}
+
+
+def test_rejected_address_is_given_up(store, monkeypatch, capsys):
+    refused = smtplib.SMTPRecipientsRefused({'alice@example.com': (550, b'5.1.1 No such user')})
+    monkeypatch.setattr(FailingTransport, 'errors', {'alice': [refused]})
+    deliver(store, 'assignment', _accounts(FailingTransport), backoff=0)
+    assert _statuses(store) == {'alice': 'failed', 'bob': 'sent', 'chris': 'sent'}
+
+
+def test_retries_are_capped_per_run_and_kept_for_the_next(store, monkeypatch, capsys):
+    busy = smtplib.SMTPDataError(451, b'4.3.0 Try again later')
+    monkeypatch.setattr(FailingTransport, 'errors', {'alice': [busy] * 3, 'bob': [busy]})
+    deliver(store, 'assignment', _accounts(FailingTransport), tries_per_run=2, backoff=0)
+    # alice failed twice, bob once then went through on his second try
+    assert _statuses(store) == {'alice': 'failed', 'bob': 'sent', 'chris': 'sent'}
+    assert store.given_up('assignment', 5) == 0
+    assert [row[3] for row in store.due_messages('assignment', float('inf'), 5)] == [2]
+
+    deliver(store, 'assignment', _accounts(FailingTransport), backoff=0)
+    assert _statuses(store)['alice'] == 'sent'
+
+
+def test_running_out_of_attempts_gives_up_until_rearmed(store, monkeypatch, capsys):
+    busy = smtplib.SMTPDataError(451, b'4.3.0 Try again later')
+    monkeypatch.setattr(FailingTransport, 'errors', {'alice': [busy] * 4})
+    for _ in range(2):
+        deliver(store, 'assignment', _accounts(FailingTransport), max_attempts=3, tries_per_run=2, backoff=0)
+    assert _statuses(store)['alice'] == 'failed'
+    assert store.given_up('assignment', 3) == 1
+    assert store.due_messages('assignment', float('inf'), 3) == []
+    assert '(giving up)' in capsys.readouterr().out
+
+    assert store.rearm_failed('assignment', 3) == 1
+    deliver(store, 'assignment', _accounts(FailingTransport), max_attempts=3, backoff=0)
+    assert set(_statuses(store).values()) == {'sent'}
+
+
+def test_quiet_counts_failures_without_names(store, monkeypatch, capsys):
+    refused = smtplib.SMTPRecipientsRefused({'alice@example.com': (550, b'5.1.1 No such user')})
+    monkeypatch.setattr(FailingTransport, 'errors', {'alice': [refused]})
+    deliver(store, 'assignment', _accounts(FailingTransport), backoff=0, quiet=True)
+    out = capsys.readouterr().out
+    assert 'alice' not in out
+    assert "Couldn't send 1 email(s), 1 of them given up on" in out
+
+
+def test_a_claimed_email_is_left_to_the_run_holding_it(store, capsys):
+    alice = store.due_messages('assignment', 0, 5)[0][0]
+    now = time.time()
+    assert store.claim([alice], 'collector', now, 600) == [alice]
+    # a cron run starting meanwhile neither sees nor claims it
+    assert store.claim([alice], 'cron', now + 1, 600) == []
+    transport = []
+    deliver(store, 'assignment', make_accounts([{'username': 'santa@example.com', 'password': 'x'}],
+                                               session_class=MemoryTransport, outbox=transport))
+    assert sorted(str(msg['To']) for msg in transport) == ['bob@example.com', 'chris@example.com']
+    assert _statuses(store)['alice'] == 'in_flight'
+
+
+def test_an_expired_claim_is_taken_over(store):
+    alice = store.due_messages('assignment', 0, 5)[0][0]
+    store.claim([alice], 'died', 100.0, 600)
+    assert alice not in [row[0] for row in store.due_messages('assignment', 699.0, 5)]
+    assert alice in [row[0] for row in store.due_messages('assignment', 700.0, 5)]
+    assert store.claim([alice], 'next run', 700.0, 600) == [alice]
+
+
+def test_backoff_doubles_and_is_kept_for_later_runs(store, monkeypatch, capsys):
+    busy = smtplib.SMTPDataError(451, b'4.3.0 Try again later')
+    monkeypatch.setattr(FailingTransport, 'errors', {'alice': [busy] * 2})
+    for attempt in (1, 2):
+        before = time.time()
+        deliver(store, 'assignment', _accounts(FailingTransport), tries_per_run=1, backoff=100, max_wait=0)
+        retry_at, = store.conn.execute("SELECT next_attempt FROM outbox WHERE name = 'alice'").fetchone()
+        # the first retry waits 100s, the second 200s
+        assert before + 100 * attempt <= retry_at <= time.time() + 100 * attempt
+        assert store.due_messages('assignment', retry_at - 1, 5) == []
+        store.conn.execute("UPDATE outbox SET next_attempt = 0 WHERE name = 'alice'")
+    deliver(store, 'assignment', _accounts(FailingTransport))
+    assert set(_statuses(store).values()) == {'sent'}
+
+
+def _limited(username, per_day, sent, used=0, transport=MemoryTransport):
+    # quota_limited like a real SMTP account, but sending into a list
+    return SendAccount(username, lambda: transport(username, outbox=sent), per_minute=None, per_day=per_day,
+                       used=used)
+
+
+def test_what_goes_over_the_daily_limit_waits_for_the_next_window(store, capsys):
+    sent = []
+    deliver(store, 'assignment', [_limited('santa@example.com', 2, sent)])
+    assert len(sent) == 2
+    waiting, send_after = store.scheduled('assignment', time.time())
+    assert waiting == 1
+    used, window_start = store.quota_usage(time.time(), QUOTA_WINDOW)['santa@example.com']
+    # the window starts with the run (a moment before its first email is counted)
+    assert used == 2 and send_after == pytest.approx(window_start + QUOTA_WINDOW, abs=5)
+
+    # a run later the same day builds its accounts from what's been used, so it sends nothing more
+    deliver(store, 'assignment', [_limited('santa@example.com', 2, sent, used=used)])
+    assert len(sent) == 2
+    assert store.due_messages('assignment', send_after, 5)
+
+
+def test_an_account_the_server_says_is_over_quota_hands_over(store, monkeypatch, capsys):
+    over = smtplib.SMTPDataError(550, b'5.4.5 Daily user sending quota exceeded')
+    monkeypatch.setattr(FailingTransport, 'errors', {None: [over]})
+    first, second = [], []
+    deliver(store, 'assignment', [_limited('one@example.com', 100, first, transport=FailingTransport),
+                                  _limited('two@example.com', 100, second, transport=FailingTransport)])
+    assert (len(first), len(second)) == (0, 3)
+    assert set(_statuses(store).values()) == {'sent'}
+    # the server knows best: the first account counts as full until its window rolls over
+    usage = store.quota_usage(time.time(), QUOTA_WINDOW)
+    assert usage['one@example.com'][0] == 100 and usage['two@example.com'][0] == 3
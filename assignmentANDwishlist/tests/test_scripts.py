@@ -0,0 +1,26 @@
+"""
+Import smoke test for the command line scripts, which nothing else imports: each has to at least parse and import
+without running anything.
+"""
+import importlib
+import json
+import os
+
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = sorted(name[:-3] for name in os.listdir(HERE)
+                 if name.endswith('.py') and not name.startswith('santa_') and name != 'conftest.py')
+
+
+def test_every_script_has_an_importable_name():
+    assert all(name.isidentifier() for name in SCRIPTS)
+
+
+@pytest.mark.parametrize('name', SCRIPTS)
+def test_script_imports(name, tmp_path, monkeypatch):
+    # some read the mail settings as they load
+    (tmp_path / 'email_auth.json').write_text(json.dumps({'gmail_username': 'santa@example.com',
+                                                          'gmail_app_password': 'x'}))
+    monkeypatch.chdir(tmp_path)
+    importlib.import_module(name)
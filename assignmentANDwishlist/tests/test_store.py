@@ -0,0 +1,87 @@
+"""
+StateStore.change_roster() on random games: whatever changes, the running totals, the assignments and the ready
+queue must agree with the participant rows, as if the game had been set up that way.
+"""
+import random
+
+import pytest
+
+from santa_matching import add_participant, make_matches, remove_participant
+from santa_store import StateStore
+
+SEEDS = range(100)
+
+
+def _game(rng, size):
+    names = [f'p{i}' for i in range(size)]
+    matches = dict(make_matches({name: {} for name in names}, [], rng=rng))
+    participants = {}
+    for name in names:
+        received = rng.random() < 0.6
+        participants[name] = {'email': f'{name}@example.com', 'wishlist_received': received,
+                              'wishlist_content': f'{name} wants socks' if received else None,
+                              'assignment_sent': rng.random() < 0.3}
+    return {'participants': participants, 'assignments': matches, 'created_at': '2024-11-01T12:00:00'}
+
+
+def _check(store, told=()):
+    rows = {name: (received, sent) for name, received, sent in store.conn.execute(
+        "SELECT name, wishlist_received, assignment_sent FROM participants")}
+    assert store.summary() == {'participants': len(rows),
+                               'wishlists_received': sum(received for received, _ in rows.values()),
+                               'assignments_sent': sum(sent for _, sent in rows.values())}
+    assignments = store.assignments()
+    assert sorted(assignments) == sorted(rows) and sorted(assignments.values()) == sorted(rows)
+    assert all(giver != receiver for giver, receiver in assignments.items())
+    # ready is every assignment that could be written now, except those the caller is telling themselves
+    planned = {name for name, in store.conn.execute("SELECT name FROM outbox WHERE kind = 'assignment'")}
+    expected = {giver for giver, receiver in assignments.items()
+                if rows[giver][0] and rows[receiver][0] and not rows[giver][1] and giver not in planned}
+    assert {giver for giver, _, _ in store.ready_assignments()} == expected - set(told)
+    for table, column in (('wishlists', 'name'), ('ready', 'giver'), ('late', 'giver'), ('outbox', 'name')):
+        assert {name for name, in store.conn.execute(f"SELECT {column} FROM {table}")} <= set(rows)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_change_roster_keeps_the_store_consistent(seed):
+    rng = random.Random(seed)
+    store = StateStore(':memory:')
+    store.reset(_game(rng, rng.randrange(3, 8)))
+    # someone whose assignment is mid-send counts as told too
+    giver = rng.choice(list(store.assignments()))
+    store.plan_message('assignment', giver, f'<{giver}@example.com>', b'Subject: hi\n\nhi\n')
+    store.dequeue_ready([giver])
+    store.claim([f'<{giver}@example.com>'], 'run', 0, 600)
+    _check(store)
+    before = store.assignments()
+    revisions = store.revisions()
+
+    if rng.random() < 0.5:
+        changes = add_participant(before, 'new', rng=rng)
+        told = store.change_roster(changes, joined=('new', 'new@example.com', None))
+    else:
+        left = rng.choice(list(before))
+        changes = remove_participant(before, left, rng=rng)
+        told = store.change_roster(changes, left=left)
+        assert store.participant(left) is None
+    _check(store, told)
+
+    for giver in changes:
+        if giver == 'new':
+            continue
+        # their old emails are gone, and whatever replaces them has a new Message-ID
+        assert store.message_status('assignment', giver) is None
+        assert store.revisions()[giver] == revisions.get(giver, 0) + 1
+        assert not store.participant(giver)['assignment_sent']
+    assert all(store.assignments()[giver] == receiver for giver, receiver in before.items()
+               if giver in store.assignments() and giver not in changes)
+
+    # and it stays consistent as the game carries on, once the caller has written the new assignments it tells
+    for giver in told:
+        store.plan_message('assignment', giver, f'<{giver}-again@example.com>', b'Subject: hi\n\nhi\n')
+    for name, _, received in store.roster():
+        if not received:
+            store.record_wishlist(name, 'a late wishlist')
+            break
+    _check(store)
+    store.close()
@@ -0,0 +1,76 @@
+from email import message_from_bytes, policy
+from email.header import decode_header, make_header
+from email.utils import getaddresses
+
+import pytest
+
+from santa_templates import MAX_LINE, MessageTemplate, load
+
+LONG_ADDRESS = 'averyveryverylongaddress.name@subdomain.example-long-domain.com'
+
+RECIPIENTS = [
+    ('alice@example.com', 'alice@example.com', ''),
+    (LONG_ADDRESS, LONG_ADDRESS, ''),
+    ('"Doe, John" <john@example.com>', 'john@example.com', 'Doe, John'),
+    ('Zoë Ünïcödé <zoe@example.com>', 'zoe@example.com', 'Zoë Ünïcödé'),
+    (f'Zoë With A Really Quite Remarkably Long Display Name <{LONG_ADDRESS}>', LONG_ADDRESS,
+     'Zoë With A Really Quite Remarkably Long Display Name'),
+    (f'Plain Long Display Name For Someone <{LONG_ADDRESS}>', LONG_ADDRESS, 'Plain Long Display Name For Someone'),
+]
+
+SUBJECTS = ['Hi $name', 'Hi $name, ' + 'a long subject line ' * 6, 'Für $name 🎅', 'Für $name 🎅 ' * 10]
+
+
+def _decoded(value):
+    return str(make_header(decode_header(str(value))))
+
+
+@pytest.mark.parametrize('recipient, address, display', RECIPIENTS)
+@pytest.mark.parametrize('subject', SUBJECTS)
+@pytest.mark.parametrize('message_policy', [policy.compat32, policy.default])
+def test_round_trip(recipient, address, display, subject, message_policy):
+    template = MessageTemplate(f"Subject: {subject}\n\nDear $name,\n$wishlist\n", reply_to='bot@example.com')
+    values = {'name': 'Zoë', 'wishlist': 'socks'}
+    raw = template.render(recipient, '<santa-test@example.com>', **values)
+
+    msg = message_from_bytes(raw, policy=message_policy)
+    # what the transport sends to, see MailSession.send_message()
+    assert [(_decoded(name), addr) for name, addr in getaddresses([str(value) for value in msg.get_all('To')])] == \
+        [(display, address)]
+    assert getaddresses([str(msg['Reply-To'])]) == [('', 'bot@example.com')]
+    expected_subject, expected_body = template.text(**values)
+    assert _decoded(msg['Subject']) == expected_subject
+    assert msg['Message-ID'] == '<santa-test@example.com>'
+    assert msg.get_payload(decode=True).decode('utf-8') == expected_body
+
+
+def test_header_lines_stay_short_unless_an_address_cant_fold():
+    template = MessageTemplate("Subject: " + "Für dich 🎅 " * 20 + "\n\nHello\n")
+    raw = template.render('Zoë With A Really Quite Remarkably Long Display Name <alice@example.com>')
+    head = raw.split(b'\n\n', 1)[0]
+    assert all(len(line) <= MAX_LINE for line in head.split(b'\n'))
+
+
+def test_body_encoding():
+    template = MessageTemplate("Subject: Hi\n\n$text\n")
+    plain = message_from_bytes(template.render('a@example.com', text='socks'))
+    assert plain['Content-Transfer-Encoding'] == '7bit'
+    encoded = message_from_bytes(template.render('a@example.com', text='chaussettes à rayures'))
+    assert encoded['Content-Transfer-Encoding'] == 'base64'
+    assert encoded.get_payload(decode=True).decode('utf-8') == 'chaussettes à rayures\n'
+
+
+def test_dollar_without_field_is_kept():
+    assert MessageTemplate("Subject: Hi\n\nUnder $10, $$ and $name\n").text(name='bob')[1] == \
+        "Under $10, $ and bob\n"
+
+
+def test_shipped_templates_render():
+    for name, values in (('wishlist_request', {}),
+                         ('assignment', {'receiver': 'Bob', 'wishlist': 'socks'}),
+                         ('late_wishlist', {'person': 'Bob', 'wishlist': 'socks'}),
+                         ('reassignment', {'receiver': 'Bob', 'wishlist': 'socks'}),
+                         ('reassignment_no_wishlist', {'receiver': 'Bob'})):
+        msg = message_from_bytes(load(name).render('alice@example.com', **values), policy=policy.default)
+        assert msg['To'].addresses[0].addr_spec == 'alice@example.com'
+        assert 'Bob' in msg['Subject'] or name == 'wishlist_request'
@@ -1,14 +1,25 @@
-import random
-import copy
-import smtplib
-from email.message import EmailMessage
 import json
+import os
+
+# The mail session, matcher and templates are shared with the wishlist-gated version. Install them once with
+# "pip install ." from the top of the repository (see README.md).
+from santa_async import send_concurrently, print_report, make_accounts
+from santa_mail import build_message, read_accounts
+from santa_transport import transport_from_config
+from santa_matching import make_matches
+from santa_templates import load as load_template
+
+# This script's own emails, next to it rather than with the wishlist-gated version's
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 
 with open("email_auth.json") as f:
     # Read in the auth for your mail account (tested with gmail app password only)
     email_auth = json.load(f)
-    gmail_username = email_auth['gmail_username']
-    gmail_app_password = email_auth['gmail_app_password']
+    # extra sending accounts can be listed under "accounts", concurrent sends are shared across all of them
+    accounts = read_accounts(email_auth)
+    gmail_username = accounts[0]['username']
+    gmail_app_password = accounts[0]['password']
+    transport, transport_options = transport_from_config(email_auth)
 
 def mailer(recipient, message, sender="santabot9000", subject="Secret Santa"):
     """
@@ -19,71 +30,49 @@ def mailer(recipient, message, sender="santabot9000", subject="Secret Santa"):
     :param subject: email subject
     :return: None
     """
-    msg = EmailMessage()
-    msg.set_content(message)
-    msg['Subject'] = subject
-    msg['From'] = sender
-    msg['To'] = recipient
-    server = smtplib.SMTP('smtp.gmail.com', 25)
-    server.connect('smtp.gmail.com', 587)
-    server.ehlo()
-    server.starttls()
-    server.ehlo()
-    server.login(gmail_username, gmail_app_password)
-    server.send_message(msg)
-    server.quit()
-    
-
-def make_matches(email_dict, blocked_matches=()):
-    """
-    Randomise a list of participants and match them into giver:receiver pairs, ensuring that no-one is assigned
-    themselves and that (optionally) certain pairings are blocked
-    :param email_dict: Dictionary of participants and their details. We only use the keys of this dict
-    :param blocked_matches: optional list of sets of blocked pairs in format ({'alice', 'bob'}) where we don't want
-    Alice or Bob to be assigned each other
-    :return: list of tuples in format [(giver, receiver)]
-    """
-    candidates = list(email_dict.keys())
-    receivers = copy.copy(candidates)
-    random.shuffle(receivers)
-    pairs = []
-    for giver, receiver in zip(candidates, receivers):
-        if giver == receiver:
-            # we can't have someone send a gift to themselves!
-            print(f"self santa detected! {giver} buys for {receiver}. Retrying")
-            return False
-        if {giver, receiver} in blocked_matches:
-            # note that blocked_matches is empty by default. Santa only cheats if you tell him to!
-            print(f"undesirable secret santa detected! {giver} buys for {receiver}. Retrying")
-            return False
-        pairs.append((giver, receiver))
-    return pairs
+    with transport(gmail_username, gmail_app_password, **transport_options) as session:
+        session.send(recipient, message, sender=sender, subject=subject)
 
 
   
-def mail_invites(email_dict, matches, dry_run=True):
+def mail_invites(email_dict, matches, dry_run=True, concurrent=False):
     """
     Function to send emails to secret santa participants. You may wish to make some edits to the msg format string
     :param email_dict: A dictionary of participant names, emails and (optionally) wishlists
     :param matches: A list of tuples matching participants in format ((giver, receiver))
     :param dry_run: if True, does not send emails, just prints them. If False will send emails and not print (for anonymity)
+    :param concurrent: if True, send over several rate-limited connections at once (for big groups)
     :return: None
     """
     if dry_run:
         print("matches successful!")
         for giver, receiver in matches:
             print(f"{giver.capitalize()} will buy for {receiver.capitalize()}")
-    for giver, receiver in matches:
-        giver_dict = email_dict[giver]
-        receiver_dict = email_dict[receiver]
-        msg = f"Ho ho ho {giver.capitalize()} 🎄\n\nYour assigned secret santa is {receiver.capitalize()} 🎅."
-        if 'wishlist' in receiver_dict.keys():
-            msg += f"\n\nThey have requested the following: {receiver_dict['wishlist']}"
-        if dry_run:
-            print(f"DRY RUN Would send email to {giver_dict['email']}, message:\n\n{msg}\n\n")
-        else:
-            mailer(giver_dict['email'], msg)
-            print(f"sent mail to {giver_dict['email']}")
+    # The emails are templates/invite.txt and invite_wishlist.txt
+    letter = load_template('invite', sender="santabot9000", directory=TEMPLATE_DIR)
+    wishlist_letter = load_template('invite_wishlist', sender="santabot9000", directory=TEMPLATE_DIR)
+    outgoing = []
+    # one login for the whole batch, the session only connects once we actually send something
+    with transport(gmail_username, gmail_app_password, **transport_options) as session:
+        for giver, receiver in matches:
+            giver_dict = email_dict[giver]
+            receiver_dict = email_dict[receiver]
+            values = {'giver': giver.capitalize(), 'receiver': receiver.capitalize()}
+            if 'wishlist' in receiver_dict.keys():
+                subject, msg = wishlist_letter.text(wishlist=receiver_dict['wishlist'], **values)
+            else:
+                subject, msg = letter.text(**values)
+            if dry_run:
+                print(f"DRY RUN Would send email to {giver_dict['email']}, message:\n\n{msg}\n\n")
+            elif concurrent:
+                outgoing.append((giver_dict['email'], build_message(giver_dict['email'], msg, sender="santabot9000",
+                                                                    subject=subject)))
+            else:
+                session.send(giver_dict['email'], msg, sender="santabot9000", subject=subject)
+                print(f"sent mail to {giver_dict['email']}")
+    if outgoing:
+        senders = make_accounts(accounts, session_class=transport, **transport_options)
+        print_report(send_concurrently(outgoing, senders))
 
 
 
@@ -102,9 +91,8 @@ def secret_santa():
         {'chris', 'evan'},
     )
 
-    matches = False
-    while not matches:
-        matches = make_matches(participants, blocked_matches=undesired_matches)
+    # make_matches only gives up when the blocked pairs make a valid assignment impossible
+    matches = make_matches(participants, blocked_matches=undesired_matches)
     if matches:
         mail_invites(participants, matches, dry_run=dry_run)
     else: